@@ -5,6 +5,7 @@ from scipy import signal
 import scipy
 import math
 from scipy.special import eval_chebyu
+import fixed_point as fxp
 
 
 def bindigits(n, bits):
@@ -12,7 +13,7 @@ def bindigits(n, bits):
     Takes an integer value and number of bits, and converts to two's complement string
     Basically just masks off the number of bits. Python twos-complement are infinite length (...111111111101, for example)
     """
-    s = bin(n & int("1"*bits, 2))[2:] # The [2:] cuts off the 0b of 0b######
+    s = bin(n & fxp.qmask(bits))[2:] # The [2:] cuts off the 0b of 0b######
     return ("{0:0>%s}" % (bits)).format(s)
 
 def twos_complement_integer(n, bits):
@@ -37,7 +38,7 @@ def convert_to_fixed_point(a, a_int, a_frac, allow_overflow=False):
         a_temp = twos_complement_integer(a_temp, a_int+a_frac)
         # print("%s = %s"%(a_temp, bin(a_temp)))
         # print(bin(a_temp))
-    a_temp = a_temp & int("1"*(a_int+a_frac), 2)
+    a_temp = a_temp & fxp.qmask(a_int+a_frac)
     return a_temp
 
 def convert_from_fixed_point(a, a_int, a_frac, twos_complement=True):
@@ -62,29 +63,23 @@ def convert_from_fixed_point(a, a_int, a_frac, twos_complement=True):
     return a_temp
 
 def manual_fir_section_convert(coeffs, x, coeff_int, coeff_frac, data_int, data_frac, out_int=22, out_frac=26):
+    # Array version, see fixed_point.py. Each set of coefficients is an FIR in series.
+    # Products are signed Q<coeff_int+data_int>.<coeff_frac+data_frac>, then floored
+    # to Q<out_int>.<out_frac>. In the firmware overflow is clipped off, so we wrap.
     for coeff_set in coeffs:
         for c in coeff_set:
             if(c >= 2**18 or c < -1*(2**18)):
-                raise Exception("Coefficient out of bounds")    
-    x = np.array(x)
-    y = np.zeros(len(x))
+                raise Exception("Coefficient out of bounds")
+    x = np.array(x, dtype=np.float64)
     for coeff_set in coeffs:
-        for i in range(len(coeff_set), len(x)):
-            total = 0
-            for j in range(len(coeff_set)):
-                c = convert_to_fixed_point(coeff_set[j], coeff_int, coeff_frac)
-                x_point = convert_to_fixed_point(x[i-j], data_int, data_frac)
-                total += c * x_point
-            # get actual value after fixed point math
-            y[i] = convert_from_fixed_point(total, coeff_int + data_int, coeff_frac+data_frac)
-            # Reduce to precision of output. In the firmware overflow is clipped off
-            val = convert_to_fixed_point(y[i], out_int, out_frac, allow_overflow=True)
-            y[i] = convert_from_fixed_point(val, out_int, out_frac)
-#             if(total>0):
-#                 print(total)
-#                 print(y[i])
-        x=np.copy(y)
-        y=np.zeros(len(x))
+        c = fxp.quantize(coeff_set, coeff_int, coeff_frac)
+        x_raw = np.zeros(len(x), dtype=np.int64)
+        # Sample 0 never enters the sum, so don't bounds check it either
+        x_raw[1:] = fxp.quantize(x[1:], data_int, data_frac)
+        total = fxp.fir_fixed_point(c, x_raw)
+        y = fxp.requantize(total, coeff_frac+data_frac, out_frac)
+        y = fxp.wrap(y, out_int+out_frac)
+        x = fxp.dequantize(y, out_frac)
     return x
 
 def get_f_coeffs(samp_per_clock, mag, angle): # CHANGED 2/17
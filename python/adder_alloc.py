@@ -0,0 +1,251 @@
+import argparse
+import copy
+import itertools
+import pickle
+
+import beam_table
+import process_jjb
+
+# Sub-beam (adder) allocation for beamform_trigger_v3.
+#
+# process_jjb.transform_adders keeps one adder per distinct delay tuple in the
+# pickle and only moves the smallest offset into it. But an adder is really only
+# a *shape*: beams whose left delays are (3,5,7) and (6,8,10) can share the adder
+# (3,5,7), the second one taking it with an offset of 3 out of the left store.
+# And a beam is only defined up to a common delay on all 8 antennas, which is
+# used to line up the top pairs (the top adders have no store, so those have to
+# match exactly).
+#
+# The tradeoff is adders vs. store depth: one adder per shape needs the biggest
+# offsets, splitting a shape into several adders keeps the offsets (and the left/
+# right stores) short. allocate() does the minimum number of adders for a given
+# maximum offset (greedy interval cover, which is optimal for that), optimize()
+# sweeps the left/right offset limits and keeps the cheapest by resources().
+#
+# Depths are the smallest the HDL slicing allows, (DEPTH-1)*8 >= delay, which is
+# one less than process_jjb's formula when the delay is a multiple of 8. SKEWED_TOP
+# isn't considered, the delays here are the unskewed ones.
+
+LEFT_CHANNELS = (5, 6, 7)
+RIGHT_CHANNELS = (1, 2, 3)
+TOP_CHANNELS = (0, 4)
+
+# Resource estimate per unit, UltraScale+. A sub-beam is 8 ternary adders of
+# 7 bits (a LUT and a FF per bit). The sample store is registered (PIPE TRUE) and
+# holds 8 channels x 8 samples x 5 bits per clock, the left/right stores aren't
+# (PIPE FALSE) and hold 8 x 7 bits per clock per adder. The beams themselves
+# cost the same whatever the allocation, so they aren't counted.
+SUB_BEAM_LUTS = 8*7
+SUB_BEAM_FFS = 8*7
+SAMPLE_STORE_FFS = 8*8*5
+BEAM_STORE_FFS = 8*7
+# a CLB has 8 LUTs and 16 FFs
+FF_WEIGHT = 0.5
+
+def beam_delays(b):
+    """ Total (left, right, top) delays of a process_jjb beam dictionary. top is None if unused """
+    left = tuple(d + b['LeftOffset'] for d in b['LeftDelays'])
+    right = tuple(d + b['RightOffset'] for d in b['RightDelays'])
+    top = tuple(d + b['TopOffset'] for d in b['TopDelays']) if b['TopDelays'] is not None else None
+    return left, right, top
+
+def beam_from_delays(delays, index, mask=0, top=True, el=None, az=None):
+    """ process_jjb beam dictionary from 8 per-channel delays, everything in the adders """
+    return { 'LeftDelays' : tuple(int(delays[c]) for c in LEFT_CHANNELS), 'LeftOffset' : 0,
+             'RightDelays' : tuple(int(delays[c]) for c in RIGHT_CHANNELS), 'RightOffset' : 0,
+             'TopDelays' : tuple(int(delays[c]) for c in TOP_CHANNELS) if top else None, 'TopOffset' : 0,
+             'Index' : index, 'L2Mask' : mask, 'El' : el, 'Az' : az }
+
+def load_beams(filename):
+    """ Beams as process_jjb dictionaries from any of the beam files we have:
+    the jjb pickles (LeftAdder/LeftOffset/...), the older (el, az, [8 delays]) and
+    ((el, az), ['A1', 'B4', ...]) pickles, or a beam CSV (elevation, azimuth, 8 delays).
+    The older formats have no L2 mask.
+    """
+    if filename.endswith(".csv"):
+        table = beam_table.load_table(filename)
+        raw = list(zip(table['elevation'].tolist(), table['azimuth'].tolist(), table['delays'].tolist()))
+    else:
+        with open(filename, 'rb') as f:
+            raw = pickle.load(f)
+    if len(raw) and isinstance(raw[0], dict):
+        return process_jjb.simplify_beams(raw)
+    beams = []
+    for i, r in enumerate(raw):
+        if isinstance(r[1], (list, tuple)) and len(r[1]) and isinstance(r[1][0], str):
+            # antenna names: letter is the channel, number the delay
+            delays = [ 0 ]*8
+            for name in r[1]:
+                delays[ord(name[0]) - ord('A')] = int(name[1:])
+            el, az = r[0]
+        else:
+            el, az, delays = r
+        beams.append(beam_from_delays(delays, i, el=float(el), az=float(az)))
+    return beams
+
+def store_depth(max_delay):
+    """ Smallest store depth that can reach max_delay samples back """
+    return -(-max_delay//8) + 1
+
+def normalize(beams):
+    """ Shifts each beam (all 8 antennas together) so its delays start as low as possible
+    while the top pairs with the same shape land on the same absolute delays.
+    Returns a list of (left, right, top) delay tuples.
+    """
+    delays = [ beam_delays(b) for b in beams ]
+    # top base for each top shape: enough that nothing in any of its beams goes negative
+    top_base = {}
+    for left, right, top in delays:
+        if top is None:
+            continue
+        shape = tuple(d - min(top) for d in top)
+        need = max(0, min(top) - min(left + right + top))
+        top_base[shape] = max(top_base.get(shape, 0), need)
+    out = []
+    for left, right, top in delays:
+        if top is None:
+            k = -min(left + right)
+        else:
+            k = top_base[tuple(d - min(top) for d in top)] - min(top)
+        shift = lambda t : tuple(d + k for d in t) if t is not None else None
+        out.append((shift(left), shift(right), shift(top)))
+    return out
+
+def cover(group_delays, max_offset):
+    """ Minimum adders for one side. group_delays is a list of delay tuples (one per beam).
+    Returns (adders, assignment) where assignment[i] = (adder index, offset) for beam i.
+    """
+    shapes = {}
+    for i, t in enumerate(group_delays):
+        base = min(t)
+        shapes.setdefault(tuple(d - base for d in t), []).append((base, i))
+    adders = []
+    assignment = [ None ]*len(group_delays)
+    for shape in sorted(shapes):
+        members = sorted(shapes[shape])
+        start = None
+        for base, i in members:
+            if start is None or base - start > max_offset:
+                start = base
+                adders.append(tuple(d + start for d in shape))
+            assignment[i] = (len(adders)-1, base - start)
+    return adders, assignment
+
+def top_adders(delays):
+    """ Top adders are exact (no top store). Returns (adders, delay tuple -> index) """
+    top = []
+    tidx = {}
+    for d in delays:
+        if d[2] is not None and d[2] not in tidx:
+            tidx[d[2]] = len(top)
+            top.append(d[2])
+    return top, tidx
+
+def assemble(delays, left_cover, right_cover, top_cover):
+    """ Package entries from normalized delays and the cover() results for each side """
+    left, la = left_cover
+    right, ra = right_cover
+    top, tidx = top_cover
+    return package_params(left, right, top,
+                          [ (la[i][0], ra[i][0], tidx[d[2]] if d[2] is not None else 255) for i, d in enumerate(delays) ],
+                          [ a[1] for a in la ], [ a[1] for a in ra ], [ 0 ]*len(delays))
+
+def allocate(beams, max_left_offset, max_right_offset):
+    """ Adder allocation with offsets limited to max_left_offset/max_right_offset.
+    Returns the adder/index/offset/depth entries of the pueo_beams package (same keys as
+    process_jjb's params).
+    """
+    delays = normalize(beams)
+    return assemble(delays,
+                    cover([ d[0] for d in delays ], max_left_offset),
+                    cover([ d[1] for d in delays ], max_right_offset),
+                    top_adders(delays))
+
+def package_params(left, right, top, indices, left_offsets, right_offsets, top_offsets):
+    max_delay = max(itertools.chain(*left, *right, *top))
+    left = process_jjb.pad_left_adders(left, right)
+    params = {}
+    params['NUM_BEAM'] = len(indices)
+    params['SAMPLE_STORE_DEPTH'] = store_depth(max_delay)
+    params['LEFT_ADDER_LEN'] = len(left)
+    params['LEFT_STORE_DEPTH'] = store_depth(max(left_offsets))
+    params['RIGHT_ADDER_LEN'] = len(right)
+    params['RIGHT_STORE_DEPTH'] = store_depth(max(right_offsets))
+    params['TOP_ADDER_LEN'] = len(top)
+    params['TOP_STORE_DEPTH'] = store_depth(max(top_offsets))
+    params['LEFT_ADDERS'] = left
+    params['RIGHT_ADDERS'] = right
+    params['TOP_ADDERS'] = top
+    params['BEAM_INDICES'] = indices
+    params['BEAM_LEFT_OFFSETS'] = left_offsets
+    params['BEAM_RIGHT_OFFSETS'] = right_offsets
+    params['BEAM_TOP_OFFSETS'] = top_offsets
+    return params
+
+def baseline(beams):
+    """ What process_jjb does now (transform_adders), for comparison """
+    beams = copy.deepcopy(beams)
+    left = process_jjb.transform_adders(set(b['LeftDelays'] for b in beams), 'LeftDelays', 'LeftOffset', beams, verbose=False)
+    right = process_jjb.transform_adders(set(b['RightDelays'] for b in beams), 'RightDelays', 'RightOffset', beams, verbose=False)
+    top = list(set(b['TopDelays'] for b in beams if b['TopDelays']))
+    indices = process_jjb.beam_adder_indices(beams, left, right, top)
+    return package_params(left, right, top, indices,
+                          [ b['LeftOffset'] for b in beams ],
+                          [ b['RightOffset'] for b in beams ],
+                          [ b['TopOffset'] for b in beams ])
+
+def resources(params):
+    """ LUT/FF estimate for the adders and stores of a pueo_beams parameter set """
+    # padding adders (package_params) aren't built
+    nleft = len(set(tuple(a) for a in params['LEFT_ADDERS']))
+    nsub = nleft + params['RIGHT_ADDER_LEN'] + params['TOP_ADDER_LEN']
+    luts = nsub*SUB_BEAM_LUTS
+    sub_ffs = nsub*SUB_BEAM_FFS
+    sample_ffs = params['SAMPLE_STORE_DEPTH']*SAMPLE_STORE_FFS
+    store_ffs = ((params['LEFT_STORE_DEPTH']-1)*nleft +
+                 (params['RIGHT_STORE_DEPTH']-1)*params['RIGHT_ADDER_LEN'])*BEAM_STORE_FFS
+    ffs = sub_ffs + sample_ffs + store_ffs
+    return { 'adders' : nsub,
+             'luts' : luts,
+             'ffs' : ffs,
+             'sample_store_ffs' : sample_ffs,
+             'beam_store_ffs' : store_ffs,
+             'cost' : luts + FF_WEIGHT*ffs }
+
+def optimize(beams, ff_weight=FF_WEIGHT):
+    """ Sweeps the left/right offset limits and returns (params, resources) for the cheapest
+    allocation (LUTs + ff_weight*FFs), ties going to fewer adders.
+    """
+    delays = normalize(beams)
+    span = lambda k : max(min(d[k]) for d in delays) - min(min(d[k]) for d in delays)
+    # the two sides only interact through the sample store depth, so cover each once per limit
+    lcovers = [ cover([ d[0] for d in delays ], lmax) for lmax in range(span(0)+1) ]
+    rcovers = [ cover([ d[1] for d in delays ], rmax) for rmax in range(span(1)+1) ]
+    tcover = top_adders(delays)
+    best = None
+    for lc in lcovers:
+        for rc in rcovers:
+            params = assemble(delays, lc, rc, tcover)
+            res = resources(params)
+            key = (res['luts'] + ff_weight*res['ffs'], res['adders'])
+            if best is None or key < best[0]:
+                best = (key, params, res)
+    return best[1], best[2]
+
+def print_summary(name, params, res):
+    print(f'{name}: {params["LEFT_ADDER_LEN"]}/{params["RIGHT_ADDER_LEN"]}/{params["TOP_ADDER_LEN"]} adders, '
+          f'sample/left/right store depth {params["SAMPLE_STORE_DEPTH"]}/{params["LEFT_STORE_DEPTH"]}/{params["RIGHT_STORE_DEPTH"]}, '
+          f'~{res["luts"]} LUTs / {res["ffs"]} FFs')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Optimize the sub-beam adder allocation for a beam map.")
+    parser.add_argument("infile", help="Beam file (pickle or CSV)")
+    parser.add_argument("--ff-weight", type=float, default=FF_WEIGHT, help="Cost of a FF relative to a LUT")
+    args = parser.parse_args()
+
+    beams = load_beams(args.infile)
+    print(f'adder_alloc: loaded {len(beams)} beam(s)')
+    base = baseline(beams)
+    print_summary('process_jjb', base, resources(base))
+    params, res = optimize(beams, args.ff_weight)
+    print_summary('optimized', params, res)
@@ -0,0 +1,182 @@
+import argparse
+
+import numpy as np
+
+import fixed_point as fxp
+from capture_reader import CaptureReader
+
+# Bit-accurate model of the per-channel AGC (hdl/agc_core.sv): the agc_dsp
+# scale/offset DSP, saturate_and_scale, and the square and probit
+# accumulators, over a whole (channels, samples) block of 12 bit data at once.
+#
+# agc_dsp : AD = dat<<8 + offset (offset Q8.8 signed, 27 bit preadder, wraps)
+#           P  = AD * scale      (scale 17 bit unsigned, Q_SCALE=12)
+#           the output LSB is P bit 23 (8 + 12 + 5 - 2): a scale of 4096 maps
+#           an input RMS of 32 to 4 output LSBs. en=False resets M, so P = 0.
+# saturate_and_scale : in bounds if P[47:27] is all 0s or all 1s, then
+#           out = { ~sign, P[26:24], P[23] | P[22] } (offset binary, code k
+#           is k-15.5), abs the symmetric magnitude (flip the bits if negative),
+#           gt = positive and P[26], lt = negative and !P[26]. Out of bounds
+#           saturates to 31 or 0 with abs 15 and gt or lt set.
+# accumulators, over one AGC cycle (131072/TIMESCALE_REDUCTION clocks):
+#           gt/lt : count of gt/lt flags over all 8 samples (21 bits)
+#           sq    : one abs value per clock (lfsr_rms_mux), accumulating
+#                   a(a+1)/2 from 16384/TIMESCALE_REDUCTION and read out shifted
+#                   up one, so it's the sum of (a+0.5)^2 (25 bits).
+#                   square_5bit_accumulator isn't in this tree, that's what its
+#                   reset value and the shift work out to.
+#
+# Note on the RMS mux: lfsr_rms_mux indexes its inputs with
+# in_i[NBITS*i % NBITS*NSAMP +: 4], which is ((4*i) % 4)*8 = 0 for every i, so
+# whatever the LFSR picks it always gets sample 0. That's the default here
+# (select=None); pass the per-clock sample select to model the intended mux.
+#
+# The pipeline latencies (6 clocks to out_o, 5 to the flags) aren't applied,
+# everything comes out aligned with the input. The readbacks are at
+# 0x4004 (sq), 0x4008 (gt), 0x400C (lt), 0x4010 (scale), 0x4014 (offset).
+
+NSAMP = 8
+DAT_BITS = 12
+OFFSET_BITS = 16
+SCALE_BITS = 17
+Q_SCALE = 12
+Q_OFFSET = 8
+SCALE_IN = 5
+NFRAC_OUT = 2
+LSB = Q_OFFSET + Q_SCALE + SCALE_IN - NFRAC_OUT
+OBITS = 5
+PREADD_BITS = 27
+SQ_BITS = 25
+PR_BITS = 21
+AGC_CLOCKS = 131072
+# agc_wrapper's default
+TIMESCALE_REDUCTION = 4
+UNITY_SCALE = 1 << Q_SCALE
+OUT_LATENCY = 6
+FLAG_LATENCY = 5
+
+def agc_dsp(dat, scale, offset, en=True):
+    """ DSP P output for 12 bit data (..., nsamples). scale/offset are the raw register values
+    and broadcast against dat[..., 0] (e.g. one per channel as (nch, 1)).
+    """
+    dat = fxp.wrap(np.asarray(dat, dtype=np.int64), DAT_BITS)
+    offset = fxp.to_signed(np.asarray(offset, dtype=np.int64), OFFSET_BITS)
+    scale = np.bitwise_and(np.asarray(scale, dtype=np.int64), fxp.qmask(SCALE_BITS))
+    ad = fxp.wrap((dat << Q_OFFSET) + offset, PREADD_BITS)
+    p = ad*scale
+    return np.where(en, p, 0)
+
+def saturate_and_scale(p, lsb=LSB):
+    """ (out, abs, gt, lt) from the DSP output """
+    p = np.asarray(p, dtype=np.int64)
+    sign = p < 0
+    in_bounds = np.isin(p >> (lsb + OBITS - 1), (0, -1))
+    base = (p >> lsb) & 0xF
+    sublsb = (p >> (lsb-1)) & 1
+    rounded = (base & 0xE) | (base & 1) | sublsb
+    out = np.where(in_bounds, np.where(sign, 0, 16) | rounded, np.where(sign, 0, 31))
+    mag = np.where(sign, ~rounded & 0xF, rounded)
+    absval = np.where(in_bounds, mag, 15)
+    top = (base >> 3).astype(bool)
+    gt = np.where(in_bounds, ~sign & top, ~sign)
+    lt = np.where(in_bounds, sign & ~top, sign)
+    return out.astype(np.uint8), absval.astype(np.uint8), gt, lt
+
+def agc_samples(dat, scale=UNITY_SCALE, offset=0, en=True):
+    """ The whole sample path for (nch, nsamples) data: dict of out, abs, gt, lt (same shape) """
+    dat = np.asarray(dat)
+    scale = np.asarray(scale).reshape(-1, 1) if np.ndim(scale) else scale
+    offset = np.asarray(offset).reshape(-1, 1) if np.ndim(offset) else offset
+    out, absval, gt, lt = saturate_and_scale(agc_dsp(dat, scale, offset, en))
+    return { 'out' : out, 'abs' : absval, 'gt' : gt, 'lt' : lt }
+
+def window_clocks(timescale_reduction=TIMESCALE_REDUCTION):
+    return AGC_CLOCKS // timescale_reduction
+
+def accumulate(absval, gt, lt, timescale_reduction=TIMESCALE_REDUCTION, select=None):
+    """ Accumulator readbacks for back to back AGC cycles starting at sample 0.
+    absval/gt/lt are (nch, nsamples) (agc_samples), only whole cycles are used.
+    select is the per-clock sample the RMS mux picks ((nclocks,) ints), None for the
+    HDL as it is (always sample 0).
+    Returns dict of sq, gt, lt, each (nch, ncycles), as read back.
+    """
+    n = window_clocks(timescale_reduction)
+    nch = absval.shape[0]
+    ncyc = absval.shape[1] // (NSAMP*n)
+    used = ncyc*n*NSAMP
+    a = absval[:, :used].reshape(nch, ncyc, n, NSAMP)
+    if select is None:
+        picked = a[..., 0]
+    else:
+        sel = np.asarray(select, dtype=np.int64)[:ncyc*n].reshape(ncyc, n)
+        picked = np.take_along_axis(a, np.broadcast_to(sel[np.newaxis, ..., np.newaxis], (nch, ncyc, n, 1)), axis=-1)[..., 0]
+    picked = picked.astype(np.int64)
+    sq = (16384 // timescale_reduction + (picked*(picked+1) >> 1).sum(axis=-1)) & fxp.qmask(SQ_BITS-1)
+    gts = gt[:, :used].reshape(nch, ncyc, n*NSAMP).sum(axis=-1) & fxp.qmask(PR_BITS)
+    lts = lt[:, :used].reshape(nch, ncyc, n*NSAMP).sum(axis=-1) & fxp.qmask(PR_BITS)
+    return { 'sq' : sq << 1, 'gt' : gts, 'lt' : lts }
+
+def run(dat, scale=UNITY_SCALE, offset=0, timescale_reduction=TIMESCALE_REDUCTION, select=None, en=True):
+    """ agc_samples + accumulate in one go. Returns (samples dict, readbacks dict) """
+    s = agc_samples(dat, scale, offset, en)
+    return s, accumulate(s['abs'], s['gt'], s['lt'], timescale_reduction, select)
+
+def run_chunks(chunks, scale=UNITY_SCALE, offset=0, timescale_reduction=TIMESCALE_REDUCTION, select=None):
+    """ Readbacks for a stream of (nch, n) chunks (CaptureReader.chunks style (pos, array) pairs or
+    plain arrays), cycle after cycle, carrying partial cycles over. Yields the readback dict
+    for each chunk's completed cycles. select, if given, is a function of the first clock
+    index -> per-clock selects for that many clocks.
+    """
+    cycle = NSAMP*window_clocks(timescale_reduction)
+    left = None
+    clock = 0
+    for c in chunks:
+        x = c[1] if isinstance(c, tuple) else c
+        x = np.asarray(x)
+        if left is not None:
+            x = np.concatenate((left, x), axis=1)
+        whole = (x.shape[1] // cycle)*cycle
+        left = x[:, whole:]
+        if whole:
+            s = agc_samples(x[:, :whole], scale, offset)
+            sel = select(clock, whole//NSAMP) if select is not None else None
+            yield accumulate(s['abs'], s['gt'], s['lt'], timescale_reduction, sel)
+            clock += whole//NSAMP
+
+def rms(sq, timescale_reduction=TIMESCALE_REDUCTION):
+    """ RMS in output LSBs from the sq readback """
+    return np.sqrt(np.asarray(sq)/window_clocks(timescale_reduction))
+
+def compare(readbacks, recorded):
+    """ Model vs recorded readbacks, both dicts of equal-shape arrays. Returns the keys and
+    cycle indices that differ: { name : indices }.
+    """
+    out = {}
+    for k in ('sq', 'gt', 'lt'):
+        if k in recorded:
+            bad = np.flatnonzero(np.asarray(readbacks[k]).ravel() != np.asarray(recorded[k]).ravel())
+            if len(bad):
+                out[k] = bad
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a capture through the AGC model.")
+    parser.add_argument("capture", help="(channels, samples) .npy capture")
+    parser.add_argument("--scale", type=int, default=UNITY_SCALE, help="raw scale register (0x4010)")
+    parser.add_argument("--offset", type=int, default=0, help="raw offset register (0x4014)")
+    parser.add_argument("--timescale-reduction", type=int, default=TIMESCALE_REDUCTION)
+    parser.add_argument("--channels", type=int, nargs="+", default=None)
+    parser.add_argument("--readbacks", default=None, help="CSV of recorded sq,gt,lt per cycle (one channel) to compare against")
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.capture)
+    chunk = 16*NSAMP*window_clocks(args.timescale_reduction)
+    parts = list(run_chunks(reader.chunks(chunk, args.channels), args.scale, args.offset, args.timescale_reduction))
+    rb = { k : np.concatenate([ p[k] for p in parts ], axis=1) for k in ('sq', 'gt', 'lt') }
+    for i in range(rb['sq'].shape[1]):
+        print(f'cycle {i}: ' + "  ".join(f'sq {rb["sq"][c, i]} gt {rb["gt"][c, i]} lt {rb["lt"][c, i]}' for c in range(rb['sq'].shape[0])))
+    if args.readbacks is not None:
+        rec = np.genfromtxt(args.readbacks, delimiter=",", names=True, dtype=np.int64)
+        n = len(rec)
+        diff = compare({ k : rb[k][0, :n] for k in rb }, { k : rec[k] for k in ('sq', 'gt', 'lt') })
+        print('agc_model: matches the readbacks' if not diff else f'agc_model: differs at {diff}')
@@ -0,0 +1,213 @@
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import signal
+
+import agc_model
+import fixed_point as fxp
+import trigger_loop
+import trigger_mc
+from capture_reader import CaptureReader
+
+# Closed loop model of the AGC servo in trigger_chain_wrapper (AGC_CONTROL =
+# "TRUE"), run over many channels and many (scale delta, offset delta)
+# settings at once.
+#
+# Per AGC cycle the wrapper resets the AGC, runs one accumulation, reads
+# 0x00-0x14 back and then
+#   ms = sq >> (17 - AGC_TIMESCALE_REDUCTION_BITS)     (mean of (abs+0.5)^2)
+#   ms > TARGET_RMS_SQUARED + RMS_SQUARE_SCALE_ERR : scale -= scale delta (if scale > 0x12C)
+#   ms < TARGET_RMS_SQUARED - RMS_SQUARE_SCALE_ERR : scale += scale delta (if scale < SCALE_MAX)
+#   gt > lt + OFFSET_ERR                           : offset -= offset delta
+#   lt > gt + OFFSET_ERR                           : offset += offset delta
+# writes scale/offset, loads and applies them, and starts again. The deltas
+# are the 0x40/0x44 controller registers (0x4040/0x4044). The Wishbone traffic
+# between cycles is a few hundred clocks, so cycles here are back to back. It
+# starts from STARTSCALE/STARTOFFSET.
+#
+# SCALE_MAX is trigger_chain_wrapper_1500's cutoff. trigger_chain_wrapper.sv
+# (and hdl_lf) has 0x1FBD0, and its offset branch assigns the *scale* register
+# from the offset one (agc_recalculated_scale_reg = info[5] -/+ scale delta),
+# so the offset never moves: offset_bug=True models that.
+#
+# The data is either a capture (CaptureReader, 12 bit) or gaussian noise whose
+# sigma/DC change at given cycles (the "noise environment change"). Groups of
+# settings run in parallel, each process going through the whole stream.
+
+TIMESCALE_REDUCTION_BITS = 4
+TARGET_RMS_SQUARED = 16
+RMS_SQUARE_SCALE_ERR = 0
+OFFSET_ERR = 5
+SCALE_DELTA = 30
+OFFSET_DELTA = 25
+STARTSCALE = 1500
+STARTOFFSET = 0
+SCALE_MIN = 0x12C
+SCALE_MAX = 0x4000
+SCALE_MAX_V1 = 0x1FBD0
+OFFSET_CUTOFF = 1000
+CONFIG_BLOCK = 8
+DAT_LIMIT = 1 << (agc_model.DAT_BITS - 1)
+
+def servo_step(scale, offset, sq, gt, lt, scale_delta, offset_delta, tr_bits=TIMESCALE_REDUCTION_BITS,
+               target=TARGET_RMS_SQUARED, scale_err=RMS_SQUARE_SCALE_ERR, offset_err=OFFSET_ERR,
+               scale_max=SCALE_MAX, offset_bug=False):
+    """ One AGC_MODULE_CALCULATING pass. Everything broadcasts (e.g. (nconfigs, nch) registers
+    and (nconfigs, 1) deltas). Returns the new (scale, offset) register values.
+    """
+    ms = sq >> (17 - tr_bits)
+    new_scale = np.where(ms > target + scale_err, np.where(scale > SCALE_MIN, scale - scale_delta, scale),
+                         np.where(ms < target - scale_err, np.where(scale < scale_max, scale + scale_delta, scale), scale))
+    if offset_bug:
+        # info[5] is zero extended, so $signed() of it is never negative
+        new_scale = np.where(gt > lt + offset_err, offset - scale_delta,
+                             np.where(lt > gt + offset_err, np.where(offset < OFFSET_CUTOFF, offset + scale_delta, offset), new_scale))
+        new_offset = offset
+    else:
+        new_offset = np.where(gt > lt + offset_err, offset - offset_delta,
+                              np.where(lt > gt + offset_err, offset + offset_delta, offset))
+    return new_scale & fxp.qmask(agc_model.SCALE_BITS), new_offset & fxp.qmask(agc_model.OFFSET_BITS)
+
+def synthetic_cycles(ncycles, clocks, nch=8, seed=0, levels=((0, 32.0, 0.0),), band=trigger_mc.BAND):
+    """ Generator of (nch, 8*clocks) 12 bit gaussian noise blocks, one per AGC cycle.
+    levels is a list of (first cycle, sigma, dc) in ADC counts, each holding until the next.
+    band=None is white noise.
+    """
+    rng = np.random.default_rng(seed)
+    levels = sorted(levels)
+    taps = trigger_mc.bandpass_taps(band) if band is not None else None
+    zi = None
+    if taps is not None:
+        zi = signal.lfilter(taps, 1.0, rng.standard_normal((nch, len(taps))), axis=1,
+                            zi=np.zeros((nch, len(taps)-1)))[1]
+    for k in range(ncycles):
+        _, sigma, dc = [ l for l in levels if l[0] <= k ][-1]
+        x = rng.standard_normal((nch, agc_model.NSAMP*clocks))
+        if taps is not None:
+            x, zi = signal.lfilter(taps, 1.0, x, axis=1, zi=zi)
+        yield np.clip(np.rint(x*sigma + dc), -DAT_LIMIT, DAT_LIMIT-1).astype(np.int16)
+
+def capture_cycles(filename, ncycles, clocks, channels=None, start=0):
+    """ Generator of (nch, 8*clocks) blocks from a capture, stopping at ncycles or the end """
+    reader = CaptureReader(filename)
+    n = agc_model.NSAMP*clocks
+    for k, (_, x) in enumerate(reader.chunks(n, channels, start)):
+        if k == ncycles or x.shape[1] < n:
+            break
+        yield x
+
+def _cycles(source, ncycles, clocks):
+    if 'capture' in source:
+        return capture_cycles(source['capture'], ncycles, clocks, source.get('channels'), source.get('start', 0))
+    return synthetic_cycles(ncycles, clocks, **source)
+
+def _run_block(args):
+    source, configs, ncycles, tr_bits, opts = args
+    tr = 1 << tr_bits
+    clocks = agc_model.window_clocks(tr)
+    sd = configs[:, 0:1]
+    od = configs[:, 1:2]
+    scale = offset = None
+    hist = None
+    for k, x in enumerate(_cycles(source, ncycles, clocks)):
+        if scale is None:
+            nch = x.shape[0]
+            scale = np.full((len(configs), nch), STARTSCALE, dtype=np.int64)
+            offset = np.full((len(configs), nch), STARTOFFSET, dtype=np.int64)
+            hist = { name : np.zeros((ncycles, len(configs), nch), dtype=np.int64) for name in ('sq', 'gt', 'lt', 'scale', 'offset') }
+        p = agc_model.agc_dsp(x[np.newaxis], scale[..., np.newaxis], offset[..., np.newaxis])
+        _, a, gt, lt = agc_model.saturate_and_scale(p)
+        n = a.shape[-1]
+        rb = agc_model.accumulate(a.reshape(-1, n), gt.reshape(-1, n), lt.reshape(-1, n), tr)
+        rb = { name : v.reshape(scale.shape) for name, v in rb.items() }
+        for name in rb:
+            hist[name][k] = rb[name]
+        hist['scale'][k] = scale
+        hist['offset'][k] = offset
+        scale, offset = servo_step(scale, offset, rb['sq'], rb['gt'], rb['lt'], sd, od, tr_bits, **opts)
+    # a capture can run out early
+    return { name : v[:k+1] for name, v in hist.items() }
+
+def simulate(source, configs, ncycles, tr_bits=TIMESCALE_REDUCTION_BITS, processes=None, **opts):
+    """ Runs the servo for every (scale delta, offset delta) row of configs over the same data.
+    source is {'capture' : filename, 'channels' : ..., 'start' : ...} or synthetic_cycles()
+    keywords. opts go to servo_step. processes=1 runs serially, None uses all the cores.
+    Returns a dict of sq, gt, lt, scale, offset, each (ncycles, nconfigs, nch): the readbacks of
+    each cycle and the registers it ran with.
+    """
+    configs = np.atleast_2d(np.asarray(configs, dtype=np.int64))
+    jobs = [ (source, configs[i:i+CONFIG_BLOCK], ncycles, tr_bits, opts) for i in range(0, len(configs), CONFIG_BLOCK) ]
+    if processes == 1 or len(jobs) == 1:
+        parts = list(map(_run_block, jobs))
+    else:
+        with Pool(min(processes or os.cpu_count() or 1, len(jobs))) as pool:
+            parts = pool.map(_run_block, jobs)
+    return { name : np.concatenate([ p[name] for p in parts ], axis=1) for name in parts[0] }
+
+def metrics(hist, step=0, tr_bits=TIMESCALE_REDUCTION_BITS, target=TARGET_RMS_SQUARED, tolerance=0.2, tail=None):
+    """ Per config and channel, from simulate():
+      settle     : cycles after cycle <step> until the mean square stays within tolerance*target
+      overshoot  : largest relative mean square error after it first crosses the target
+      rms        : steady state 5 bit RMS (LSBs, abs+0.5) over the last <tail> cycles
+      imbalance  : steady state (gt - lt)/(gt + lt) over the same cycles
+      settled    : fraction of channels settled per config
+    tail defaults to the last quarter after the step.
+    """
+    ms = hist['sq'][step:] >> (17 - tr_bits)
+    ncyc = ms.shape[0]
+    conv = trigger_loop.convergence(ms, np.full(ms.shape[1], target), tolerance)
+    tail = tail or max(ncyc//4, 1)
+    sq = hist['sq'][step:][-tail:]
+    gt = hist['gt'][step:][-tail:].astype(np.float64)
+    lt = hist['lt'][step:][-tail:].astype(np.float64)
+    conv['rms'] = agc_model.rms(sq, 1 << tr_bits).mean(axis=0)
+    conv['imbalance'] = ((gt - lt)/np.maximum(gt + lt, 1)).mean(axis=0)
+    return conv
+
+def sweep(source, scale_deltas, offset_deltas, ncycles, step=0, tr_bits=TIMESCALE_REDUCTION_BITS, processes=None,
+          tolerance=0.2, **opts):
+    """ Every combination of scale_deltas x offset_deltas. Returns (configs (n, 2), metrics, hist) """
+    sd, od = np.meshgrid(np.asarray(scale_deltas), np.asarray(offset_deltas), indexing='ij')
+    configs = np.stack((sd.ravel(), od.ravel()), axis=1).astype(np.int64)
+    hist = simulate(source, configs, ncycles, tr_bits, processes, **opts)
+    target = opts.get('target', TARGET_RMS_SQUARED)
+    return configs, metrics(hist, step, tr_bits, target, tolerance), hist
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep the AGC servo deltas over real or synthetic data.")
+    parser.add_argument("--capture", default=None, help="Capture (.npy) to run on instead of synthetic noise")
+    parser.add_argument("--channels", type=int, nargs="+", default=None)
+    parser.add_argument("--nch", type=int, default=8, help="Synthetic channels")
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--sigma", type=float, nargs=2, default=[32.0, 128.0], metavar=("BEFORE", "AFTER"), help="Synthetic noise sigma (ADC counts)")
+    parser.add_argument("--dc", type=float, nargs=2, default=[0.0, 0.0], metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--step", type=int, default=None, help="Cycle the synthetic noise changes at (default: halfway). Settling is measured from here.")
+    parser.add_argument("--white", action="store_true", help="Don't band limit the synthetic noise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale-deltas", type=int, nargs=3, default=[10, 100, 10], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--offset-deltas", type=int, nargs=3, default=[25, 25, 1], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--timescale-reduction-bits", type=int, default=TIMESCALE_REDUCTION_BITS)
+    parser.add_argument("--scale-max", type=lambda x : int(x, 0), default=SCALE_MAX)
+    parser.add_argument("--offset-bug", action="store_true", help="trigger_chain_wrapper.sv's offset branch (writes the scale)")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.capture is not None:
+        source = { 'capture' : args.capture, 'channels' : args.channels }
+        step = 0
+    else:
+        step = args.step if args.step is not None else args.cycles//2
+        source = { 'nch' : args.nch, 'seed' : args.seed, 'band' : None if args.white else trigger_mc.BAND,
+                   'levels' : [ (0, args.sigma[0], args.dc[0]), (step, args.sigma[1], args.dc[1]) ] }
+    sds = np.arange(args.scale_deltas[0], args.scale_deltas[1]+1, args.scale_deltas[2])
+    ods = np.arange(args.offset_deltas[0], args.offset_deltas[1]+1, args.offset_deltas[2])
+    configs, m, _ = sweep(source, sds, ods, args.cycles, step, args.timescale_reduction_bits, args.processes,
+                          args.tolerance, scale_max=args.scale_max, offset_bug=args.offset_bug)
+    worst = m['settle'].max(axis=1)
+    print(f'agc_servo: {len(configs)} settings, {np.mean(m["settled"] == 1)*100:.1f}% with every channel settled in {args.cycles - step} cycles')
+    for i in np.argsort(worst + m['overshoot'].max(axis=1)/1e3)[:10]:
+        print(f'scale delta {configs[i, 0]} offset delta {configs[i, 1]}: settles in {worst[i]} cycles, '
+              f'overshoot {m["overshoot"][i].max()*100:.0f}%, rms {m["rms"][i].mean():.2f}, imbalance {np.abs(m["imbalance"][i]).max():.3f}')
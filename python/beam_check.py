@@ -0,0 +1,137 @@
+import argparse
+import sys
+
+import numpy as np
+
+import adder_alloc
+import beam_files
+import beam_sky
+
+# Round trip check for the pueo_beams packages: rebuilds the per-antenna delay
+# of every beam from BEAM_INDICES, the adders and the offsets (what the HDL
+# actually does with them) and compares against the beam file the package was
+# made from, all beams at once. Nothing here needs a simulator, so it can run
+# right after process_jjb in the nightly build.
+#
+# Besides the delays it checks what the firmware slicing can reach: an adder
+# tap d comes out of the sample store at (SAMPLE_STORE_DEPTH-1)*8 - d, so
+# taps have to be in [0, (SAMPLE_STORE_DEPTH-1)*8], and the same for the beam
+# offsets and the left/right store depths. SKEWED_TOP moves the left/right taps
+# before they're sliced.
+#
+# By default a beam only has to match up to a common delay on all its antennas
+# (that's just latency); exact=True wants the same absolute delays.
+
+NSAMP = 8
+
+def store_problems(params, skewed_top=False):
+    """ Everything in the package the HDL can't do, as a list of strings """
+    problems = []
+    def check(bad, what):
+        bad = np.flatnonzero(bad)
+        if len(bad):
+            problems.append("%s: %s"%(what, bad.tolist()))
+    maxd = (params['SAMPLE_STORE_DEPTH']-1)*NSAMP
+    for kind, width in (('LEFT', 3), ('RIGHT', 3), ('TOP', 2)):
+        taps = np.array(params[kind + '_ADDERS'], dtype=np.int64).reshape(-1, width)
+        if params.get(kind + '_ADDER_LEN', len(taps)) != len(taps):
+            problems.append("%s_ADDER_LEN is %d but there are %d adders"%(kind, params[kind + '_ADDER_LEN'], len(taps)))
+        if skewed_top and kind != 'TOP':
+            taps = np.where(taps >= NSAMP, taps - NSAMP, taps)
+        check(np.any((taps < 0) | (taps > maxd), axis=1), "%s adder taps outside [0, %d] (SAMPLE_STORE_DEPTH %d)"%(kind.lower(), maxd, params['SAMPLE_STORE_DEPTH']))
+    # beamform_trigger_v3 declares right_store[NUM_LEFT_ADDERS-1:0]
+    nleft = params.get('LEFT_ADDER_LEN', len(params['LEFT_ADDERS']))
+    nright = params.get('RIGHT_ADDER_LEN', len(params['RIGHT_ADDERS']))
+    if nright > nleft:
+        problems.append("RIGHT_ADDER_LEN %d is more than LEFT_ADDER_LEN %d (right_store only has LEFT_ADDER_LEN entries)"%(nright, nleft))
+    nb = params['NUM_BEAM']
+    idx = np.array(params['BEAM_INDICES'], dtype=np.int64).reshape(-1, 3)
+    if len(idx) < nb:
+        problems.append("only %d BEAM_INDICES for %d beams"%(len(idx), nb))
+        return problems
+    idx = idx[:nb]
+    check(idx[:, 0] >= len(params['LEFT_ADDERS']), "beams using a left adder that doesn't exist")
+    check(idx[:, 1] >= len(params['RIGHT_ADDERS']), "beams using a right adder that doesn't exist")
+    check((idx[:, 2] >= len(params['TOP_ADDERS'])) & (idx[:, 2] != beam_files.NO_ADDER), "beams using a top adder that doesn't exist")
+    for kind in ('LEFT', 'RIGHT', 'TOP'):
+        name = 'BEAM_%s_OFFSETS'%kind
+        if name not in params:
+            continue
+        off = np.array(params[name][:nb], dtype=np.int64)
+        maxo = (params[kind + '_STORE_DEPTH']-1)*NSAMP
+        check((off < 0) | (off > maxo), "%s offsets outside [0, %d] (%s_STORE_DEPTH %d)"%(kind.lower(), maxo, kind, params[kind + '_STORE_DEPTH']))
+    return problems
+
+def mappable(params):
+    """ True if beam_files.beam_map can rebuild the beams: a BEAM_INDICES entry for every beam,
+    each pointing at a left and right adder that exists
+    """
+    nb = params['NUM_BEAM']
+    idx = np.array(params['BEAM_INDICES'], dtype=np.int64).reshape(-1, 3)
+    if len(idx) < nb:
+        return False
+    idx = idx[:nb]
+    return bool(np.all(idx[:, 0] < len(params['LEFT_ADDERS'])) and np.all(idx[:, 1] < len(params['RIGHT_ADDERS'])))
+
+def compare(bmap, delays, used, masks=None, exact=False):
+    """ Compares a beam map against source delays/used ((nbeams, 8) each) and optionally the
+    source L2 masks. Returns a list of strings, empty if everything matches.
+    """
+    problems = []
+    if bmap['nbeams'] != len(delays):
+        problems.append("package has %d beams, source has %d"%(bmap['nbeams'], len(delays)))
+    n = min(bmap['nbeams'], len(delays))
+    pd, pu = bmap['delays'][:n], bmap['used'][:n]
+    sd, su = np.asarray(delays)[:n], np.asarray(used)[:n]
+    bad_used = np.flatnonzero(np.any(pu != su, axis=1))
+    if len(bad_used):
+        problems.append("different antennas used in beam(s) %s"%bad_used.tolist())
+    if not exact:
+        big = np.iinfo(np.int64).max
+        pd = pd - np.where(pu, pd, big).min(axis=1, keepdims=True)
+        sd = sd - np.where(su, sd, big).min(axis=1, keepdims=True)
+    bad = np.any((pd != sd) & pu & su, axis=1)
+    bad[bad_used] = False
+    for b in np.flatnonzero(bad):
+        problems.append("beam %d: package %s, source %s"%(b, pd[b].tolist(), sd[b].tolist()))
+    if masks is not None and bmap['meta'] is not None:
+        pm = np.zeros(n, dtype=np.int64)
+        for bit, beams in enumerate(bmap['meta']):
+            beams = np.array([ b for b in beams if b < n ], dtype=np.int64)
+            pm[beams] |= 1 << bit
+        bad_mask = np.flatnonzero(pm != np.asarray(masks)[:n])
+        if len(bad_mask):
+            problems.append("L2 mask (META bits) differ in beam(s) %s"%bad_mask.tolist())
+    return problems
+
+def check_package(package, source, nontop_delay=0, skewed_top=False, exact=False):
+    """ All the problems with a package (file name or parsed params) against its source beam
+    file (anything adder_alloc.load_beams reads). Empty list if it round trips.
+    """
+    params = beam_files.parse_file(package) if isinstance(package, str) else package
+    problems = store_problems(params, skewed_top)
+    if not mappable(params):
+        return problems
+    bmap = beam_files.beam_map(params, nontop_delay, skewed_top)
+    beams = adder_alloc.load_beams(source)
+    delays, used, _, _ = beam_sky.beam_arrays(beams)
+    masks = [ b['L2Mask'] for b in beams ]
+    # the old pickles and the CSVs don't have masks
+    if not any(masks):
+        masks = None
+    return problems + compare(bmap, delays, used, masks, exact)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that a pueo_beams package reproduces its source beam delays.")
+    parser.add_argument("package", help="pueo_beams package (.sv)")
+    parser.add_argument("source", help="Beam file it was made from (pickle or CSV)")
+    parser.add_argument("--nontop-delay", type=int, default=0, help="Samples of delay the package assumes on the non-top channels (8 for the 11/06 packages)")
+    parser.add_argument("--skewed-top", action="store_true", help="The package is for SKEWED_TOP")
+    parser.add_argument("--exact", action="store_true", help="Require the same absolute delays, not just the same beams")
+    args = parser.parse_args()
+
+    problems = check_package(args.package, args.source, args.nontop_delay, args.skewed_top, args.exact)
+    for p in problems:
+        print(p)
+    print(f'beam_check: {args.package}: ' + ('OK' if not problems else f'{len(problems)} problem(s)'))
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,94 @@
+import argparse
+import csv
+import glob
+import os
+from multiprocessing import Pool
+
+import adder_alloc
+import beam_check
+import process_jjb
+
+# Batch front end for process_jjb: compiles every candidate beam map in a
+# directory to a pueo_beams package, in parallel, and summarizes what each one
+# costs. Beam-search studies produce thousands of maps, so the per-map work
+# (process_jjb.compile_params) is all dictionary lookups, linear in the number
+# of beams.
+
+SUMMARY_FIELDS = [ 'file', 'beams', 'left_adders', 'right_adders', 'top_adders',
+                   'sample_store_depth', 'left_store_depth', 'right_store_depth',
+                   'luts', 'ffs' ]
+
+def compile_file(infile, outfile=None, optimize=False):
+    """ Compiles one beam file (anything adder_alloc.load_beams reads). Writes the package
+    to outfile if given. Returns (params, summary). Anything beam_check.store_problems
+    finds in the package goes in the summary's 'error'.
+    """
+    beams = adder_alloc.load_beams(infile)
+    params = process_jjb.compile_params(beams, optimize, verbose=False)
+    if outfile is not None:
+        process_jjb.write_package(params, outfile)
+    res = adder_alloc.resources(params)
+    summary = { 'file' : os.path.basename(infile),
+                'beams' : params['NUM_BEAM'],
+                'left_adders' : params['LEFT_ADDER_LEN'],
+                'right_adders' : params['RIGHT_ADDER_LEN'],
+                'top_adders' : params['TOP_ADDER_LEN'],
+                'sample_store_depth' : params['SAMPLE_STORE_DEPTH'],
+                'left_store_depth' : params['LEFT_STORE_DEPTH'],
+                'right_store_depth' : params['RIGHT_STORE_DEPTH'],
+                'luts' : res['luts'],
+                'ffs' : res['ffs'] }
+    problems = beam_check.store_problems(params)
+    if problems:
+        summary['error'] = "; ".join(problems)
+    return params, summary
+
+def _compile_job(args):
+    infile, outfile, optimize = args
+    try:
+        return compile_file(infile, outfile, optimize)[1]
+    except Exception as e:
+        # one bad candidate shouldn't take down the batch
+        return { 'file' : os.path.basename(infile), 'error' : str(e) }
+
+def compile_directory(indir, outdir=None, optimize=False, processes=None, pattern="*.pkl"):
+    """ Compiles every file matching pattern in indir. Packages go to outdir (same name,
+    .sv) if given. processes=1 runs serially, None uses all the cores.
+    Returns the summaries in file name order; failed files, and packages beam_check finds
+    problems in, have an 'error' entry.
+    """
+    files = sorted(glob.glob(os.path.join(indir, pattern)))
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    outname = lambda f : os.path.join(outdir, os.path.splitext(os.path.basename(f))[0] + ".sv") if outdir is not None else None
+    jobs = [ (f, outname(f), optimize) for f in files ]
+    if processes == 1:
+        return list(map(_compile_job, jobs))
+    with Pool(processes) as pool:
+        return pool.map(_compile_job, jobs, chunksize=max(1, len(jobs)//(4*(processes or os.cpu_count() or 1))))
+
+def write_summary(summaries, filename):
+    # the errors have commas in them
+    with open(filename, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(SUMMARY_FIELDS + [ 'error' ])
+        for s in summaries:
+            w.writerow([ s.get(k, '') for k in SUMMARY_FIELDS + [ 'error' ] ])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile a directory of beam maps to pueo_beams packages.")
+    parser.add_argument("indir", help="Directory of beam files")
+    parser.add_argument("--outdir", default=None, help="Write the packages here")
+    parser.add_argument("--pattern", default="*.pkl")
+    parser.add_argument("--optimize", action="store_true", help="reallocate the adders with adder_alloc")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--summary", default=None, help="Write a CSV summary here")
+    args = parser.parse_args()
+
+    summaries = compile_directory(args.indir, args.outdir, args.optimize, args.processes, args.pattern)
+    failed = [ s for s in summaries if 'error' in s ]
+    print(f'beam_compiler: compiled {len(summaries)-len(failed)} of {len(summaries)} beam map(s)')
+    for s in failed:
+        print(f'{s["file"]}: {s["error"]}')
+    if args.summary is not None:
+        write_summary(summaries, args.summary)
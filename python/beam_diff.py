@@ -0,0 +1,155 @@
+import argparse
+import collections
+import sys
+
+import numpy as np
+
+import beam_files
+
+# Compares two beam files (any of the formats beam_files reads, the two don't
+# have to be the same format). Beams are compared by their per-antenna delays
+# with each beam's smallest used delay taken out, since a common delay on all
+# the antennas of a beam doesn't change it. Also reports beams that just moved
+# to another index, how the adders and their reuse changed, store depths, and
+# which beams each META bit covers. Adders are compared the same way, with
+# their smallest tap taken out: where the delay sits between an adder's taps
+# and the beam offsets (or a nontop_delay) is up to whoever built the package,
+# so (0,2,5) and (8,10,13) are the same adder.
+
+def adder_reuse(bmap):
+    """ kind -> (number of adders, number of adders actually used, most beams on one adder) """
+    out = {}
+    for kind, adders in bmap['adders'].items():
+        use = bmap['adder_use'][kind]
+        counts = np.bincount(use[use >= 0], minlength=len(adders))
+        out[kind] = (len(adders), int(np.count_nonzero(counts)), int(counts.max(initial=0)))
+    return out
+
+def adder_shape(adder):
+    """ Adder taps with the smallest one at 0. Taps are delays, or (channel, delay) for the
+    optimized triplets/doublets.
+    """
+    if len(adder) and isinstance(adder[0], tuple):
+        base = min(d for _, d in adder)
+        return tuple((c, d - base) for c, d in adder)
+    base = min(adder, default=0)
+    return tuple(d - base for d in adder)
+
+def diff_maps(old, new):
+    """ Differences between two beam maps (beam_files.beam_map). Returns a dict:
+      nbeams     : (old, new)
+      changed    : [ (beam, old delays, new delays) ] for beams at the same index that differ
+      moved      : [ (old index, new index) ] for changed beams found elsewhere in the other map
+      removed    : old beams not anywhere in the new map
+      added      : new beams not anywhere in the old map
+      adders     : kind -> (old reuse, new reuse) from adder_reuse, where either has adders
+      adders_removed, adders_added : kind -> adder shapes (adder_shape) only in one of them,
+                   repeated if one has more adders of that shape
+      depths     : name -> (old, new) for depth parameters that changed
+      meta       : bit -> (beams dropped, beams added) for META bits that changed
+      same       : True if the beams and the META bits are the same
+    """
+    na = beam_files.normalized_delays(old)
+    nb = beam_files.normalized_delays(new)
+    where_a = {}
+    where_b = {}
+    for i, d in enumerate(na):
+        where_a.setdefault(d, i)
+    for i, d in enumerate(nb):
+        where_b.setdefault(d, i)
+    changed = []
+    moved = []
+    for i in range(max(len(na), len(nb))):
+        a = na[i] if i < len(na) else None
+        b = nb[i] if i < len(nb) else None
+        if a == b:
+            continue
+        changed.append((i, a, b))
+        if a is not None and a in where_b:
+            moved.append((i, where_b[a]))
+    removed = [ d for d in na if d not in where_b ]
+    added = [ d for d in nb if d not in where_a ]
+
+    ra = adder_reuse(old)
+    rb = adder_reuse(new)
+    adders = {}
+    adders_removed = {}
+    adders_added = {}
+    for kind in sorted(set(ra) | set(rb)):
+        adders[kind] = (ra.get(kind), rb.get(kind))
+        aa = collections.Counter(adder_shape(a) for a in old['adders'].get(kind, []))
+        ab = collections.Counter(adder_shape(a) for a in new['adders'].get(kind, []))
+        if aa - ab:
+            adders_removed[kind] = sorted((aa - ab).elements())
+        if ab - aa:
+            adders_added[kind] = sorted((ab - aa).elements())
+
+    depths = {}
+    for k in sorted(set(old['depths']) | set(new['depths'])):
+        if old['depths'].get(k) != new['depths'].get(k):
+            depths[k] = (old['depths'].get(k), new['depths'].get(k))
+
+    meta = {}
+    if old['meta'] is not None or new['meta'] is not None:
+        ma = old['meta'] or [ [] ]*8
+        mb = new['meta'] or [ [] ]*8
+        for bit in range(8):
+            sa, sb = set(ma[bit]), set(mb[bit])
+            if sa != sb:
+                meta[bit] = (sorted(sa - sb), sorted(sb - sa))
+
+    return { 'nbeams' : (old['nbeams'], new['nbeams']),
+             'changed' : changed,
+             'moved' : moved,
+             'removed' : removed,
+             'added' : added,
+             'adders' : adders,
+             'adders_removed' : adders_removed,
+             'adders_added' : adders_added,
+             'depths' : depths,
+             'meta' : meta,
+             'same' : not changed and not meta }
+
+def format_delays(d):
+    return "-" if d is None else "(" + ",".join("." if x is None else str(x) for x in d) + ")"
+
+def report(diff, old_name="old", new_name="new"):
+    """ The diff as a list of lines """
+    lines = [ f'{old_name} -> {new_name}: {diff["nbeams"][0]} -> {diff["nbeams"][1]} beams' ]
+    moved = dict(diff['moved'])
+    for i, a, b in diff['changed']:
+        note = f' (now beam {moved[i]})' if i in moved else ''
+        lines.append(f'  beam {i}: {format_delays(a)} -> {format_delays(b)}{note}')
+    if diff['removed']:
+        lines.append(f'  {len(diff["removed"])} beam(s) no longer in the map: ' + " ".join(format_delays(d) for d in diff['removed']))
+    if diff['added']:
+        lines.append(f'  {len(diff["added"])} new beam(s): ' + " ".join(format_delays(d) for d in diff['added']))
+    for kind, (a, b) in diff['adders'].items():
+        fmt = lambda r : "none" if r is None else f'{r[0]} ({r[1]} used, up to {r[2]} beams each)'
+        lines.append(f'  {kind} adders: {fmt(a)} -> {fmt(b)}')
+        for t in diff['adders_removed'].get(kind, []):
+            lines.append(f'    - {t}')
+        for t in diff['adders_added'].get(kind, []):
+            lines.append(f'    + {t}')
+    for k, (a, b) in diff['depths'].items():
+        lines.append(f'  {k}: {a} -> {b}')
+    for bit, (dropped, added) in diff['meta'].items():
+        lines.append(f'  META{bit}: dropped {dropped} added {added}')
+    lines.append('  beams and META identical' if diff['same'] else f'  {len(diff["changed"])} beam(s) differ')
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two beam files (pueo_beams packages, L1Beams headers, optimized_beams).")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--old-nontop-delay", type=int, default=0, help="Samples of delay the old package assumes on the non-top channels")
+    parser.add_argument("--new-nontop-delay", type=int, default=0, help="Same for the new one (8 for the 11/06 packages)")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 if the beams or META bits differ")
+    args = parser.parse_args()
+
+    old = beam_files.load_beam_map(args.old, args.old_nontop_delay)
+    new = beam_files.load_beam_map(args.new, args.new_nontop_delay)
+    diff = diff_maps(old, new)
+    print("\n".join(report(diff, args.old, args.new)))
+    if args.check and not diff['same']:
+        sys.exit(1)
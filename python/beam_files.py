@@ -0,0 +1,204 @@
+import ast
+import re
+
+import numpy as np
+
+import adder_alloc
+
+# Reads the generated beam files back in. Three flavors are around:
+#
+#   pueo_beams packages (include/pueo_beams_*.sv, process_jjb.py output):
+#       localparams LEFT/RIGHT/TOP_ADDERS, BEAM_INDICES, BEAM_*_OFFSETS, META*_INDICES
+#   antenna delay headers (include/L1Beams_header*.vh, convert_beam_header.py):
+#       `define BEAM_ANTENNA_DELAYS, optionally BEAM_USED_CHANNELS
+#   optimized adder headers (include/optimized_beams.vh, hdl_v2/optimized_beams.sv):
+#       TRIPLET/DOUBLET_ADDER_INDICES/DELAYS and BEAM_CONTENTS
+#
+# All of them become a "beam map" dictionary with the per-antenna delays of
+# every beam (what any of them is supposed to implement) plus whatever hardware
+# description the format has (adders, which beams use them, store depths, META).
+#
+# Some pueo_beams packages assume an extra clock on the non-top channels outside
+# the beamformer (see the 11/06 header): nontop_delay adds that back in.
+# skewed_top does what beamform_trigger_v3's SKEWED_TOP does to the left/right
+# adder taps (8 samples less for taps of 8 or more).
+
+NANT = 8
+NO_ADDER = 255
+
+_SIZED = re.compile(r"\d*'([bBdDhHoO])([0-9a-fA-F_]+)")
+_BASES = { 'b' : 2, 'd' : 10, 'h' : 16, 'o' : 8 }
+
+def _value(text):
+    """ SV constant expression (number or '{...} array, possibly nested) -> python """
+    text = text.replace("\\\n", " ").strip()
+    text = _SIZED.sub(lambda m : str(int(m.group(2).replace("_", ""), _BASES[m.group(1).lower()])), text)
+    text = re.sub(r"'\s*\{", "[", text).replace("}", "]")
+    value = ast.literal_eval(text)
+    if isinstance(value, list):
+        value = [ tuple(v) if isinstance(v, list) else v for v in value ]
+    return value
+
+def parse_text(text):
+    """ All the int localparams and `defines with constant values in a file. 2-D arrays are
+    lists of tuples, like process_jjb's params. Anything that isn't a constant is skipped.
+    """
+    # keep the line continuations for `defines, drop comments
+    text = re.sub(r'//[^\n]*', '', text)
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    params = {}
+    for m in re.finditer(r'localparam\s+(?:int\s+)?(\w+)\s*((?:\[[^\]]*\]\s*)*)=\s*([^;]*);', text):
+        try:
+            params[m.group(1)] = _value(m.group(3))
+        except (ValueError, SyntaxError):
+            pass
+    for m in re.finditer(r'`define\s+(\w+)[ \t]+((?:[^\n\\]|\\\n|\\)*)', text):
+        try:
+            params[m.group(1)] = _value(m.group(2))
+        except (ValueError, SyntaxError):
+            pass
+    return params
+
+def parse_file(filename):
+    with open(filename) as f:
+        return parse_text(f.read())
+
+def detect_format(params):
+    if 'BEAM_INDICES' in params and 'LEFT_ADDERS' in params:
+        return 'pueo_beams'
+    if 'BEAM_CONTENTS' in params and 'TRIPLET_ADDER_DELAYS' in params:
+        return 'optimized'
+    if 'BEAM_ANTENNA_DELAYS' in params:
+        return 'antenna_delays'
+    raise Exception("Don't know what kind of beam file this is")
+
+def _meta_lists(params):
+    metas = []
+    for i in range(8):
+        name = 'META%d_INDICES'%i
+        if name not in params:
+            return None
+        metas.append([ b for b in params[name] if b != NO_ADDER ])
+    return metas
+
+def _pueo_beams(params, nontop_delay, skewed_top):
+    nb = params['NUM_BEAM']
+    # adders in the same frame as the delays, so packages with and without the extra clock compare
+    tap = lambda d : (d - 8 if skewed_top and d >= 8 else d) + nontop_delay
+    left = [ tuple(tap(d) for d in a) for a in params['LEFT_ADDERS'] ]
+    right = [ tuple(tap(d) for d in a) for a in params['RIGHT_ADDERS'] ]
+    top = [ tuple(a) for a in params['TOP_ADDERS'] ]
+    idx = np.array(params['BEAM_INDICES'], dtype=np.int64).reshape(-1, 3)[:nb]
+    loff = np.array(params['BEAM_LEFT_OFFSETS'][:nb], dtype=np.int64)
+    roff = np.array(params['BEAM_RIGHT_OFFSETS'][:nb], dtype=np.int64)
+    toff = np.array(params.get('BEAM_TOP_OFFSETS', [ 0 ]*nb)[:nb], dtype=np.int64)
+    delays = np.zeros((nb, NANT), dtype=np.int64)
+    used = np.ones((nb, NANT), dtype=bool)
+    has_top = idx[:, 2] < len(top)
+    delays[:, list(adder_alloc.LEFT_CHANNELS)] = np.array(left, dtype=np.int64).reshape(-1, 3)[idx[:, 0]] + loff[:, np.newaxis]
+    delays[:, list(adder_alloc.RIGHT_CHANNELS)] = np.array(right, dtype=np.int64).reshape(-1, 3)[idx[:, 1]] + roff[:, np.newaxis]
+    if len(top):
+        t = np.array(top, dtype=np.int64).reshape(-1, 2)[np.where(has_top, idx[:, 2], 0)] + toff[:, np.newaxis]
+        delays[:, list(adder_alloc.TOP_CHANNELS)] = np.where(has_top[:, np.newaxis], t, 0)
+    used[:, list(adder_alloc.TOP_CHANNELS)] = has_top[:, np.newaxis]
+    use = { 'left' : idx[:, 0], 'right' : idx[:, 1], 'top' : np.where(has_top, idx[:, 2], -1) }
+    depths = { k : params[k] for k in ('SAMPLE_STORE_DEPTH', 'LEFT_STORE_DEPTH', 'RIGHT_STORE_DEPTH', 'TOP_STORE_DEPTH') if k in params }
+    return delays, used, { 'left' : left, 'right' : right, 'top' : top }, use, depths
+
+def _optimized(params):
+    contents = np.array(params['BEAM_CONTENTS'], dtype=np.int64).reshape(-1, 3)
+    nb = params.get('NUM_BEAM', len(contents))
+    contents = contents[:nb]
+    tidx = params['TRIPLET_ADDER_INDICES']
+    tdel = params['TRIPLET_ADDER_DELAYS']
+    didx = params['DOUBLET_ADDER_INDICES']
+    ddel = params['DOUBLET_ADDER_DELAYS']
+    triplets = [ tuple(zip(i, d)) for i, d in zip(tidx, tdel) ]
+    doublets = [ tuple(zip(i, d)) for i, d in zip(didx, ddel) ]
+    delays = np.zeros((nb, NANT), dtype=np.int64)
+    used = np.zeros((nb, NANT), dtype=bool)
+    for b, (t0, t1, d) in enumerate(contents):
+        for ch, dl in triplets[t0] + triplets[t1] + doublets[d]:
+            delays[b, ch] = dl
+            used[b, ch] = True
+    use = { 'triplet' : np.concatenate((contents[:, 0], contents[:, 1])), 'doublet' : contents[:, 2] }
+    return delays, used, { 'triplet' : triplets, 'doublet' : doublets }, use, {}
+
+def _antenna_delays(params):
+    delays = np.array(params['BEAM_ANTENNA_DELAYS'], dtype=np.int64).reshape(-1, NANT)
+    nb = params.get('BEAM_TOTAL', len(delays))
+    delays = delays[:nb]
+    used = np.ones((nb, NANT), dtype=bool)
+    if 'BEAM_USED_CHANNELS' in params:
+        bits = np.array(params['BEAM_USED_CHANNELS'][:nb], dtype=np.int64)
+        # channel 0 is the MSB
+        used = ((bits[:, np.newaxis] >> (NANT-1-np.arange(NANT))) & 1).astype(bool)
+    depths = { 'MAX_ANTENNA_DELAY_%d'%i : params['MAX_ANTENNA_DELAY_%d'%i] for i in range(NANT) if 'MAX_ANTENNA_DELAY_%d'%i in params }
+    return delays, used, {}, {}, depths
+
+def beam_map(params, nontop_delay=0, skewed_top=False):
+    """ Beam map dictionary from parsed parameters:
+      format      : 'pueo_beams', 'optimized' or 'antenna_delays'
+      nbeams      : number of beams
+      delays      : (nbeams, 8) per-antenna delay in samples (0 where unused)
+      used        : (nbeams, 8) which antennas each beam adds
+      adders      : kind -> list of adder tuples
+      adder_use   : kind -> (nbeams,) adder index each beam uses (-1 = none), for
+                    triplets (2*nbeams,), the first triplets then the second ones
+      depths      : store depth parameters
+      meta        : 8 lists of beam indices (255s dropped), or None
+      params      : what was parsed
+    """
+    fmt = detect_format(params)
+    if fmt == 'pueo_beams':
+        delays, used, adders, use, depths = _pueo_beams(params, nontop_delay, skewed_top)
+    elif fmt == 'optimized':
+        delays, used, adders, use, depths = _optimized(params)
+    else:
+        delays, used, adders, use, depths = _antenna_delays(params)
+    return { 'format' : fmt,
+             'nbeams' : len(delays),
+             'delays' : delays,
+             'used' : used,
+             'adders' : adders,
+             'adder_use' : use,
+             'depths' : depths,
+             'meta' : _meta_lists(params),
+             'params' : params }
+
+def load_beam_map(filename, nontop_delay=0, skewed_top=False):
+    return beam_map(parse_file(filename), nontop_delay, skewed_top)
+
+def jjb_beams(params):
+    """ The process_jjb beam dictionaries back from a pueo_beams package """
+    nb = params['NUM_BEAM']
+    metas = _meta_lists(params) or [ [] ]*8
+    masks = [ 0 ]*nb
+    for bit, beams in enumerate(metas):
+        for b in beams:
+            if b < nb:
+                masks[b] |= 1 << bit
+    top = params['TOP_ADDERS']
+    toff = params.get('BEAM_TOP_OFFSETS', [ 0 ]*nb)
+    beams = []
+    for b in range(nb):
+        li, ri, ti = params['BEAM_INDICES'][b]
+        beams.append({ 'LeftDelays' : tuple(params['LEFT_ADDERS'][li]),
+                       'LeftOffset' : params['BEAM_LEFT_OFFSETS'][b],
+                       'RightDelays' : tuple(params['RIGHT_ADDERS'][ri]),
+                       'RightOffset' : params['BEAM_RIGHT_OFFSETS'][b],
+                       'TopDelays' : tuple(top[ti]) if ti < len(top) else None,
+                       'TopOffset' : toff[b],
+                       'Index' : b,
+                       'L2Mask' : masks[b] })
+    return beams
+
+def normalized_delays(bmap):
+    """ Each beam's delays as a tuple with its smallest used delay at 0 (None for unused antennas).
+    Two beams are the same beam if these match.
+    """
+    out = []
+    for d, u in zip(bmap['delays'].tolist(), bmap['used'].tolist()):
+        base = min((x for x, k in zip(d, u) if k), default=0)
+        out.append(tuple(x - base if k else None for x, k in zip(d, u)))
+    return out
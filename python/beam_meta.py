@@ -0,0 +1,168 @@
+import argparse
+import math
+
+import numpy as np
+
+import beam_files
+import process_jjb
+from beamform_model import CLOCK_RATE
+
+# Model of hdl_v3/beam_meta_builder.sv + beam_meta_nybble.sv.
+#
+# Each META bit is a 22-input OR of (masked) beam triggers, picked by that
+# bit's META*_INDICES list (255, or anything past NBEAMS, is a 0). The OR is
+# done in a DSP in FOUR12 SIMD mode, four META bits per DSP: entries 0-10 of a
+# list are an 11 bit lane of AB, entries 11-21 the same lane of C, and
+# AB + C + 0xFFF carries out of the 12 bit lane iff any of them is set. AB/C
+# and P are registered, so meta_o (and trig_o) come out 2 clocks after beam_i.
+#
+# The DSP does the OR in one level whatever the lists look like, so the layout
+# only matters for what it costs getting the bits there: how many live inputs
+# each AB/C lane has, how many META bits each beam trigger has to fan out to,
+# and how deep the OR would be if it were LUTs instead. optimize_layout()
+# splits each list evenly between AB and C (process_jjb fills AB first) and
+# drops repeated beams; the metadata it gives is the same.
+
+NMETA = 8
+META_LENGTH = 22
+LANE_BITS = 11
+LATENCY = 2
+NO_BEAM = beam_files.NO_ADDER
+LUT_INPUTS = 6
+
+def meta_indices(params, lf=False):
+    """ (8, 22) index array from a parsed package (META*_INDICES, or LF_META*_INDICES) """
+    prefix = 'LF_META' if lf else 'META'
+    return np.array([ params['%s%d_INDICES'%(prefix, k)] for k in range(NMETA) ], dtype=np.int64)
+
+def meta_bits(beam_bits, indices, block=65536):
+    """ Combinational META: beam_bits is (nbeams, nclocks) bool (BeamformModel.triggers),
+    returns (nclocks,) uint8, bit k = the DSP carry of lane k.
+    """
+    beam_bits = np.asarray(beam_bits, dtype=bool)
+    nbeams, nclk = beam_bits.shape
+    indices = np.asarray(indices, dtype=np.int64)
+    valid = indices < nbeams
+    safe = np.where(valid, indices, 0)
+    weight = (1 << (np.arange(META_LENGTH) % LANE_BITS)).astype(np.int64)
+    half = np.arange(META_LENGTH) < LANE_BITS
+    out = np.zeros(nclk, dtype=np.uint8)
+    for start in range(0, nclk, block):
+        bits = beam_bits[:, start:start+block][safe] & valid[..., np.newaxis]       # (8, 22, n)
+        lanes = bits*weight[:, np.newaxis]
+        ab = lanes[:, half].sum(axis=1)
+        c = lanes[:, ~half].sum(axis=1)
+        carry = ((ab + c + 0xFFF) >> 12) & 1                                      # (8, n)
+        out[start:start+block] = (carry << np.arange(NMETA)[:, np.newaxis]).sum(axis=0)
+    return out
+
+class BeamMetaBuilder:
+    """ beam_meta_builder with USE_V3 = TRUE: the 2 clock pipeline carries over between run()s.
+    full=False is the dummy beam version (meta is always 0xFF).
+    """
+    def __init__(self, indices, nbeams, full=True):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.nbeams = nbeams
+        self.full = full
+        self.reset()
+
+    def reset(self):
+        self.meta_pipe = np.zeros(LATENCY, dtype=np.uint8)
+        self.trig_pipe = np.zeros(LATENCY, dtype=bool)
+
+    def run(self, beam_bits, trig):
+        """ beam_bits (nbeams, nclocks), trig (nclocks,) -> (meta_o, trig_o), both (nclocks,) """
+        trig = np.asarray(trig, dtype=bool)
+        if self.full:
+            meta = meta_bits(beam_bits, self.indices)
+        else:
+            meta = np.full(len(trig), 0xFF, dtype=np.uint8)
+        meta = np.concatenate((self.meta_pipe, meta))
+        trig = np.concatenate((self.trig_pipe, trig))
+        self.meta_pipe = meta[len(meta)-LATENCY:]
+        self.trig_pipe = trig[len(trig)-LATENCY:]
+        return meta[:len(meta)-LATENCY], trig[:len(trig)-LATENCY]
+
+def meta_rates(meta, trig=None, clock_rate=CLOCK_RATE):
+    """ Rate (Hz) each META bit is set, only counting clocks where trig is set if it's given """
+    meta = np.asarray(meta, dtype=np.uint8)
+    bits = (meta[:, np.newaxis] >> np.arange(NMETA)) & 1
+    if trig is not None:
+        bits = bits & np.asarray(trig, dtype=np.uint8)[:, np.newaxis]
+    return bits.sum(axis=0) * clock_rate / max(len(meta), 1)
+
+def layout_cost(indices, nbeams):
+    """ What a META layout costs:
+      entries         : (8,) live (distinct, < nbeams) beams in each list
+      ab, c           : (8,) live inputs in the AB and C lane of each list
+      max_lane_fanin  : largest of those
+      duplicates      : repeated beams summed over the lists
+      beam_fanout     : (nbeams,) number of META bits each beam goes to
+      lut_depth       : LUT6 levels for the biggest list if the OR were done in fabric
+      fits            : every list fits the DSP (22 entries, 11 per lane)
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    live = indices < nbeams
+    entries = np.array([ len(set(row[ok].tolist())) for row, ok in zip(indices, live) ])
+    ab = live[:, :LANE_BITS].sum(axis=1)
+    c = live[:, LANE_BITS:].sum(axis=1)
+    fanout = np.zeros(nbeams, dtype=np.int64)
+    for row, ok in zip(indices, live):
+        fanout[np.unique(row[ok])] += 1
+    lut_depth = max([ math.ceil(math.log(n, LUT_INPUTS)) if n > 1 else 0 for n in entries ], default=0)
+    return { 'entries' : entries,
+             'ab' : ab,
+             'c' : c,
+             'max_lane_fanin' : int(max(ab.max(initial=0), c.max(initial=0))),
+             'duplicates' : int(live.sum() - entries.sum()),
+             'beam_fanout' : fanout,
+             'lut_depth' : lut_depth,
+             'fits' : indices.shape[1] <= META_LENGTH and bool(np.all(ab <= LANE_BITS) & np.all(c <= LANE_BITS)) }
+
+def optimize_layout(indices, nbeams):
+    """ Same META bits, each list deduplicated, sorted and split evenly between the AB and C
+    lanes (AB gets the odd one), padded with 255. Returns an (8, 22) array.
+    """
+    out = np.full((NMETA, META_LENGTH), NO_BEAM, dtype=np.int64)
+    for k, row in enumerate(np.asarray(indices, dtype=np.int64)):
+        beams = sorted(set(row[row < nbeams].tolist()))
+        if len(beams) > META_LENGTH:
+            raise Exception("META%d has %d beams, the DSP OR only takes %d"%(k, len(beams), META_LENGTH))
+        nab = (len(beams) + 1)//2
+        out[k, :nab] = beams[:nab]
+        out[k, LANE_BITS:LANE_BITS+len(beams)-nab] = beams[nab:]
+    return out
+
+def layout_params(indices, prefix='META'):
+    """ package entries (process_jjb params style) for a layout """
+    return { '%s%d_INDICES'%(prefix, k) : [ int(i) for i in row ] for k, row in enumerate(indices) }
+
+def print_cost(name, cost):
+    print(f'{name}: entries {cost["entries"].tolist()}, AB/C lanes {cost["ab"].tolist()}/{cost["c"].tolist()}, '
+          f'max lane fan-in {cost["max_lane_fanin"]}, {cost["duplicates"]} duplicate(s), '
+          f'max beam fan-out {cost["beam_fanout"].max(initial=0)}, LUT OR depth {cost["lut_depth"]}'
+          + ('' if cost['fits'] else ', DOES NOT FIT'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check and re-lay-out the META index lists of a pueo_beams package.")
+    parser.add_argument("package", help="pueo_beams package (.sv)")
+    parser.add_argument("--lf", action="store_true", help="Use the LF_META lists (pueo_lf_meta.sv)")
+    parser.add_argument("--nbeams", type=int, default=None, help="Number of beams (default NUM_BEAM from the package)")
+    parser.add_argument("--clocks", type=int, default=0, help="Also check the new layout against the old one on this many clocks of random triggers")
+    parser.add_argument("--outfile", default=None, help="Write the new META localparams here")
+    args = parser.parse_args()
+
+    params = beam_files.parse_file(args.package)
+    nbeams = args.nbeams if args.nbeams is not None else params['NUM_BEAM']
+    old = meta_indices(params, args.lf)
+    new = optimize_layout(old, nbeams)
+    print_cost('current', layout_cost(old, nbeams))
+    print_cost('optimized', layout_cost(new, nbeams))
+    if args.clocks:
+        bits = np.random.default_rng().random((nbeams, args.clocks)) < 0.05
+        same = np.array_equal(meta_bits(bits, old), meta_bits(bits, new))
+        print(f'beam_meta: metadata {"identical" if same else "DIFFERENT"} over {args.clocks} clocks')
+    if args.outfile is not None:
+        with open(args.outfile, "w") as f:
+            for name, value in layout_params(new, 'LF_META' if args.lf else 'META').items():
+                f.write(process_jjb.sv_string(name, value, 'int') + "\n")
@@ -0,0 +1,176 @@
+import argparse
+import pickle
+
+import numpy as np
+
+import adder_alloc
+
+# Sky coverage of a beam map with sample-quantized delays.
+#
+# A plane wave from direction u (unit vector toward the source, elevation/azimuth
+# in degrees, z up) reaches antenna i at -p_i.u/c. A beam steered at u_b adds
+# antenna i delayed by d_i samples, and the delays follow
+#     d_i = (fs/c) p_i.u_b + const
+# (the antenna that fires first gets the biggest delay, the last one gets 0),
+# except that they're rounded to whole samples. For a source at v the antennas
+# then line up with timing errors e_i = d_i/fs - p_i.v/c (plus a common constant),
+# and for a signal with a flat spectrum over the band [f1, f2] the beam power
+# relative to a perfectly aligned 8 antenna sum is
+#     sum_i sum_k R(e_i - e_k) / 64
+#     R(t) = (sin(2 pi f2 t) - sin(2 pi f1 t)) / (2 pi t (f2 - f1))
+# so the loss includes both the quantization and pointing away from the beam, and
+# 6 antenna beams (no top pair) start 2.5 dB down. Antenna gain patterns are ignored.
+#
+# Positions come from the 'Array' in the jjb beam pickles or are fit to the beam
+# table itself (least squares on the delays, antenna 0 at the origin).
+
+SAMPLE_RATE = 3.0e9
+SPEED_OF_LIGHT = 299792458.0
+BAND = (300e6, 1200e6)
+NANT = 8
+
+def directions(el, az):
+    """ Unit vectors (..., 3) for elevation/azimuth in degrees """
+    el = np.radians(np.asarray(el, dtype=np.float64))
+    az = np.radians(np.asarray(az, dtype=np.float64))
+    return np.stack((np.cos(el)*np.cos(az), np.cos(el)*np.sin(az), np.sin(el)), axis=-1)
+
+def beam_arrays(beams):
+    """ (delays (nbeams, 8), used (nbeams, 8), el, az) from process_jjb/adder_alloc beam dictionaries.
+    el/az are NaN for beams that don't have them.
+    """
+    n = len(beams)
+    delays = np.zeros((n, NANT), dtype=np.int64)
+    used = np.ones((n, NANT), dtype=bool)
+    for i, b in enumerate(beams):
+        left, right, top = adder_alloc.beam_delays(b)
+        delays[i, list(adder_alloc.LEFT_CHANNELS)] = left
+        delays[i, list(adder_alloc.RIGHT_CHANNELS)] = right
+        if top is None:
+            used[i, list(adder_alloc.TOP_CHANNELS)] = False
+        else:
+            delays[i, list(adder_alloc.TOP_CHANNELS)] = top
+    el = np.array([ np.nan if b.get('El') is None else b['El'] for b in beams ])
+    az = np.array([ np.nan if b.get('Az') is None else b['Az'] for b in beams ])
+    return delays, used, el, az
+
+def geometry_from_pickle(filename):
+    """ Antenna positions (8, 3) in meters from the first full beam of a jjb pickle, or None """
+    with open(filename, 'rb') as f:
+        raw = pickle.load(f)
+    for b in raw:
+        if isinstance(b, dict) and 'Array' in b and len(b['Array']) == NANT:
+            return np.asarray(b['Array'], dtype=np.float64)
+    return None
+
+def fit_geometry(delays, used, el, az, sample_rate=SAMPLE_RATE):
+    """ Least squares antenna positions from the beam delays: d_ib = k p_i.u_b + c_b with
+    k = fs/c, p_0 = 0 and one constant per beam. Returns (positions (8, 3), rms residual in samples).
+    """
+    k = sample_rate/SPEED_OF_LIGHT
+    ok = np.isfinite(el) & np.isfinite(az)
+    delays, used, u = delays[ok], used[ok], directions(el[ok], az[ok])
+    nb = len(delays)
+    b_idx, a_idx = np.nonzero(used)
+    rows = np.arange(len(b_idx))
+    A = np.zeros((len(b_idx), 3*NANT + nb))
+    for xyz in range(3):
+        A[rows, 3*a_idx + xyz] = k*u[b_idx, xyz]
+    A[rows, 3*NANT + b_idx] = 1.0
+    # antenna 0 is the origin
+    A = A[:, 3:]
+    y = delays[b_idx, a_idx].astype(np.float64)
+    sol = np.linalg.lstsq(A, y, rcond=None)[0]
+    pos = np.zeros((NANT, 3))
+    pos[1:] = sol[:3*(NANT-1)].reshape(NANT-1, 3)
+    rms = np.sqrt(np.mean((A @ sol - y)**2))
+    return pos, rms
+
+def correlation(t, band=BAND):
+    """ Normalized autocorrelation of a flat band-limited signal at lag t (seconds) """
+    f1, f2 = band
+    t = np.asarray(t, dtype=np.float64)
+    safe = np.where(t == 0, 1.0, t)
+    r = (np.sin(2*np.pi*f2*safe) - np.sin(2*np.pi*f1*safe)) / (2*np.pi*safe*(f2 - f1))
+    return np.where(t == 0, 1.0, r)
+
+def beam_power(positions, delays, used, el, az, band=BAND, sample_rate=SAMPLE_RATE, block=4096):
+    """ Relative coherent power (ndir, nbeams) of each beam for sources at the el/az directions
+    (1-D, same length). 1.0 is a perfectly aligned 8 antenna sum.
+    """
+    v = directions(el, az).reshape(-1, 3)
+    arrival = -(v @ positions.T)/SPEED_OF_LIGHT                        # (ndir, 8)
+    applied = delays/sample_rate                                       # (nbeams, 8)
+    w = used.astype(np.float64)
+    pairs = [ (i, j) for i in range(NANT) for j in range(i+1, NANT) ]
+    pi = np.array([ p[0] for p in pairs ])
+    pj = np.array([ p[1] for p in pairs ])
+    pair_w = w[:, pi]*w[:, pj]                                         # (nbeams, npairs)
+    diag = w.sum(axis=1)
+    out = np.zeros((len(v), len(delays)))
+    for start in range(0, len(v), block):
+        e = applied[np.newaxis] + arrival[start:start+block, np.newaxis]    # (nd, nbeams, 8)
+        r = correlation(e[..., pi] - e[..., pj], band)
+        out[start:start+block] = (diag + 2*np.sum(r*pair_w, axis=-1)) / NANT**2
+    return out
+
+def sky_map(positions, delays, used, el_grid, az_grid, band=BAND, hole_db=-3.0, sample_rate=SAMPLE_RATE):
+    """ Best beam over an el x az grid. Returns a dict:
+      el, az     : the grid axes
+      power_db   : (nel, naz, nbeams) beam power in dB relative to an ideal 8 antenna sum
+      best_beam  : (nel, naz) index of the best beam
+      best_db    : (nel, naz) its power
+      holes      : (nel, naz) True where even the best beam is below hole_db
+      coverage   : fraction of the grid that isn't a hole
+    """
+    el_grid = np.asarray(el_grid, dtype=np.float64)
+    az_grid = np.asarray(az_grid, dtype=np.float64)
+    E, A = np.meshgrid(el_grid, az_grid, indexing='ij')
+    p = beam_power(positions, delays, used, E.ravel(), A.ravel(), band, sample_rate)
+    p = p.reshape(len(el_grid), len(az_grid), -1)
+    power_db = 10*np.log10(np.maximum(p, 1e-12))
+    best = np.argmax(power_db, axis=-1)
+    best_db = np.take_along_axis(power_db, best[..., np.newaxis], axis=-1)[..., 0]
+    holes = best_db < hole_db
+    return { 'el' : el_grid, 'az' : az_grid,
+             'power_db' : power_db,
+             'best_beam' : best,
+             'best_db' : best_db,
+             'holes' : holes,
+             'coverage' : 1.0 - holes.mean() }
+
+def quantization_loss(positions, delays, used, el, az, band=BAND, sample_rate=SAMPLE_RATE):
+    """ Each beam's power (dB) at its own nominal direction: what rounding the delays costs
+    (and the 2.5 dB for the 6 antenna beams)
+    """
+    p = beam_power(positions, delays, used, el, az, band, sample_rate)
+    return 10*np.log10(np.maximum(np.diagonal(p), 1e-12))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sky coverage of a beam map.")
+    parser.add_argument("infile", help="Beam file (pickle or CSV)")
+    parser.add_argument("--geometry", default=None, help="jjb pickle to take the antenna positions from (default: fit them)")
+    parser.add_argument("--el", type=float, nargs=3, default=[-50, 25, 0.5], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--az", type=float, nargs=3, default=[-30, 30, 0.5], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--hole-db", type=float, default=-3.0)
+    parser.add_argument("--save", default=None, help="Save the map (.npz)")
+    args = parser.parse_args()
+
+    beams = adder_alloc.load_beams(args.infile)
+    delays, used, el, az = beam_arrays(beams)
+    positions = geometry_from_pickle(args.geometry) if args.geometry is not None else None
+    if positions is None:
+        positions, rms = fit_geometry(delays, used, el, az)
+        print(f'beam_sky: fit antenna positions, rms delay residual {rms:.2f} samples')
+    el_grid = np.arange(args.el[0], args.el[1] + args.el[2]/2, args.el[2])
+    az_grid = np.arange(args.az[0], args.az[1] + args.az[2]/2, args.az[2])
+    m = sky_map(positions, delays, used, el_grid, az_grid, hole_db=args.hole_db)
+    print(f'beam_sky: {len(beams)} beams over {m["holes"].size} directions, {100*m["coverage"]:.1f}% above {args.hole_db} dB')
+    worst = np.unravel_index(np.argmin(m['best_db']), m['best_db'].shape)
+    print(f'worst direction el {el_grid[worst[0]]:.1f} az {az_grid[worst[1]]:.1f}: {m["best_db"][worst]:.2f} dB')
+    if np.all(np.isfinite(el)):
+        q = quantization_loss(positions, delays, used, el, az)
+        for i in np.argsort(q)[:5]:
+            print(f'beam {i} (el {el[i]:.1f} az {az[i]:.1f}): {q[i]:.2f} dB at its own direction')
+    if args.save is not None:
+        np.savez(args.save, **m)
@@ -0,0 +1,121 @@
+import os
+import re
+
+import numpy as np
+
+import process_jjb
+
+# Beam delay tables (L1Beams_*.csv) as one structured array.
+#
+# The CSV has a header line, one row per beam (elevation, azimuth, then the
+# delays of antennas 0-7, with a trailing comma), and then whatever notes follow
+# the first blank row. The beam rows are found with one regex over the whole
+# file and parsed in a single np.loadtxt. The parsed table is cached as a .npy
+# sidecar next to the CSV (L1Beams_2025_06_05.csv -> L1Beams_2025_06_05.beams.npy)
+# and reused as long as it's newer than the CSV.
+#
+# Delays are in samples: zero is the last antenna to fire, the delay is how many
+# samples in the past the other antennas are added.
+
+NANT = 8
+BEAM_DTYPE = np.dtype([ ('elevation', np.float64),
+                        ('azimuth', np.float64),
+                        ('delays', np.int32, (NANT,)) ])
+
+# a run of lines that start with two numbers
+_NUM = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_ROWS = re.compile(r'(?:[ \t]*%s[ \t]*,[ \t]*%s[ \t]*,[^\n]*(?:\n|$))*'%(_NUM, _NUM))
+
+def sidecar_name(csvname):
+    return os.path.splitext(csvname)[0] + ".beams.npy"
+
+def parse_csv(filename):
+    """ Reads the beam rows of a beam CSV into a BEAM_DTYPE array """
+    with open(filename) as f:
+        text = f.read()
+    body = text.split("\n", 1)[1] if "\n" in text else ""
+    rows = _ROWS.match(body).group(0)
+    if not rows.strip():
+        return np.zeros(0, dtype=BEAM_DTYPE)
+    raw = np.loadtxt(rows.splitlines(), delimiter=",", usecols=range(2+NANT), ndmin=2)
+    table = np.zeros(len(raw), dtype=BEAM_DTYPE)
+    table['elevation'] = raw[:, 0]
+    table['azimuth'] = raw[:, 1]
+    delays = raw[:, 2:]
+    bad = np.flatnonzero(np.any(delays != np.round(delays), axis=1))
+    if len(bad):
+        raise Exception("%s: non-integer delays in beam(s) %s"%(filename, bad.tolist()))
+    table['delays'] = delays.astype(np.int32)
+    return table
+
+def validate(table, require_zero=True):
+    """ Checks the whole table at once. Raises with the offending beam numbers. """
+    problems = []
+    def check(mask, what):
+        bad = np.flatnonzero(mask)
+        if len(bad):
+            problems.append("%s: beam(s) %s"%(what, bad.tolist()))
+    check(~np.isfinite(table['elevation']) | ~np.isfinite(table['azimuth']), "non-finite direction")
+    check(np.abs(table['elevation']) > 90, "elevation outside +/-90")
+    check(np.any(table['delays'] < 0, axis=1), "negative delay")
+    if require_zero:
+        check(table['delays'].min(axis=1, initial=0) != 0, "no zero-delay antenna")
+    if problems:
+        raise Exception("Bad beam table: " + "; ".join(problems))
+    return table
+
+def load_table(filename, cache=True, require_zero=True):
+    """ Beam table from a CSV (or a .npy sidecar directly). With cache, the sidecar is used
+    if it's up to date and (re)written if it isn't.
+    """
+    if filename.endswith(".npy"):
+        return validate(np.load(filename), require_zero)
+    side = sidecar_name(filename)
+    if cache and os.path.exists(side) and os.path.getmtime(side) >= os.path.getmtime(filename):
+        table = np.load(side)
+        if table.dtype == BEAM_DTYPE:
+            return validate(table, require_zero)
+    table = validate(parse_csv(filename), require_zero)
+    if cache:
+        np.save(side, table)
+    return table
+
+def max_delays(table):
+    return table['delays'].max(axis=0, initial=0)
+
+def render_defines(table, lead_antennas=(0, 4)):
+    """ One `define per beam and antenna, like convert_beams_to_verilog """
+    n = len(table)
+    beam = np.repeat(np.arange(n), NANT)
+    ant = np.tile(np.arange(NANT), n)
+    lines = [ "`define BEAM_%d_ANTENNA_DELAY_%d %d\n"%t for t in zip(beam.tolist(), ant.tolist(), table['delays'].ravel().tolist()) ]
+    maxes = max_delays(table)
+    lines += [ "`define MAX_ANTENNA_DELAY_%d %d\n"%(a, maxes[a]) for a in lead_antennas ]
+    return "".join(lines)
+
+def render_arrays(table, lead_antennas=None):
+    """ One BEAM_ANTENNA_DELAYS array, like convert_beams_to_verilog_arrays """
+    rows = [ "\n\t'{%d,%d,%d,%d,%d,%d,%d,%d}"%tuple(r) for r in table['delays'].tolist() ]
+    out = "`define BEAM_ANTENNA_DELAYS '{ \\" + ", \\".join(rows) + " \\\n}\n"
+    out += "`define BEAM_TOTAL %d\n"%len(table)
+    maxes = max_delays(table)
+    for a in (range(NANT) if lead_antennas is None else lead_antennas):
+        out += "`define MAX_ANTENNA_DELAY_%d %d\n"%(a, maxes[a])
+    return out
+
+def render_package(table, name="pueo_beam_delays"):
+    """ The same table as an SV package (process_jjb's localparam style) """
+    out = "`ifndef %s_SV\n`define %s_SV\n\npackage %s;\n"%(name.upper(), name.upper(), name)
+    out += process_jjb.sv_string('NUM_BEAM', len(table), 'int') + "\n\n"
+    out += process_jjb.sv_string('BEAM_ANTENNA_DELAYS', [ tuple(r) for r in table['delays'].tolist() ], 'int') + "\n"
+    out += process_jjb.sv_string('MAX_ANTENNA_DELAY', max_delays(table).tolist(), 'int') + "\n"
+    out += "endpackage\n\n`endif\n"
+    return out
+
+def write_header(table, outfilename, lead_antennas=None):
+    """ Picks the format from the extension: .sv is the package, anything else the arrays """
+    with open(outfilename, "w") as f:
+        if outfilename.endswith(".sv"):
+            f.write(render_package(table))
+        else:
+            f.write(render_arrays(table, lead_antennas))
@@ -0,0 +1,214 @@
+import ast
+import re
+
+import numpy as np
+
+import envelope_model
+
+# Golden model of hdl_v3/beamform_trigger_v3.sv, driven by the same pueo_beams
+# package the firmware is built with (include/pueo_beams_*.sv, as written by
+# process_jjb.py).
+#
+# Like the firmware, every left/right/top sub-beam is summed once and the beams
+# are composed from them:
+#   left adders  : channels 5, 6, 7 at the LEFT_ADDERS delays
+#   right adders : channels 1, 2, 3 at the RIGHT_ADDERS delays
+#   top adders   : channels 0, 4 at the TOP_ADDERS delays, plus 4 (sym_shift)
+#   beam         : left delayed by its BEAM_LEFT_OFFSETS + right delayed by its
+#                  BEAM_RIGHT_OFFSETS + top (or 35 if it has no top adder)
+# The inputs are 5 bit offset binary (code k means k-15.5), so with the
+# corrections above flipping the top bit of the 8 bit beam sum gives the signed
+# beam, sum(k-15.5) over the antennas. That's squared (14 bits), the envelope is
+# the larger of the two 8-sample sums ending at sample 3 and sample 7 of each clock
+# (dual_pueo_envelope_v2), and a beam triggers on a clock when its envelope is
+# >= the threshold (the DSP computes thresh - env - 1 and takes the sign).
+#
+# Delays are in samples, bigger is older. With SKEWED_TOP the left/right delays
+# of 8 or more lose a clock, because the top antennas already have an extra one.
+
+LEFT_INDICES = (5, 6, 7)
+RIGHT_INDICES = (1, 2, 3)
+TOP_INDICES = (0, 4)
+NSAMP = 8
+NBITS = 5
+SYM_SHIFT = 4
+FILLER = 35
+# 8 bit beam sum, flipping the top bit
+BEAM_OFFSET = 128
+ENVELOPE_BITS = 17
+SAMPLE_RATE = 3.0e9
+CLOCK_RATE = SAMPLE_RATE/NSAMP
+
+def parse_package(filename):
+    """ Reads the localparams out of a pueo_beams SV package into a dict.
+    Scalars come back as ints, 1-D arrays as lists, 2-D arrays as lists of tuples
+    (the same types process_jjb builds its params with).
+    """
+    with open(filename) as f:
+        text = f.read()
+    text = re.sub(r'//[^\n]*', '', text)
+    params = {}
+    for m in re.finditer(r'localparam\s+(?:int\s+)?(\w+)\s*((?:\[[^\]]*\]\s*)*)=\s*([^;]*);', text):
+        name, dims, value = m.groups()
+        value = value.strip()
+        if not dims:
+            params[name] = int(value, 0)
+            continue
+        value = ast.literal_eval(value.replace("'{", "[").replace("}", "]"))
+        params[name] = [ tuple(v) if isinstance(v, list) else v for v in value ]
+    return params
+
+class BeamformModel:
+    """ Evaluates every beam of a pueo_beams parameter set on (8, N) 5-bit data.
+    params is a dict like parse_package returns. Data can be fed in pieces with process();
+    the sample history and the envelope's previous half-clock carry over between calls.
+    """
+    def __init__(self, params, skewed_top=False, use_all_beams=True):
+        self.params = params
+        self.skewed_top = skewed_top
+        self.nbeams = params['NUM_BEAM']
+        skew = lambda d : d - 8 if (skewed_top and d >= 8) else d
+        self.left_delays = np.array([ [ skew(d) for d in a ] for a in params['LEFT_ADDERS'] ], dtype=np.int64).reshape(-1, 3)
+        self.right_delays = np.array([ [ skew(d) for d in a ] for a in params['RIGHT_ADDERS'] ], dtype=np.int64).reshape(-1, 3)
+        self.top_delays = np.array(params['TOP_ADDERS'], dtype=np.int64).reshape(-1, 2)
+        indices = np.array(params['BEAM_INDICES'], dtype=np.int64).reshape(-1, 3)[:self.nbeams]
+        self.left_index = indices[:, 0]
+        self.right_index = indices[:, 1]
+        self.top_index = indices[:, 2]
+        self.has_top = self.top_index < len(self.top_delays)
+        self.left_offset = np.array(params['BEAM_LEFT_OFFSETS'][:self.nbeams], dtype=np.int64)
+        self.right_offset = np.array(params['BEAM_RIGHT_OFFSETS'][:self.nbeams], dtype=np.int64)
+        # beams with no top adder are only instantiated with USE_ALL_BEAMS
+        self.enabled = self.has_top | use_all_beams
+        self._check(params)
+
+        self.max_offset = int(max(self.left_offset.max(initial=0), self.right_offset.max(initial=0)))
+        self.history = self.max_offset + int(max(self.left_delays.max(initial=0),
+                                                 self.right_delays.max(initial=0),
+                                                 self.top_delays.max(initial=0)))
+        self.reset()
+
+    def _check(self, params):
+        # right_store is declared [NUM_LEFT_ADDERS-1:0]
+        if len(self.right_delays) > len(self.left_delays):
+            raise Exception("%d right adders but only %d left adders (right_store has LEFT_ADDER_LEN entries)"%(len(self.right_delays), len(self.left_delays)))
+        # the firmware slices can't reach past the end of the stores
+        maxd = (params['SAMPLE_STORE_DEPTH']-1)*NSAMP
+        for name, d in (('left', self.left_delays), ('right', self.right_delays), ('top', self.top_delays)):
+            if d.size and (d.min() < 0 or d.max() > maxd):
+                raise Exception("%s adder delays must be in [0, %d] for SAMPLE_STORE_DEPTH %d"%(name, maxd, params['SAMPLE_STORE_DEPTH']))
+        for name, off, depth in (('left', self.left_offset, params['LEFT_STORE_DEPTH']),
+                                 ('right', self.right_offset, params['RIGHT_STORE_DEPTH'])):
+            if off.min() < 0 or off.max() > (depth-1)*NSAMP:
+                raise Exception("%s beam offsets must be in [0, %d] for store depth %d"%(name, (depth-1)*NSAMP, depth))
+        for name, idx, n in (('left', self.left_index, len(self.left_delays)),
+                             ('right', self.right_index, len(self.right_delays))):
+            if idx.max() >= n:
+                raise Exception("Beam uses %s adder %d but there are only %d"%(name, idx.max(), n))
+
+    def reset(self):
+        """ Back to power-up: the sample stores are all zero """
+        self._samples = np.zeros((8, self.history), dtype=np.int16)
+        self._last74 = np.zeros(self.nbeams, dtype=np.int64)
+
+    def effective_delays(self):
+        """ (nbeams, 8) total delay of each antenna in each beam, -1 where a beam doesn't use
+        the antenna (no top adder). Handy to compare against the beam tables.
+        """
+        d = np.full((self.nbeams, 8), -1, dtype=np.int64)
+        d[:, LEFT_INDICES] = self.left_delays[self.left_index] + self.left_offset[:, np.newaxis]
+        d[:, RIGHT_INDICES] = self.right_delays[self.right_index] + self.right_offset[:, np.newaxis]
+        top = self.top_delays[np.where(self.has_top, self.top_index, 0)]
+        d[:, TOP_INDICES] = np.where(self.has_top[:, np.newaxis], top, -1)
+        return d
+
+    def sub_beams(self, xp, n):
+        """ Left/right/top sums from the history-extended samples xp (8, history+n).
+        left/right cover the last max_offset+n samples so they can be offset, top the last n.
+        """
+        H = self.history
+        span = self.max_offset + n
+        start = H - self.max_offset
+        def adders(delays, chans, length, first):
+            out = np.zeros((len(delays), length), dtype=np.int16)
+            for i, dl in enumerate(delays):
+                for ch, d in zip(chans, dl):
+                    out[i] += xp[ch, first-d:first-d+length]
+            return out
+        left = adders(self.left_delays, LEFT_INDICES, span, start)
+        right = adders(self.right_delays, RIGHT_INDICES, span, start)
+        top = adders(self.top_delays, TOP_INDICES, n, H) + SYM_SHIFT
+        return left, right, top
+
+    def beams(self, x):
+        """ Signed beam values (nbeams, N) for the next N samples (8, N), N a multiple of 8 """
+        x = np.asarray(x)
+        if x.shape[0] != 8 or x.shape[1] % NSAMP:
+            raise Exception("Need 8 channels and whole clocks, got shape %s"%(x.shape,))
+        n = x.shape[1]
+        xp = np.concatenate((self._samples, x.astype(np.int16)), axis=1)
+        left, right, top = self.sub_beams(xp, n)
+        self._samples = xp[:, xp.shape[1]-self.history:]
+
+        # beam b takes left[left_index[b]] delayed by left_offset[b], and so on
+        pos = self.max_offset + np.arange(n)[np.newaxis, :]
+        out = left[self.left_index[:, np.newaxis], pos - self.left_offset[:, np.newaxis]]
+        out += right[self.right_index[:, np.newaxis], pos - self.right_offset[:, np.newaxis]]
+        if len(top):
+            out += np.where(self.has_top[:, np.newaxis], top[np.minimum(self.top_index, len(top)-1)], FILLER)
+        else:
+            out += FILLER
+        out -= BEAM_OFFSET
+        return out
+
+    def envelopes(self, x):
+        """ Envelope (nbeams, nclocks) for the next (8, N) samples, one value per clock """
+        b = self.beams(x).astype(np.int32)
+        env, self._last74 = envelope_model.envelope(b*b, self._last74)
+        return env
+
+    def triggers(self, x, thresholds):
+        """ Boolean (nbeams, nclocks) triggers. thresholds is a scalar or per-beam """
+        env = self.envelopes(x)
+        thr = np.broadcast_to(np.asarray(thresholds), (self.nbeams,))
+        return (env >= thr[:, np.newaxis]) & self.enabled[:, np.newaxis]
+
+def envelope_histogram(env, hist=None):
+    """ Accumulates per-beam envelope counts into hist (nbeams, 2**17) """
+    env = np.asarray(env, dtype=np.int64)
+    nb = env.shape[0]
+    nbins = 1 << ENVELOPE_BITS
+    flat = (env + (np.arange(nb)*nbins)[:, np.newaxis]).ravel()
+    counts = np.bincount(flat, minlength=nb*nbins).reshape(nb, nbins)
+    if hist is None:
+        return counts
+    hist += counts
+    return hist
+
+def rates_from_histogram(hist, thresholds=None, clock_rate=CLOCK_RATE):
+    """ Trigger rate (Hz) per beam at each threshold from an envelope histogram.
+    thresholds=None gives every threshold, (nbeams, 2**17). A clock triggers when the
+    envelope is >= the threshold.
+    """
+    hist = np.asarray(hist)
+    nclocks = hist.sum(axis=1, keepdims=True)
+    above = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+    rate = above / np.maximum(nclocks, 1) * clock_rate
+    if thresholds is None:
+        return rate
+    thresholds = np.clip(np.asarray(thresholds, dtype=np.int64), 0, hist.shape[1]-1)
+    return rate[:, thresholds]
+
+def predict_rates(params, chunks, thresholds=None, skewed_top=False, use_all_beams=True):
+    """ Runs the model over an iterable of (8, N) chunks and returns (rates, hist, nclocks).
+    rates is per beam at each threshold (see rates_from_histogram). Disabled beams read 0.
+    """
+    model = BeamformModel(params, skewed_top, use_all_beams)
+    hist = None
+    for x in chunks:
+        hist = envelope_histogram(model.envelopes(x), hist)
+    if hist is None:
+        raise Exception("No data")
+    rates = rates_from_histogram(hist, thresholds)
+    rates[~model.enabled] = 0
+    return rates, hist, int(hist[0].sum())
@@ -0,0 +1,334 @@
+import numpy as np
+from scipy import signal
+
+# Fast version of IIRSim.iir_biquad_run_fixed_point / iir_biquad_run_fixed_point_extended.
+# Same bit-exact truncation (the >>1 on F/G, >>14 for the feedback, >>27 for the output),
+# but all of the FIR and F/G prep is done up front on whole arrays and the only
+# truly recursive step (the 2x2 C matrix update) runs in a tight kernel with no
+# debug branches. If numba is around the kernel is compiled, otherwise it's a
+# plain Python loop over Python ints, which is still far quicker than indexing
+# numpy scalars.
+#
+# The IIRSim versions are kept as the reference (and for their debug output).
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def split_coeffs(coeffs, samp_per_clock=8):
+    """ Splits a clustered look-ahead coefficient vector into (f_fir, g_fir, D_FF, D_FG, E_GF, E_GG, C) """
+    coeffs = np.asarray(coeffs, dtype=np.int64)
+    n = 2*samp_per_clock-3
+    f_fir = coeffs[0:samp_per_clock-2]
+    g_fir = coeffs[samp_per_clock-2:n]
+    D_FF, D_FG, E_GF, E_GG = coeffs[n:n+4]
+    C = coeffs[n+4:n+8]
+    return f_fir, g_fir, D_FF, D_FG, E_GF, E_GG, C
+
+def default_ics(samp_per_clock=8):
+    """ Zero initial conditions, shaped like the IIRSim ones """
+    return np.zeros(samp_per_clock*3).reshape(3, -1)
+
+def fg_prep(ins, coeffs, samp_per_clock=8, ics=None, added_precision=0):
+    """ Everything before the recursion: the f/g FIRs, decimation to samples 0/1 and the
+    cross-linked F/G FIRs. Returns (F, G) as int64, one entry per clock.
+    Done exactly the way IIRSim does it (lfilter, then floor) so the results are identical.
+    """
+    if ics is None:
+        ics = default_ics(samp_per_clock)
+    f_fir, g_fir, D_FF, D_FG, E_GF, E_GG, C = split_coeffs(coeffs, samp_per_clock)
+    newins = np.concatenate((ics[0], ins))
+    f = signal.lfilter(f_fir, [1], newins)
+    g = signal.lfilter(g_fir, [1], newins)
+    f = f.reshape(-1, samp_per_clock).transpose()[0]
+    g = g.reshape(-1, samp_per_clock).transpose()[1]
+
+    F = signal.lfilter([2**(14+added_precision), D_FF], [1], f)
+    G = signal.lfilter([2**(14+added_precision), E_GG], [1], g)
+    F[1:] += D_FG*g[0:-1]
+    G[1:] += E_GF*f[0:-1]
+    F = np.array(np.floor(F[1:]), dtype=np.int64)
+    G = np.array(np.floor(G[1:]), dtype=np.int64)
+    return F, G
+
+def startup_clocks(F, G, C, ics, first_clock=0):
+    """ The first two clocks come from the initial conditions. IIRSim does these in floating
+    point (ics are floats), so we do exactly the same thing here to stay bit-exact.
+    F/G start at clock <first_clock>. Returns a (2, 2) array with the pre-shift
+    intermediates for clocks 0 and 1 (rows for clocks not in F/G are left zero).
+    """
+    seed = np.zeros((2, 2), dtype=np.int64)
+    for i in range(first_clock, min(2, first_clock+len(F))):
+        k = i - first_clock
+        y0 = C[0]*ics[1+i][0] + C[1]*ics[1+i][1] + F[k]
+        y1 = C[2]*ics[1+i][0] + C[3]*ics[1+i][1] + G[k]
+        seed[i, 0] = np.int64(C[0]*y0 + C[1]*y1 + np.right_shift(F[k], 1))
+        seed[i, 1] = np.int64(C[2]*y0 + C[3]*y1 + np.right_shift(G[k], 1))
+    return seed
+
+def new_state():
+    """ Feedback state for the recursion: the >>14 intermediates of the last two clocks,
+    indexed by [clock parity][sample 0/1].
+    """
+    return np.zeros((2, 2), dtype=np.int64)
+
+def _recursion_py(F1, G1, C, seed, state, i0, out_shift, state_shift, y0, y1):
+    """ Pure Python version of the update step. F1/G1 are F>>1 and G>>1, starting at clock i0.
+    seed holds the intermediates for clocks 0/1 (already computed), state is updated in place
+    and y0/y1 get the outputs.
+    """
+    c0, c1, c2, c3 = (int(c) for c in C)
+    F1 = F1.tolist()
+    G1 = G1.tolist()
+    n = len(F1)
+    o0 = [0]*n
+    o1 = [0]*n
+    s0 = [int(state[0, 0]), int(state[1, 0])]
+    s1 = [int(state[0, 1]), int(state[1, 1])]
+    for i in range(n):
+        p = (i0 + i) & 1
+        if i0 + i < 2:
+            a = int(seed[i0+i, 0])
+            b = int(seed[i0+i, 1])
+        else:
+            a = c0*s0[p] + c1*s1[p] + F1[i]
+            b = c2*s0[p] + c3*s1[p] + G1[i]
+        o0[i] = a >> out_shift
+        o1[i] = b >> out_shift
+        s0[p] = a >> state_shift
+        s1[p] = b >> state_shift
+    y0[:] = o0
+    y1[:] = o1
+    state[:, 0] = s0
+    state[:, 1] = s1
+
+def _recursion_nb(F1, G1, C, seed, state, i0, out_shift, state_shift, y0, y1):
+    c0, c1, c2, c3 = C[0], C[1], C[2], C[3]
+    for i in range(len(F1)):
+        p = (i0 + i) & 1
+        if i0 + i < 2:
+            a = seed[i0+i, 0]
+            b = seed[i0+i, 1]
+        else:
+            a = c0*state[p, 0] + c1*state[p, 1] + F1[i]
+            b = c2*state[p, 0] + c3*state[p, 1] + G1[i]
+        y0[i] = a >> out_shift
+        y1[i] = b >> out_shift
+        state[p, 0] = a >> state_shift
+        state[p, 1] = b >> state_shift
+
+if numba is not None:
+    _recursion_nb = numba.njit(cache=True)(_recursion_nb)
+
+def run_recursion(F, G, C, seed, out_shift=27, state_shift=14, state=None, first_clock=0):
+    """ Runs the C matrix update over all clocks. Returns the (sample 0, sample 1) outputs.
+    Pass in a state (see new_state) and the clock F/G start at to carry on from a previous call;
+    the state is updated in place.
+    """
+    if state is None:
+        state = new_state()
+    C = np.asarray(C, dtype=np.int64)
+    F1 = np.right_shift(np.asarray(F, dtype=np.int64), 1)
+    G1 = np.right_shift(np.asarray(G, dtype=np.int64), 1)
+    y0 = np.zeros(len(F1), dtype=np.int64)
+    y1 = np.zeros(len(F1), dtype=np.int64)
+    if numba is not None:
+        _recursion_nb(F1, G1, C, seed, state, first_clock, out_shift, state_shift, y0, y1)
+    else:
+        _recursion_py(F1, G1, C, seed, state, first_clock, out_shift, state_shift, y0, y1)
+    return y0, y1
+
+def _recursion_np_batch(F1, G1, C, seeds, state, i0, out_shift, state_shift, y0, y1):
+    """ Fallback for the batched case: still one loop over clocks, but each step is
+    vectorized over the batch (channels). F1/G1/y0/y1 are (batch, nclocks), C is (batch, 4),
+    seeds is (batch, 2, 2) and state is (batch, 2, 2).
+    """
+    c0, c1, c2, c3 = C[:, 0], C[:, 1], C[:, 2], C[:, 3]
+    for i in range(F1.shape[1]):
+        p = (i0 + i) & 1
+        if i0 + i < 2:
+            a = seeds[:, i0+i, 0]
+            b = seeds[:, i0+i, 1]
+        else:
+            a = c0*state[:, p, 0] + c1*state[:, p, 1] + F1[:, i]
+            b = c2*state[:, p, 0] + c3*state[:, p, 1] + G1[:, i]
+        y0[:, i] = np.right_shift(a, out_shift)
+        y1[:, i] = np.right_shift(b, out_shift)
+        state[:, p, 0] = np.right_shift(a, state_shift)
+        state[:, p, 1] = np.right_shift(b, state_shift)
+
+def run_recursion_batch(F, G, C, seeds, out_shift=27, state_shift=14, state=None, first_clock=0):
+    """ Batched run_recursion. F/G are (batch, nclocks), C is (batch, 4), seeds is one
+    startup_clocks() result per row and state is (batch, 2, 2).
+    Returns (sample 0, sample 1) outputs, each (batch, nclocks).
+    """
+    C = np.asarray(C, dtype=np.int64)
+    F1 = np.right_shift(np.asarray(F, dtype=np.int64), 1)
+    G1 = np.right_shift(np.asarray(G, dtype=np.int64), 1)
+    seeds = np.asarray(seeds, dtype=np.int64)
+    if state is None:
+        state = np.zeros((F1.shape[0], 2, 2), dtype=np.int64)
+    y0 = np.zeros(F1.shape, dtype=np.int64)
+    y1 = np.zeros(F1.shape, dtype=np.int64)
+    if numba is not None:
+        for k in range(F1.shape[0]):
+            _recursion_nb(F1[k], G1[k], C[k], seeds[k], state[k], first_clock, out_shift, state_shift, y0[k], y1[k])
+    else:
+        _recursion_np_batch(F1, G1, C, seeds, state, first_clock, out_shift, state_shift, y0, y1)
+    return y0, y1
+
+def incremental_step(arr, a1, a2, shift=14):
+    """ Fills in samples 2..samp_per_clock-1 of every clock from the two before it.
+    Each clock is independent, so this is vectorized over clocks. arr is (samp_per_clock, nclocks).
+    """
+    for j in range(2, arr.shape[0]):
+        arr[j] += -1*(np.right_shift(a1*arr[j-1], shift) + np.right_shift(a2*arr[j-2], shift))
+    return arr
+
+def iir_biquad_run_fixed_point_fast(ins, coeffs, samp_per_clock=8, ics=None, decimate=True, a1=0, a2=0, added_precision=0):
+    """ Drop-in for iir_biquad_run_fixed_point (added_precision=0) and
+    iir_biquad_run_fixed_point_extended. Output is bit-identical.
+    """
+    if ics is None:
+        ics = default_ics(samp_per_clock)
+    ins = np.array(ins, dtype=np.int64)
+    C = split_coeffs(coeffs, samp_per_clock)[6]
+
+    F, G = fg_prep(ins, coeffs, samp_per_clock, ics, added_precision)
+    seed = startup_clocks(F, G, C, ics)
+    y0, y1 = run_recursion(F, G, C, seed,
+                           out_shift=27+added_precision*2,
+                           state_shift=14+added_precision)
+
+    arr = np.array(ins.reshape(-1, samp_per_clock).transpose(), dtype=np.int64)
+    arr[0] = y0
+    arr[1] = y1
+    if decimate:
+        arr[2:] = 0
+    else:
+        incremental_step(arr, a1, a2, shift=14+added_precision)
+    return arr.transpose().reshape(-1)
+
+def iir_biquad_cascade_batch(ins, coeffs, samp_per_clock=8, decimate=True, a1=None, a2=None, added_precision=0):
+    """ Runs a cascade of biquads over many channels at once, like biquad8_x2_wrapper
+    does for each of the 8 channels in trigger_chain_x8_wrapper.
+    ins is (n_channels, n_samples). coeffs is (n_channels, n_biquads, n_coeffs), or
+    (n_biquads, n_coeffs) to use the same cascade on every channel. a1/a2 are the
+    incremental computation coefficients, (n_channels, n_biquads) or (n_biquads,),
+    only needed if not decimating. Each stage is identical to iir_biquad_run_fixed_point_fast
+    run on that channel, with zero initial conditions. Returns (n_channels, n_samples).
+    """
+    ins = np.array(ins, dtype=np.int64, ndmin=2)
+    nch = ins.shape[0]
+    coeffs = np.asarray(coeffs, dtype=np.int64)
+    if coeffs.ndim == 2:
+        coeffs = coeffs[np.newaxis]
+    coeffs = np.broadcast_to(coeffs, (nch,) + coeffs.shape[1:])
+    nbq = coeffs.shape[1]
+    if not decimate:
+        if a1 is None or a2 is None:
+            raise Exception("a1/a2 are needed when not decimating")
+        a1 = np.broadcast_to(np.asarray(a1, dtype=np.int64), (nch, nbq))
+        a2 = np.broadcast_to(np.asarray(a2, dtype=np.int64), (nch, nbq))
+    ics = default_ics(samp_per_clock)
+    n = 2*samp_per_clock-3
+
+    x = ins
+    for bq in range(nbq):
+        C = coeffs[:, bq, n+4:n+8]
+        # FIR prep is per channel since the coefficients differ, but each call is whole-array
+        FG = [ fg_prep(x[ch], coeffs[ch, bq], samp_per_clock, ics, added_precision) for ch in range(nch) ]
+        F = np.array([ fg[0] for fg in FG ])
+        G = np.array([ fg[1] for fg in FG ])
+        seeds = [ startup_clocks(F[ch], G[ch], C[ch], ics) for ch in range(nch) ]
+        y0, y1 = run_recursion_batch(F, G, C, seeds,
+                                     out_shift=27+added_precision*2,
+                                     state_shift=14+added_precision)
+        # (n_channels, samp_per_clock, nclocks)
+        arr = np.array(x.reshape(nch, -1, samp_per_clock).transpose(0, 2, 1))
+        arr[:, 0] = y0
+        arr[:, 1] = y1
+        if decimate:
+            arr[:, 2:] = 0
+        else:
+            incremental_step(arr.transpose(1, 0, 2), a1[:, bq, np.newaxis], a2[:, bq, np.newaxis],
+                             shift=14+added_precision)
+        x = arr.transpose(0, 2, 1).reshape(nch, -1)
+    return x
+
+class BiquadStream:
+    """ Stateful version of iir_biquad_run_fixed_point_fast for feeding a long capture through
+    in chunks. Everything the single-shot run carries from clock to clock (two clocks of input
+    history for the FIRs, the feedback state and the clock count for the startup clocks) is
+    kept here, so concatenating the outputs of process() is bit-identical to one single-shot run.
+    Chunks don't need to be whole clocks: leftover samples wait for the next chunk.
+    """
+    def __init__(self, coeffs, samp_per_clock=8, ics=None, decimate=True, a1=0, a2=0, added_precision=0, state=None):
+        self.coeffs = np.array(coeffs, dtype=np.int64)
+        self.samp_per_clock = samp_per_clock
+        self.ics = default_ics(samp_per_clock) if ics is None else np.asarray(ics)
+        self.decimate = decimate
+        self.a1 = a1
+        self.a2 = a2
+        self.added_precision = added_precision
+        self.C = split_coeffs(self.coeffs, samp_per_clock)[6]
+        self.reset()
+        if state is not None:
+            self.set_state(state)
+
+    def reset(self):
+        """ Back to the start of a capture """
+        spc = self.samp_per_clock
+        # float, like the ics, so lfilter sees the same types as the single-shot run
+        self.history = np.concatenate((np.zeros(spc), self.ics[0])).astype(np.float64)
+        self.recursion = new_state()
+        self.clock = 0
+        self.pending = np.zeros(0, dtype=np.int64)
+
+    def get_state(self):
+        """ Everything needed to pick up where we left off, as a dict of plain arrays/ints """
+        return { 'history' : self.history.copy(),
+                 'recursion' : self.recursion.copy(),
+                 'clock' : self.clock,
+                 'pending' : self.pending.copy() }
+
+    def set_state(self, state):
+        self.history = np.array(state['history'], dtype=np.float64)
+        self.recursion = np.array(state['recursion'], dtype=np.int64)
+        self.clock = int(state['clock'])
+        self.pending = np.array(state['pending'], dtype=np.int64)
+
+    def process(self, chunk):
+        """ Filters the next chunk of samples. Returns the output for every complete clock so far. """
+        spc = self.samp_per_clock
+        x = np.concatenate((self.pending, np.asarray(chunk, dtype=np.int64)))
+        nclk = len(x)//spc
+        self.pending = x[nclk*spc:]
+        x = x[:nclk*spc]
+        if nclk == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # The clock before the chunk goes in as the data, the one before that as the ics,
+        # so f/g for the previous clock are right. Then drop the previous clock again.
+        F, G = fg_prep(np.concatenate((self.history[spc:], x)), self.coeffs, spc,
+                       [self.history[:spc]], self.added_precision)
+        F = F[1:]
+        G = G[1:]
+        seed = startup_clocks(F, G, self.C, self.ics, first_clock=self.clock)
+        y0, y1 = run_recursion(F, G, self.C, seed,
+                               out_shift=27+self.added_precision*2,
+                               state_shift=14+self.added_precision,
+                               state=self.recursion,
+                               first_clock=self.clock)
+        self.history = np.concatenate((self.history, x.astype(np.float64)))[-2*spc:]
+        self.clock += nclk
+
+        arr = np.array(x.reshape(-1, spc).transpose())
+        arr[0] = y0
+        arr[1] = y1
+        if self.decimate:
+            arr[2:] = 0
+        else:
+            incremental_step(arr, self.a1, self.a2, shift=14+self.added_precision)
+        return arr.transpose().reshape(-1)
@@ -0,0 +1,140 @@
+import numpy as np
+
+import coeff_table
+
+# Closed form frequency response of the quantized clustered look-ahead biquad,
+# so a coefficient set can be judged without pushing impulses through
+# iir_biquad_run_fixed_point.
+#
+# The structure (non-decimated, see biquad_engine) with M samples per clock:
+#   f_k = sum_i fX(i+1) x[kM-i]         g_k = sum_i gX(i+1) x[kM+1-i]
+#   F_k = f_k + D_FF f_(k-1) + D_FG g_(k-1)
+#   G_k = g_k + E_GG g_(k-1) + E_GF f_(k-1)
+#   [y0_k y1_k] = C [y0_(k-2) y1_(k-2)] + [F_k G_k]
+#   y[kM+j] = x[kM+j] - a1' y[kM+j-1] - a2' y[kM+j-2]     for j = 2..M-1
+# preceded by the zero FIR A + B z^-1 + A z^-2. The coefficients are the Q4.14
+# integers divided by 2^14; the truncation in the datapath is ignored.
+#
+# With mismatched (quantized) coefficients the look-ahead and incremental paths
+# don't agree exactly, so the filter is periodically time-varying. For a tone
+# at w, phase j of each clock comes out as H_j(w) e^(jwn). The response at w
+# itself is the average over j, and whatever is left over goes to images at
+# w + 2 pi m/M.
+
+def split_vector(vectors, samp_per_clock=8):
+    """ Register-ordered vectors (..., nregs) -> dict of float coefficient arrays (unscaled from Q4.14) """
+    names = coeff_table.register_names(samp_per_clock)
+    v = np.asarray(vectors, dtype=np.float64)[..., :len(names)] / 2.0**14
+    idx = { n : i for i, n in enumerate(names) }
+    s = samp_per_clock
+    c = {}
+    for n in ('A', 'B', 'C0', 'C1', 'C2', 'C3', "a1'", "a2'", 'D_FF', 'D_FG', 'E_GF', 'E_GG', 'b2'):
+        c[n] = v[..., idx[n]]
+    c['f'] = np.stack([ v[..., idx['fX%d'%(i+1)]] for i in range(s-2) ], axis=-1)
+    c['g'] = np.stack([ v[..., idx['gX%d'%(i+1)]] for i in range(s-1) ], axis=-1)
+    return c
+
+def phase_responses(vectors, w, samp_per_clock=8, zeros=True):
+    """ H_j(w) for every phase j of the clock. vectors is (nsets, nregs), w is (nw,) in
+    radians/sample. Returns (nsets, samp_per_clock, nw) complex.
+    """
+    M = samp_per_clock
+    c = split_vector(np.atleast_2d(vectors), M)
+    w = np.asarray(w, dtype=np.float64)
+    ejw = np.exp(1j*w)[np.newaxis, :]
+    zi = np.exp(-1j*w*M)[np.newaxis, :]        # one clock of delay
+    col = lambda a : a[:, np.newaxis]
+
+    # f/g FIRs, sampled at phase 0 and 1
+    taps = np.exp(-1j*np.outer(np.arange(M-1), w))
+    Pf = c['f'] @ taps[:M-2]
+    Pg = (c['g'] @ taps[:M-1]) * ejw
+    F = Pf*(1 + col(c['D_FF'])*zi) + col(c['D_FG'])*zi*Pg
+    G = Pg*(1 + col(c['E_GG'])*zi) + col(c['E_GF'])*zi*Pf
+
+    # (I - C z^-2)^-1 [F G]
+    z2 = zi*zi
+    m00 = 1 - col(c['C0'])*z2
+    m01 = -col(c['C1'])*z2
+    m10 = -col(c['C2'])*z2
+    m11 = 1 - col(c['C3'])*z2
+    det = m00*m11 - m01*m10
+    Y = np.zeros((len(c['A']), M, len(w)), dtype=np.complex128)
+    Y[:, 0] = (m11*F - m01*G)/det
+    Y[:, 1] = (m00*G - m10*F)/det
+    # incremental step, x[kM+j] = e^(jwj) per clock
+    for j in range(2, M):
+        Y[:, j] = np.exp(1j*w*j) - col(c["a1'"])*Y[:, j-1] - col(c["a2'"])*Y[:, j-2]
+    # y[kM+j] = e^(jw(kM+j)) H_j
+    H = Y * np.exp(-1j*np.outer(np.arange(M), w))[np.newaxis]
+    if zeros:
+        Z = col(c['A']) + col(c['B'])*np.exp(-1j*w) + col(c['b2'])*np.exp(-2j*w)
+        H = H * Z[:, np.newaxis, :]
+    return H
+
+def frequency_response(vectors, w, samp_per_clock=8, zeros=True):
+    """ Returns (H, image_power): the response at w (nsets, nw) and the power that goes
+    into the images at w + 2 pi m/M instead, relative to the input tone.
+    """
+    H = phase_responses(vectors, w, samp_per_clock, zeros)
+    Heff = H.mean(axis=1)
+    image = np.mean(np.abs(H)**2, axis=1) - np.abs(Heff)**2
+    return Heff, np.maximum(image, 0)
+
+def pole_radius(vectors, samp_per_clock=8):
+    """ Pole radius of the look-ahead recursion. The C matrix steps 2M samples at once,
+    so its eigenvalues are the poles to the 2M-th power.
+    """
+    c = split_vector(np.atleast_2d(vectors), samp_per_clock)
+    tr = c['C0'] + c['C3']
+    det = c['C0']*c['C3'] - c['C1']*c['C2']
+    disc = np.sqrt((tr*tr - 4*det).astype(np.complex128))
+    lam = np.maximum(np.abs((tr + disc)/2), np.abs((tr - disc)/2))
+    return lam**(1.0/(2*samp_per_clock))
+
+def analyze(vectors, samp_per_clock=8, target_freqs=None, fs=None, npoints=4096, zeros=True, block=128):
+    """ Screens many coefficient sets at once. vectors is (nsets, nregs), target_freqs the
+    intended notch frequencies in MHz (nsets,), fs defaults to 3000*samp_per_clock/8 MHz,
+    the same as generate_coeffs. Returns a dict of (nsets,) arrays:
+      notch_freq   : frequency of the deepest point (MHz)
+      depth_db     : response there (dB)
+      shift        : notch_freq - target_freqs (MHz), if targets given
+      image_db     : worst image power over the band (dB relative to the input)
+      pole_radius  : look-ahead pole radius
+      margin       : 1 - pole_radius (<= 0 is unstable)
+    """
+    if fs is None:
+        fs = 3000*samp_per_clock/8
+    vectors = np.atleast_2d(vectors)
+    f = np.linspace(0, fs/2, npoints, endpoint=False)[1:]
+    w = 2*np.pi*f/fs
+    nsets = len(vectors)
+    k = np.zeros(nsets, dtype=np.int64)
+    depth = np.zeros(nsets)
+    image = np.zeros(nsets)
+    # (nsets, M, nw) complex gets big fast, so go in blocks
+    for start in range(0, nsets, block):
+        H, im = frequency_response(vectors[start:start+block], w, samp_per_clock, zeros)
+        mag = np.abs(H)
+        kk = np.argmin(mag, axis=1)
+        k[start:start+block] = kk
+        depth[start:start+block] = mag[np.arange(len(kk)), kk]
+        image[start:start+block] = im.max(axis=1)
+    out = {}
+    out['freqs'] = f
+    out['notch_freq'] = f[k]
+    out['depth_db'] = 20*np.log10(np.maximum(depth, 1e-12))
+    if target_freqs is not None:
+        out['shift'] = out['notch_freq'] - np.asarray(target_freqs, dtype=np.float64)
+    out['image_db'] = 10*np.log10(np.maximum(image, 1e-24))
+    out['pole_radius'] = pole_radius(vectors, samp_per_clock)
+    out['margin'] = 1 - out['pole_radius']
+    return out
+
+def analyze_table(table, freqs, q_factors, samp_per_clock=8, npoints=4096, zeros=True):
+    """ analyze() over a whole coeff_table grid. Returns the same keys, each (nfreqs, nqs) """
+    table = np.asarray(table)
+    nf, nq = table.shape[0:2]
+    targets = np.repeat(np.asarray(freqs, dtype=np.float64), nq)
+    out = analyze(table.reshape(nf*nq, -1), samp_per_clock, targets, npoints=npoints, zeros=zeros)
+    return { k : (v.reshape(nf, nq) if k != 'freqs' else v) for k, v in out.items() }
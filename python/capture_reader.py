@@ -0,0 +1,80 @@
+import numpy as np
+
+# Lazy replacement for IIRSim.import_data_dep. The .npy capture is memory-mapped,
+# the first non-zero sample of each channel is found by scanning leading blocks
+# only, and the 16->12 bit shift is done per slice as it's read. Opening a
+# multi-GB capture doesn't touch more than a block or two of it.
+#
+# Channel order is the same as import_data_dep: input0, input1, output0, output1.
+
+class CaptureReader:
+    def __init__(self, file_loc, truncate=True, scan_block=65536):
+        self.data = np.load(file_loc, mmap_mode='r')
+        if self.data.ndim != 2:
+            raise Exception("Expecting a (channels, samples) capture, got shape %s"%(self.data.shape,))
+        self.truncate = truncate
+        self.scan_block = scan_block
+        self._offsets = {}
+
+    @property
+    def nchannels(self):
+        return self.data.shape[0]
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def offset(self, ch):
+        """ Index of the first non-zero sample in channel <ch> (0 if there isn't one, like argmax) """
+        if ch not in self._offsets:
+            row = self.data[ch]
+            self._offsets[ch] = 0
+            for start in range(0, len(row), self.scan_block):
+                nz = np.flatnonzero(row[start:start+self.scan_block])
+                if len(nz):
+                    self._offsets[ch] = start + int(nz[0])
+                    break
+        return self._offsets[ch]
+
+    def offsets(self):
+        return [ self.offset(ch) for ch in range(self.nchannels) ]
+
+    def _convert(self, raw):
+        # Truncate to 12 bits from 16, data was originally 12 and MSB aligned in 16
+        if self.truncate:
+            return np.right_shift(raw, 4).astype(np.int16)
+        return np.array(raw)
+
+    def read(self, ch, start=0, stop=None):
+        """ Samples [start, stop) of channel <ch> (or a list of channels), converted """
+        return self._convert(self.data[ch, start:stop])
+
+    def chunks(self, chunk_size, channels=None, start=0, stop=None):
+        """ Iterates over (first sample index, (nchannels, chunk) array) pairs """
+        if channels is None:
+            channels = list(range(self.nchannels))
+        stop = len(self) if stop is None else min(stop, len(self))
+        for pos in range(start, stop, chunk_size):
+            yield pos, self._convert(self.data[channels, pos:min(pos+chunk_size, stop)])
+
+    def aligned_range(self, ch, samp_per_clock=8):
+        """ (start, stop) of channel <ch> from its first non-zero sample, trimmed to whole clocks """
+        start = self.offset(ch)
+        n = (len(self) - start)//samp_per_clock*samp_per_clock
+        return start, start+n
+
+    def print_offsets(self):
+        names = [ "input0", "input1", "output0", "output1" ]
+        for ch in range(self.nchannels):
+            name = names[ch] if ch < len(names) else "channel%d"%ch
+            print("%s_offset: %s"%(name, self.offset(ch)))
+            print("%s_offset%%8: %s"%(name, self.offset(ch)%8))
+
+def import_data(file_loc, truncate=True, debug=False):
+    """ Same return as IIRSim.import_data_dep. This still reads all four channels in full,
+    use a CaptureReader directly to avoid that.
+    """
+    reader = CaptureReader(file_loc, truncate)
+    if debug:
+        reader.print_offsets()
+    chans = [ reader.read(ch) for ch in range(4) ]
+    return tuple(chans) + tuple(reader.offsets()[0:4])
@@ -0,0 +1,149 @@
+import argparse
+import struct
+
+import numpy as np
+
+import coeff_table
+
+# Single-file binary coefficient database, so the notch retuning path can look up
+# an operating point without walking freq_files/ and parsing text.
+#
+# Layout (all little-endian):
+#   header   : magic "PUEOBQC1", uint32 version, uint32 nregs, uint32 nrecords,
+#              uint32 nfreqs, uint32 nqs, uint32 nspcs, uint32 reserved
+#   axes     : nfreqs x int32 frequencies (MHz), nqs x int32 Q values,
+#              nspcs x int32 samples-per-clock values
+#   index    : nspcs x nfreqs x nqs int32 record numbers (-1 = no record)
+#   records  : nrecords x nregs int32, each in register order (see
+#              coeff_table.register_names). Records shorter than nregs
+#              (4 samples/clock) are zero padded, the length is implied by
+#              the samples-per-clock.
+#
+# Lookups are three dictionary hits and one index read, then a view into the
+# memory-mapped records. The keys have to be exactly on the grid: 300.7 MHz is
+# a KeyError, not the 300 MHz record.
+
+MAGIC = b"PUEOBQC1"
+VERSION = 1
+HEADER = struct.Struct("<8s7I")
+
+def nregs_for(samp_per_clock):
+    return len(coeff_table.register_names(samp_per_clock))
+
+def is_grid_key(v):
+    """ The axes are integers: True if v is one (300.0 is, 300.7 isn't) """
+    try:
+        return int(v) == v
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+def write_store(filename, tables):
+    """ tables is a list of (table, freqs, q_factors, samp_per_clock), each as returned by
+    coeff_table.build_table (table is (len(freqs), len(q_factors), nregs)). Different tables
+    can cover different grids: the axes are the union and missing points get no record.
+    Every frequency, Q and samples-per-clock has to be an integer.
+    """
+    for t in tables:
+        bad = [ v for v in list(t[1]) + list(t[2]) + [ t[3] ] if not is_grid_key(v) ]
+        if bad:
+            raise Exception("Coefficient store axes are integers, can't store %s"%bad)
+    freqs = sorted(set(int(f) for t in tables for f in t[1]))
+    qs = sorted(set(int(q) for t in tables for q in t[2]))
+    spcs = sorted(set(int(t[3]) for t in tables))
+    nregs = max(nregs_for(s) for s in spcs)
+    fidx = { f : i for i, f in enumerate(freqs) }
+    qidx = { q : i for i, q in enumerate(qs) }
+    sidx = { s : i for i, s in enumerate(spcs) }
+
+    index = np.full((len(spcs), len(freqs), len(qs)), -1, dtype=np.int32)
+    records = []
+    for table, tfreqs, tqs, spc in tables:
+        table = np.asarray(table)
+        for i, f in enumerate(tfreqs):
+            for j, q in enumerate(tqs):
+                index[sidx[int(spc)], fidx[int(f)], qidx[int(q)]] = len(records)
+                rec = np.zeros(nregs, dtype=np.int32)
+                rec[:table.shape[2]] = table[i, j]
+                records.append(rec)
+    records = np.array(records, dtype=np.int32).reshape(-1, nregs)
+
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, nregs, len(records), len(freqs), len(qs), len(spcs), 0))
+        f.write(np.array(freqs, dtype="<i4").tobytes())
+        f.write(np.array(qs, dtype="<i4").tobytes())
+        f.write(np.array(spcs, dtype="<i4").tobytes())
+        f.write(index.astype("<i4").tobytes())
+        f.write(records.astype("<i4").tobytes())
+
+class CoeffStore:
+    """ Memory-mapped reader for a file written by write_store """
+    def __init__(self, filename):
+        self.filename = filename
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, version, nregs, nrecords, nfreqs, nqs, nspcs, _ = HEADER.unpack(bytes(raw[0:HEADER.size]))
+        if magic != MAGIC:
+            raise Exception("%s is not a coefficient store"%filename)
+        if version != VERSION:
+            raise Exception("Coefficient store version %d not supported"%version)
+        self.nregs = nregs
+        pos = HEADER.size
+        def take(n, shape):
+            nonlocal pos
+            arr = raw[pos:pos+4*n].view("<i4").reshape(shape)
+            pos += 4*n
+            return arr
+        self.freqs = take(nfreqs, (nfreqs,))
+        self.q_factors = take(nqs, (nqs,))
+        self.spcs = take(nspcs, (nspcs,))
+        self.index = take(nspcs*nfreqs*nqs, (nspcs, nfreqs, nqs))
+        self.records = take(nrecords*nregs, (nrecords, nregs))
+        self._fidx = { int(f) : i for i, f in enumerate(self.freqs) }
+        self._qidx = { int(q) : i for i, q in enumerate(self.q_factors) }
+        self._sidx = { int(s) : i for i, s in enumerate(self.spcs) }
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        try:
+            self.record_number(*key)
+        except KeyError:
+            return False
+        return True
+
+    def record_number(self, notch_freq, q_factor, samp_per_clock=8):
+        """ Record for one operating point. KeyError if there isn't one, including for
+        frequencies/Qs that aren't integers (they're never rounded onto the grid)
+        """
+        if not all(is_grid_key(v) for v in (notch_freq, q_factor, samp_per_clock)):
+            raise KeyError("No coefficients for %s MHz, Q %s, %s samples/clock (not on the integer grid)"%(notch_freq, q_factor, samp_per_clock))
+        try:
+            rec = int(self.index[self._sidx[int(samp_per_clock)],
+                                 self._fidx[int(notch_freq)],
+                                 self._qidx[int(q_factor)]])
+        except KeyError:
+            rec = -1
+        if rec < 0:
+            raise KeyError("No coefficients for %s MHz, Q %s, %s samples/clock"%(notch_freq, q_factor, samp_per_clock))
+        return rec
+
+    def lookup(self, notch_freq, q_factor, samp_per_clock=8):
+        """ Register-ordered coefficient vector for one operating point (read-only view) """
+        rec = self.record_number(notch_freq, q_factor, samp_per_clock)
+        return self.records[rec, :nregs_for(samp_per_clock)]
+
+    def lookup_named(self, notch_freq, q_factor, samp_per_clock=8):
+        """ Same as lookup, but as a dictionary keyed by register name """
+        return dict(zip(coeff_table.register_names(samp_per_clock),
+                        (int(v) for v in self.lookup(notch_freq, q_factor, samp_per_clock))))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a coefficient store from coeff_table outputs.")
+    parser.add_argument("outfile", help="Output coefficient store")
+    parser.add_argument("tables", nargs="+", help="Tables (.npz) from coeff_table.py")
+    args = parser.parse_args()
+
+    tables = [ coeff_table.load_table(t) for t in args.tables ]
+    write_store(args.outfile, tables)
+    store = CoeffStore(args.outfile)
+    print("Wrote %d records to \"%s\""%(len(store), args.outfile))
@@ -0,0 +1,159 @@
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import signal
+from scipy.special import eval_chebyu
+
+# Builds the whole notch coefficient library (frequency x Q grid) in one go.
+# The per-point work in generate_coeffs*.py is iirnotch + iir_biquad_coeffs, and
+# iir_biquad_coeffs calls eval_chebyu for the same three or four orders a dozen
+# times. Here the Chebyshev polynomials are evaluated once per (mag, angle) for
+# all orders at once, the coefficients are built for a whole row of the grid in
+# array form, and the rows are spread over a process pool.
+#
+# The integers are identical to what generate_coeffs*.py write out (same
+# eval_chebyu, same pow and floor), the register order is the same as the
+# coeff_file.write sequence there.
+
+def notch_pole(notch_freq, q_factor, samp_per_clock=8):
+    """ Returns (b, a, mag, angle) for an iirnotch, like generate_coeffs_v2 does it.
+    The natural RFSoC grouping is 8, so the sample rate scales with samp_per_clock.
+    """
+    b, a = signal.iirnotch(notch_freq, q_factor, 3000/(8/samp_per_clock))
+    pole = signal.tf2zpk(b, a)[1][0]
+    return b, a, np.abs(pole), np.angle(pole)
+
+def chebyu_orders(nmax, angle):
+    """ U_0..U_nmax at cos(angle), evaluated once. Returns (nmax+1, len(angle)) """
+    angle = np.atleast_1d(angle)
+    return eval_chebyu(np.arange(nmax+1)[:, np.newaxis], np.cos(angle)[np.newaxis, :])
+
+def iir_biquad_coeffs_vec(mag, angle, samp_per_clock=8):
+    """ Array version of IIRSim.iir_biquad_coeffs: mag/angle are 1-D, returns (len(mag), 2*samp_per_clock+5) """
+    mag = np.atleast_1d(np.asarray(mag, dtype=np.float64))
+    s = samp_per_clock
+    U = chebyu_orders(s, angle)
+    n = 2*s-3
+    coeffs = np.zeros((len(mag), n+8))
+    for i in range(0, s-2):
+        coeffs[:, i] = pow(mag, i+1)*U[i+1]
+    for i in range(0, s-1):
+        coeffs[:, s-2+i] = pow(mag, i+1)*U[i+1]
+    # D_FF, D_FG, E_GF, E_GG
+    coeffs[:, n+0] = -1*pow(mag, s)*U[s-2]
+    coeffs[:, n+1] = pow(mag, s-1)*U[s-1]
+    coeffs[:, n+2] = -1*pow(mag, s+1)*U[s-1]
+    coeffs[:, n+3] = pow(mag, s)*U[s]
+    # C
+    coeffs[:, n+4] = pow(mag, 2*s)*(pow(U[s-2], 2) - pow(U[s-1], 2))
+    coeffs[:, n+5] = pow(mag, 2*s-1)*((U[s-1])*(U[s] - U[s-2]))
+    coeffs[:, n+6] = pow(mag, 2*s+1)*((U[s-1])*(U[s-2] - U[s]))
+    coeffs[:, n+7] = pow(mag, 2*s)*(pow(U[s], 2) - pow(U[s-1], 2))
+    return coeffs
+
+def to_fixed(x, frac=14):
+    """ Coefficients are in Q4.14, where the sign bit IS counted """
+    return np.array(np.floor(np.asarray(x) * (2**frac)), dtype=np.int64)
+
+def register_names(samp_per_clock=8):
+    """ Names of the entries in a register-ordered coefficient vector """
+    s = samp_per_clock
+    names = [ 'B', 'A', 'C2', 'C3', 'C1', 'C0', "a2'", "a1'", 'D_FF' ]
+    names += [ 'fX%d'%(i+1) for i in reversed(range(s-2)) ]
+    names += [ 'E_GG' ]
+    names += [ 'gX%d'%(i+1) for i in reversed(range(s-1)) ]
+    names += [ 'D_FG', 'E_GF', 'a0', 'a1', 'a2', 'b0', 'b1', 'b2' ]
+    return names
+
+def register_order(b_fixed, a_fixed, coeffs_fixed, samp_per_clock=8):
+    """ Puts the fixed point b, a and clustered look-ahead coefficients in the order
+    generate_coeffs*.py write them out. All arguments can have leading batch dimensions.
+    """
+    s = samp_per_clock
+    n = 2*s-3
+    b_fixed = np.asarray(b_fixed, dtype=np.int64)
+    a_fixed = np.asarray(a_fixed, dtype=np.int64)
+    coeffs_fixed = np.asarray(coeffs_fixed, dtype=np.int64)
+    f_fir = coeffs_fixed[..., 0:s-2]
+    g_fir = coeffs_fixed[..., s-2:n]
+    D_FF, D_FG, E_GF, E_GG = (coeffs_fixed[..., n+k:n+k+1] for k in range(4))
+    C = coeffs_fixed[..., n+4:n+8]
+    return np.concatenate((b_fixed[..., 1:2], b_fixed[..., 0:1],
+                           C[..., 2:3], C[..., 3:4], C[..., 1:2], C[..., 0:1],
+                           a_fixed[..., 2:3], a_fixed[..., 1:2],
+                           D_FF, f_fir[..., ::-1],
+                           E_GG, g_fir[..., ::-1],
+                           D_FG, E_GF,
+                           a_fixed, b_fixed), axis=-1)
+
+def _table_row(args):
+    """ One Q value across all frequencies. Returns (len(freqs), nregs) int64 """
+    freqs, q_factor, samp_per_clock = args
+    pts = [ notch_pole(f, q_factor, samp_per_clock) for f in freqs ]
+    b = np.array([ p[0] for p in pts ])
+    a = np.array([ p[1] for p in pts ])
+    mag = np.array([ p[2] for p in pts ])
+    angle = np.array([ p[3] for p in pts ])
+    coeffs = iir_biquad_coeffs_vec(mag, angle, samp_per_clock)
+    return register_order(to_fixed(b), to_fixed(a), to_fixed(coeffs), samp_per_clock)
+
+def build_table(freqs, q_factors, samp_per_clock=8, processes=None):
+    """ Register-ordered coefficient vectors for every (frequency, Q) point.
+    Returns an int64 array of shape (len(freqs), len(q_factors), nregs).
+    processes=1 runs serially, None uses all the cores.
+    """
+    freqs = list(freqs)
+    jobs = [ (freqs, q, samp_per_clock) for q in q_factors ]
+    if processes == 1:
+        rows = list(map(_table_row, jobs))
+    else:
+        with Pool(processes) as pool:
+            rows = pool.map(_table_row, jobs)
+    return np.stack(rows, axis=1)
+
+def save_table(filename, table, freqs, q_factors, samp_per_clock=8):
+    """ Everything in one file, indexed by the freqs/q_factors arrays stored alongside """
+    np.savez(filename, table=table.astype(np.int32),
+             freqs=np.asarray(freqs), q_factors=np.asarray(q_factors),
+             samp_per_clock=samp_per_clock)
+
+def load_table(filename):
+    """ Returns (table, freqs, q_factors, samp_per_clock) """
+    with np.load(filename) as f:
+        return f['table'], f['freqs'], f['q_factors'], int(f['samp_per_clock'])
+
+def legacy_filename(notch_freq, q_factor, samp_per_clock=8):
+    if samp_per_clock == 4:
+        return "coeff_4sample_file_%sMHz_%sQ.dat"%(notch_freq, q_factor)
+    return "coeff_file_%sMHz_%sQ.dat"%(notch_freq, q_factor)
+
+def export_legacy(table, freqs, q_factors, samp_per_clock=8, outdir="freq_files"):
+    """ Writes the old one-file-per-point text files (one integer per line) """
+    os.makedirs(outdir, exist_ok=True)
+    for i, notch_freq in enumerate(freqs):
+        for j, q_factor in enumerate(q_factors):
+            with open(os.path.join(outdir, legacy_filename(notch_freq, q_factor, samp_per_clock)), "w") as coeff_file:
+                coeff_file.write("".join("%d\n"%v for v in table[i, j]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the notch coefficient table.")
+    parser.add_argument("outfile", help="Output table (.npz)")
+    parser.add_argument("--fmin", type=int, default=50)
+    parser.add_argument("--fmax", type=int, default=1500, help="Exclusive, like range()")
+    parser.add_argument("--fstep", type=int, default=5)
+    parser.add_argument("--qmin", type=int, default=1)
+    parser.add_argument("--qmax", type=int, default=18, help="Inclusive")
+    parser.add_argument("--samp-per-clock", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--legacy-dir", default=None, help="Also write the per-point .dat files here")
+    args = parser.parse_args()
+
+    freqs = list(range(args.fmin, args.fmax, args.fstep))
+    q_factors = list(range(args.qmin, args.qmax+1))
+    table = build_table(freqs, q_factors, args.samp_per_clock, args.processes)
+    save_table(args.outfile, table, freqs, q_factors, args.samp_per_clock)
+    print("Wrote %d x %d points to \"%s\""%(len(freqs), len(q_factors), args.outfile))
+    if args.legacy_dir is not None:
+        export_legacy(table, freqs, q_factors, args.samp_per_clock, args.legacy_dir)
@@ -0,0 +1,109 @@
+import argparse
+
+import numpy as np
+
+# Model of hdl_v2/dual_pueo_envelope_v2.sv, for any number of beams/channels
+# (and both the A and B inputs) at once: every leading axis is just batched.
+#
+# Per clock the 8 squared samples (14 bits) are summed in halves, sum[3:0] and
+# sum[7:4] (16 bits each), and the output is
+#   sum[3:0](t) + max(sum[7:4](t), sum[7:4](t-1))
+# i.e. the larger of the 8 sample boxcars ending at sample 7 and at sample 3,
+# 17 bits. The halves come from a cumulative sum over the whole block sampled
+# every 4 samples, so nothing is summed more than once.
+#
+# The firmware doesn't add the bottom 3 bits in the DSP: LOWBIT_LUT and
+# BIT2_CMPR squeeze them into 3 low bits plus one carry bit per lane. That only
+# works because the inputs are squares (bit 1 is always 0, the low nibble is
+# 0, 1, 4 or 9), where it's exact, so the plain sum is the default.
+# lut=True does it the way the LUTs do, bit for bit, for inputs that aren't
+# squares.
+
+NSAMP = 8
+NBITS = 14
+OUT_BITS = 17
+HALF_BITS = 16
+
+LOWBIT_INIT = 0x7EE87EE869966996
+CMPR0_INIT = 0xFFFF8228
+CMPR12_INIT = 0xFFFFC0C0FF28FF28
+
+def _lut(init, idx):
+    return ((np.uint64(init) >> idx.astype(np.uint64)) & np.uint64(1)).astype(np.int64)
+
+def _bit(x, b):
+    return (x >> b) & 1
+
+def lut_half_sums(sq):
+    """ The LUT/DSP sum of each group of 4 samples: sq (..., 4*n) -> (..., n) """
+    sq = np.asarray(sq, dtype=np.int64)
+    i = sq.reshape(sq.shape[:-1] + (-1, 4))
+    b2 = _bit(i, 2)
+    b3 = _bit(i, 3)
+    cmpr0 = _lut(CMPR0_INIT, b3[..., 0] << 4 | b2[..., 3] << 3 | b2[..., 2] << 2 | b2[..., 1] << 1 | b2[..., 0])
+    idx = b3[..., 2] << 4 | b3[..., 1] << 3 | b2[..., 3] << 2 | b2[..., 2] << 1 | b2[..., 1]
+    cmpr1 = _lut(CMPR12_INIT, idx)
+    cmpr2 = _lut(CMPR12_INIT, 32 | idx)
+    b0 = _bit(i, 0)
+    lidx = b0[..., 3] << 3 | b0[..., 2] << 2 | b0[..., 1] << 1 | b0[..., 0]
+    low = (_lut(LOWBIT_INIT, lidx) | _lut(LOWBIT_INIT, 32 | lidx) << 1
+           | ((b2.sum(axis=-1) + b0.all(axis=-1)) & 1) << 2)
+    lanes = ((i >> 4) & 0x3FF).sum(axis=-1)*2 + cmpr0 + cmpr1 + cmpr2 + b3[..., 3]
+    return (lanes << 3) | low
+
+def half_sums(sq, lut=False):
+    """ (sum[3:0], sum[7:4]) per clock, each (..., nclocks), from sq (..., 8*nclocks) """
+    sq = np.asarray(sq)
+    if lut:
+        s = lut_half_sums(sq)
+    else:
+        c = np.zeros(sq.shape[:-1] + (sq.shape[-1] + 1,), dtype=np.int64)
+        np.cumsum(sq, axis=-1, out=c[..., 1:])
+        s = c[..., 4::4] - c[..., :-4:4]
+    return s[..., 0::2], s[..., 1::2]
+
+def envelope(sq, last74=None, lut=False):
+    """ Envelope (..., nclocks) from sq (..., 8*nclocks). last74 is sum[7:4] of the clock before
+    (0 at power-up). Returns (envelope, last74 for the next block).
+    """
+    s30, s74 = half_sums(sq, lut)
+    if last74 is None:
+        last74 = np.zeros(s74.shape[:-1], dtype=np.int64)
+    prev74 = np.concatenate((np.asarray(last74)[..., np.newaxis], s74[..., :-1]), axis=-1)
+    env = (s30 + np.maximum(prev74, s74)) & ((1 << OUT_BITS) - 1)
+    return env, (s74[..., -1] if s74.shape[-1] else last74)
+
+class EnvelopeModel:
+    """ dual_pueo_envelope_v2 over a stream of blocks, carrying sum[7:4] between them """
+    def __init__(self, lut=False):
+        self.lut = lut
+        self.reset()
+
+    def reset(self):
+        self.last74 = None
+
+    def run(self, sq):
+        env, self.last74 = envelope(sq, self.last74, self.lut)
+        return env
+
+def efficiency(env, thresholds, axis=0):
+    """ Fraction of events (along axis) whose peak envelope is >= each threshold:
+    env (..., nclocks) -> (thresholds, remaining axes)
+    """
+    peak = np.asarray(env).max(axis=-1)
+    thr = np.asarray(thresholds).reshape((-1,) + (1,)*peak.ndim)
+    return (peak[np.newaxis] >= thr).mean(axis=axis+1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Envelope trigger efficiency for injected signals.")
+    parser.add_argument("beams", help=".npy of signed beam samples (events, ..., 8*nclocks)")
+    parser.add_argument("--thresholds", type=int, nargs=3, default=[0, 20000, 1000], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--lut", action="store_true", help="Add up the low bits the way the LUTs do")
+    args = parser.parse_args()
+
+    b = np.load(args.beams, mmap_mode='r').astype(np.int64)
+    env, _ = envelope(b*b, lut=args.lut)
+    thr = np.arange(args.thresholds[0], args.thresholds[1]+1, args.thresholds[2])
+    eff = efficiency(env, thr)
+    for t, e in zip(thr, eff.reshape(len(thr), -1)):
+        print(f'{t}: ' + " ".join(f'{x:.3f}' for x in e))
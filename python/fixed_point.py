@@ -0,0 +1,75 @@
+import numpy as np
+
+# Array versions of the Q-format helpers in IIRSim.py. Everything here works on
+# whole int64 arrays at once, with the masks computed once per format instead of
+# once per sample. Formats are Q<a_int>.<a_frac> (ARM), where the sign bit IS
+# counted in a_int, same as convert_to_fixed_point.
+
+def qmask(bits):
+    """ Returns the all-ones mask for a <bits> bit word """
+    return (1 << bits) - 1
+
+def qlimits(a_int, a_frac):
+    """ Returns the (min, max) raw signed integer for a Q<a_int>.<a_frac> number """
+    bits = a_int + a_frac
+    return -(1 << (bits-1)), (1 << (bits-1)) - 1
+
+def quantize(a, a_int, a_frac, allow_overflow=False):
+    """ Floors a (float or array) onto a Q<a_int>.<a_frac> grid and returns the raw *signed* integers.
+    Like convert_to_fixed_point, values outside the integer range raise unless allow_overflow,
+    in which case they are wrapped (the firmware just drops the top bits).
+    """
+    a = np.asarray(a, dtype=np.float64)
+    if not allow_overflow:
+        lim = 2.0**max(a_int-1, 0)
+        bad = (a >= lim) | (a < -lim)
+        if np.any(bad):
+            raise Exception("Value %s out of bounds"%a[bad].flat[0])
+    raw = np.floor(a * (2.0**a_frac)).astype(np.int64)
+    if allow_overflow:
+        raw = wrap(raw, a_int + a_frac)
+    return raw
+
+def to_unsigned(raw, bits):
+    """ Signed raw integers -> two's complement representation in <bits> bits (what convert_to_fixed_point returns) """
+    return np.bitwise_and(np.asarray(raw, dtype=np.int64), qmask(bits))
+
+def to_signed(raw, bits):
+    """ Reinterprets the low <bits> bits of raw as a two's complement number """
+    sign = np.int64(1 << (bits-1))
+    raw = np.bitwise_and(np.asarray(raw, dtype=np.int64), qmask(bits))
+    return np.bitwise_xor(raw, sign) - sign
+
+def wrap(raw, bits):
+    """ Drops everything above <bits> bits, keeping the sign (overflow wraps around) """
+    return to_signed(raw, bits)
+
+def saturate(raw, bits):
+    """ Clips raw signed integers to the range of a <bits> bit two's complement number """
+    return np.clip(np.asarray(raw, dtype=np.int64), -(1 << (bits-1)), (1 << (bits-1)) - 1)
+
+def requantize(raw, in_frac, out_frac):
+    """ Moves raw integers from <in_frac> to <out_frac> fractional bits. Dropping bits is a
+    floor (arithmetic right shift), same as just cutting the LSBs off in firmware.
+    """
+    raw = np.asarray(raw, dtype=np.int64)
+    if out_frac < in_frac:
+        return np.right_shift(raw, in_frac - out_frac)
+    return np.left_shift(raw, out_frac - in_frac)
+
+def dequantize(raw, a_frac):
+    """ Raw signed integers -> float """
+    return np.asarray(raw, dtype=np.int64) / (2.0**a_frac)
+
+def fir_fixed_point(c_raw, x_raw, start=None):
+    """ Integer FIR, y[i] = sum_j c[j]*x[i-j]. Outputs before <start> (default len(c)) are zero,
+    matching the manual_fir_section loops. Full precision, no shifting.
+    """
+    c_raw = np.asarray(c_raw, dtype=np.int64)
+    x_raw = np.asarray(x_raw, dtype=np.int64)
+    if start is None:
+        start = len(c_raw)
+    total = np.zeros(len(x_raw), dtype=np.int64)
+    for j in range(len(c_raw)):
+        total[start:] += c_raw[j] * x_raw[start-j:len(x_raw)-j]
+    return total
@@ -0,0 +1,141 @@
+import argparse
+
+import numpy as np
+
+import agc_model
+
+# Model of hdl/lfsr_rms_mux.sv + xil_tiny_lfsr_3bit.sv: which of the 8 samples
+# of each clock goes to the square accumulator.
+#
+# The "tiny" LFSR is three 12 deep shift registers (an SRL16E at address 10,
+# so 11 clocks, plus tail_ff). Interleaved, the bits going in are one stream
+#   g[3c], g[3c+1], g[3c+2] = shift_in[2], shift_in[1], shift_in[0] at clock c
+#   g[n] = g[n-35] ^ g[n-33]
+# i.e. a 35 bit Fibonacci LFSR stepping 3 bits a clock (x^35 + x^33 + 1), and
+# the select at clock t is tail_ff = { g[3c], g[3c+1], g[3c+2] } for c = t - 12.
+# rst_i zeroes all three bits going in that clock, start_i (the AGC's one-shot
+# lfsr_sync after a reset) sets g[3c]. Everything starts at 0 and stays 0
+# until a start.
+#
+# Despite the comments in the HDL it doesn't repeat after 127 clocks: the
+# period is 2^35-1 clocks (~92 s), so there's no table to precompute. The
+# stream is generated with the recurrence squared up (g[n] = g[n-35*2^k] ^
+# g[n-33*2^k]), which gives the whole sequence between reset/sync points a
+# block of bits at a time, and skip() jumps ahead with a matrix power.
+#
+# As built, lfsr_rms_mux reads every in_vec from in_i[NBITS*i % NBITS*NSAMP +: 4]
+# = in_i[3:0], so the mux output is sample 0 whatever the select is (that's
+# agc_model's default). as_built=True in gather() does the same. The output
+# register (1 clock) isn't applied, same as agc_model.
+
+NSAMP = 8
+SEL_BITS = 3
+LFSR_BITS = 35
+LFSR_TAP = 33
+DEPTH = 12
+WINDOW = SEL_BITS*DEPTH
+
+def extend(bits, nbits):
+    """ Appends nbits of free running LFSR stream to bits, seeded from the last 35 of them """
+    out = np.empty(LFSR_BITS + nbits, dtype=np.uint8)
+    out[:LFSR_BITS] = bits[len(bits)-LFSR_BITS:]
+    n = LFSR_BITS
+    while n < len(out):
+        # the recurrence only holds from the seed on
+        k = 0
+        while LFSR_BITS << (k+1) <= n:
+            k += 1
+        m = min(LFSR_TAP << k, len(out) - n)
+        out[n:n+m] = out[n-(LFSR_BITS << k):n-(LFSR_BITS << k)+m] ^ out[n-(LFSR_TAP << k):n-(LFSR_TAP << k)+m]
+        n += m
+    return np.concatenate((bits, out[LFSR_BITS:]))
+
+def _mat_pow(m, p):
+    r = np.eye(m.shape[0], dtype=np.int64)
+    while p:
+        if p & 1:
+            r = (r @ m) & 1
+        m = (m @ m) & 1
+        p >>= 1
+    return r
+
+# one free running clock on the window (oldest bit first)
+_STEP = np.zeros((WINDOW, WINDOW), dtype=np.int64)
+for _i in range(WINDOW - SEL_BITS):
+    _STEP[_i, _i + SEL_BITS] = 1
+for _j in range(SEL_BITS):
+    for _d in (LFSR_BITS, LFSR_TAP):
+        _STEP[WINDOW - SEL_BITS + _j, WINDOW + _j - _d] = 1
+
+class RMSMuxLFSR:
+    """ xil_tiny_lfsr_3bit, carrying its state between run()s """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ power up state (all 0) """
+        self.window = np.zeros(WINDOW, dtype=np.uint8)
+
+    def run(self, nclocks, rst=(), sync=()):
+        """ Selects for the next nclocks clocks ((nclocks,) 0-7). rst and sync are the clocks (from
+        the start of this run) rst_i/start_i are high.
+        """
+        rst = set(int(c) for c in rst if 0 <= c < nclocks)
+        sync = set(int(c) for c in sync if 0 <= c < nclocks)
+        bits = self.window
+        done = 0
+        for c in sorted(rst | sync):
+            bits = extend(bits, SEL_BITS*(c - done))
+            new = extend(bits, SEL_BITS)[-SEL_BITS:]
+            if c in rst:
+                new[:] = 0
+            elif c in sync:
+                new[0] = 1
+            bits = np.concatenate((bits, new))
+            done = c + 1
+        bits = extend(bits, SEL_BITS*(nclocks - done))
+        self.window = bits[len(bits)-WINDOW:].copy()
+        trip = bits[len(bits) - WINDOW - SEL_BITS*nclocks:len(bits) - WINDOW].reshape(-1, SEL_BITS).astype(np.uint8)
+        return (trip[:, 0] << 2) | (trip[:, 1] << 1) | trip[:, 2]
+
+    def skip(self, nclocks):
+        """ Free runs nclocks clocks without generating them """
+        w = (_mat_pow(_STEP, nclocks) @ self.window.astype(np.int64)) & 1
+        self.window = w.astype(np.uint8)
+
+def agc_selects(nclocks, tick_at=0):
+    """ Selects from power up for an AGC first ticked at clock tick_at (lfsr_sync comes a
+    clock later)
+    """
+    return RMSMuxLFSR().run(nclocks, sync=[tick_at + 1])
+
+def gather(absval, select, as_built=False):
+    """ The mux: (nch, 8*nclocks) abs values -> (nch, nclocks) """
+    a = np.asarray(absval).reshape(absval.shape[0], -1, NSAMP)
+    if as_built:
+        return a[..., 0]
+    sel = np.asarray(select, dtype=np.int64)[:a.shape[1]]
+    return np.take_along_axis(a, np.broadcast_to(sel[np.newaxis, :, np.newaxis], (a.shape[0], a.shape[1], 1)), axis=-1)[..., 0]
+
+def mux_bias(absval, select, as_built=False):
+    """ Per channel, mean (abs+0.5)^2 through the mux over the mean over all samples """
+    a = np.asarray(absval, dtype=np.float64)
+    picked = gather(a, select, as_built)[:, :a.shape[1]//NSAMP]
+    full = a[:, :picked.shape[1]*NSAMP]
+    return ((picked + 0.5)**2).mean(axis=1)/((full + 0.5)**2).mean(axis=1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="RMS bias of the lfsr_rms_mux selection for a CW tone.")
+    parser.add_argument("--freq", type=float, default=375e6/8*3, help="tone frequency (Hz)")
+    parser.add_argument("--amplitude", type=float, default=64.0, help="ADC counts")
+    parser.add_argument("--clocks", type=int, default=1 << 20)
+    parser.add_argument("--scale", type=int, default=agc_model.UNITY_SCALE)
+    args = parser.parse_args()
+
+    t = np.arange(NSAMP*args.clocks)/(NSAMP*375e6)
+    dat = np.rint(args.amplitude*np.sin(2*np.pi*args.freq*t))[np.newaxis].astype(np.int16)
+    s = agc_model.agc_samples(dat, args.scale)
+    sel = agc_selects(args.clocks)
+    print(f'lfsr_rms_mux: select counts {np.bincount(sel, minlength=NSAMP).tolist()}')
+    print(f'lfsr_rms_mux: mean square bias {mux_bias(s["abs"], sel)[0]:.4f} (LFSR), '
+          f'{mux_bias(s["abs"], sel, as_built=True)[0]:.4f} (as built, sample 0)')
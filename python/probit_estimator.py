@@ -0,0 +1,117 @@
+import argparse
+
+import numpy as np
+from scipy import special
+
+import agc_model
+import fixed_point as fxp
+from capture_reader import CaptureReader
+
+# Noise level and DC offset from the probit counts (probit_accumulator.sv),
+# without squaring anything.
+#
+# The AGC's gt/lt flags are set when the scaled sample is >= +8 or < -8 output
+# LSBs (P >= 2^26, P < -2^26 in agc_dsp), i.e. at +/-2 sigma once the AGC has
+# settled. For 12 bit data with scale/offset registers that's
+#   gt : dat >= gt_min     lt : dat <= lt_max
+# integer thresholds (thresholds()). For gaussian noise of mean mu and sigma s,
+# and the sample being the rounded continuous value,
+#   gt/n = Q((gt_min - 0.5 - mu)/s)    lt/n = Q((mu - lt_max - 0.5)/s)
+# so with a = Qinv(gt/n), b = Qinv(lt/n)
+#   s  = (gt_min - lt_max - 1)/(a + b)
+#   mu = gt_min - 0.5 - a*s
+# Qinv comes from a table (log probability -> z), interpolated.
+#
+# ProbitEstimator keeps only the running counts, so blocks can stream through
+# at whatever rate they come in; every update() also gives that block's own
+# estimate. from_readbacks() does the same for the 0x4008/0x400C readbacks.
+
+LEVEL = 8
+P_LEVEL = LEVEL << agc_model.LSB
+Z_MAX = 6.0
+TABLE_SIZE = 4097
+
+_Z = np.linspace(-Z_MAX, Z_MAX, TABLE_SIZE)
+_LOGQ = np.log(special.ndtr(-_Z))
+
+def qinv(p):
+    """ z with P(x > z) = p for a unit normal, from the table (clipped to +/-Z_MAX) """
+    p = np.clip(np.asarray(p, dtype=np.float64), special.ndtr(-Z_MAX), special.ndtr(Z_MAX))
+    return np.interp(np.log(p), _LOGQ[::-1], _Z[::-1])
+
+def thresholds(scale=agc_model.UNITY_SCALE, offset=0):
+    """ (gt_min, lt_max) 12 bit data thresholds for the gt/lt flags, per scale/offset
+    (anything that broadcasts)
+    """
+    scale = np.asarray(scale, dtype=np.int64)
+    off = np.asarray(fxp.to_signed(offset, agc_model.OFFSET_BITS), dtype=np.int64)
+    # smallest AD with AD*scale >= 2^26, largest with AD*scale < -2^26
+    ad_gt = -((-P_LEVEL) // scale)
+    ad_lt = (-P_LEVEL - 1) // scale
+    gt_min = -((off - ad_gt) // 256)
+    lt_max = (ad_lt - off) // 256
+    return gt_min, lt_max
+
+def invert(gt, lt, n, gt_min, lt_max):
+    """ (sigma, mean) in ADC counts from gt/lt counts out of n samples """
+    a = qinv(np.asarray(gt)/n)
+    b = qinv(np.asarray(lt)/n)
+    sigma = (np.asarray(gt_min) - np.asarray(lt_max) - 1)/np.maximum(a + b, 1e-9)
+    return sigma, gt_min - 0.5 - a*sigma
+
+def from_readbacks(gt, lt, scale=agc_model.UNITY_SCALE, offset=0, timescale_reduction=agc_model.TIMESCALE_REDUCTION):
+    """ (sigma, mean) in ADC counts from one AGC cycle's gt/lt readbacks """
+    n = agc_model.NSAMP*agc_model.window_clocks(timescale_reduction)
+    return invert(gt, lt, n, *thresholds(scale, offset))
+
+class ProbitEstimator:
+    """ Running gt/lt counts per channel. scale/offset are the AGC registers (scalars or per channel). """
+    def __init__(self, nch, scale=agc_model.UNITY_SCALE, offset=0):
+        self.nch = nch
+        gt_min, lt_max = thresholds(scale, offset)
+        self.gt_min = np.broadcast_to(gt_min, (nch,)).copy()
+        self.lt_max = np.broadcast_to(lt_max, (nch,)).copy()
+        self.reset()
+
+    def reset(self):
+        self.gt = np.zeros(self.nch, dtype=np.int64)
+        self.lt = np.zeros(self.nch, dtype=np.int64)
+        self.n = 0
+
+    def update(self, block):
+        """ Counts a (nch, n) block of 12 bit data, returns that block's (sigma, mean) """
+        block = np.asarray(block)
+        gt = np.count_nonzero(block >= self.gt_min[:, np.newaxis], axis=1)
+        lt = np.count_nonzero(block <= self.lt_max[:, np.newaxis], axis=1)
+        self.gt += gt
+        self.lt += lt
+        self.n += block.shape[1]
+        return invert(gt, lt, block.shape[1], self.gt_min, self.lt_max)
+
+    def estimate(self):
+        """ (sigma, mean) over everything since the last reset """
+        return invert(self.gt, self.lt, max(self.n, 1), self.gt_min, self.lt_max)
+
+    def readback(self):
+        """ What the probit accumulators would read (21 bits) """
+        mask = fxp.qmask(agc_model.PR_BITS)
+        return self.gt & mask, self.lt & mask
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-channel noise level of a capture from the probit counts.")
+    parser.add_argument("capture", help="(channels, samples) .npy capture")
+    parser.add_argument("--scale", type=int, default=agc_model.UNITY_SCALE, help="raw scale register (0x4010)")
+    parser.add_argument("--offset", type=int, default=0, help="raw offset register (0x4014)")
+    parser.add_argument("--block", type=int, default=65536, help="samples per block")
+    parser.add_argument("--channels", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    reader = CaptureReader(args.capture)
+    est = None
+    for pos, x in reader.chunks(args.block, args.channels):
+        if est is None:
+            est = ProbitEstimator(x.shape[0], args.scale, args.offset)
+        sigma, mean = est.update(x)
+        print(f'{pos}: ' + "  ".join(f'{s:.2f}/{m:+.2f}' for s, m in zip(sigma, mean)))
+    sigma, mean = est.estimate()
+    print('probit_estimator: sigma ' + " ".join(f'{s:.3f}' for s in sigma) + ', mean ' + " ".join(f'{m:+.3f}' for m in mean))
@@ -1,31 +1,68 @@
-import pickle
 import argparse
 import itertools
 import io
 from pprint import pprint
 
+def simplify_beams( rawBeams ):
+    """ Turns the pickled beams into simpler dictionaries with plain int tuples """
+    beams = []
+    for b in rawBeams:
+        bb = {}
+        bb['LeftDelays'] = tuple(map(int, b['LeftAdder']))
+        bb['LeftOffset'] = int(b['LeftOffset'])
+        bb['RightDelays'] = tuple(map(int, b['RightAdder']))
+        bb['RightOffset'] = int(b['RightOffset'])
+        bb['TopDelays'] = tuple(map(int, b['TopAdder'])) if b['TopAdder'] is not None else None
+        bb['TopOffset'] = int(b['TopOffset']) if b['TopOffset'] is not None else 0
+        bb['Index'] = b['Index']
+        bb['L2Mask'] = b['L2Mask']
+        bb['El'] = float(b['El']) if 'El' in b else None
+        bb['Az'] = float(b['Az']) if 'Az' in b else None
+        beams.append(bb)
+    return beams
+
 def meta_indices( beams, mask ):
     """ Returns list of beams have the specified bits set in the L2 Mask. """
     return [ b['Index'] for b in filter(lambda x : x['L2Mask'] & mask, beams)]
 
+def all_meta_indices( beams, nbits=8, length=22 ):
+    """ meta_indices for every L2 Mask bit in one pass, padded with 255 to length. """
+    metas = [ [] for i in range(nbits) ]
+    for b in beams:
+        for i in range(nbits):
+            if b['L2Mask'] & (1<<i):
+                metas[i].append(b['Index'])
+    return [ m+[255]*(length-len(m)) if len(m) < length else m for m in metas ]
+
 def beam_adder_indices( beams, left, right, top ):
     """ Returns the adder (sub-beam) indices for all the beams. 255 = no sub-beam """
+    # first occurrence wins, same as list.index
+    lookup = lambda adders : { a : i for i, a in reversed(list(enumerate(adders))) }
+    leftLookup = lookup(left)
+    rightLookup = lookup(right)
+    topLookup = lookup(top)
     indices = []
     for b in beams:
-        leftIndex = left.index(b['LeftDelays'])
-        rightIndex = right.index(b['RightDelays'])
+        leftIndex = leftLookup[b['LeftDelays']]
+        rightIndex = rightLookup[b['RightDelays']]
         if b['TopDelays'] is not None:
-            topIndex = top.index(b['TopDelays'])
+            topIndex = topLookup[b['TopDelays']]
         else:
             topIndex = 255
         indices.append( (leftIndex, rightIndex, topIndex) )
-    return indices                               
+    return indices
 
 def transform_adders( adders, delayName, offsetName, beams, verbose=True):
     """ Find the minimum offset of an adder and integrate it into the delay """
+    # index the beams by adder first, so transforming one adder can't
+    # pick up beams another adder was just moved onto
+    users = {}
+    for b in beams:
+        users.setdefault(b[delayName], []).append(b)
     transformed = []
+    seen = set()
     for adder in adders:
-        selected = list(filter(lambda x : (x[delayName] == adder), beams))
+        selected = users[adder]
         offsets = [ x[offsetName] for x in selected ]
         minOffset = min(offsets)
         maxOffset = max(offsets)
@@ -35,9 +72,20 @@ def transform_adders( adders, delayName, offsetName, beams, verbose=True):
         for b in selected:
             b[offsetName] -= minOffset
             b[delayName] = newAdder
-        transformed.append(newAdder)
+        if newAdder not in seen:
+            seen.add(newAdder)
+            transformed.append(newAdder)
     return transformed
 
+def pad_left_adders( left, right ):
+    """ beamform_trigger_v3 declares right_store[NUM_LEFT_ADDERS-1:0], so there have to be at
+    least as many left adders as right ones. Pads the left side with copies of the last one,
+    which no beam uses (synthesis drops them).
+    """
+    if len(right) > len(left):
+        left = list(left) + [ left[-1] if left else right[0] ]*(len(right) - len(left))
+    return left
+
 def sv_string(k, v, type_name=None):
     def print_to_string(*args, **kwargs):
         with io.StringIO() as output:
@@ -75,33 +123,13 @@ def sv_string(k, v, type_name=None):
     else:
         print(f'what type is this: {type(v)}')
     
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument("infile", help="pickled beam file")
-    parser.add_argument("outfile", help="output SV package")
-    
-    args = parser.parse_args()
 
-    rawBeams = None
-    with open(args.infile, 'rb') as f:
-        rawBeams = pickle.load(f)
-
-    NBEAMS = len(rawBeams)
-    # make a simpler dictionary
-    beams = []
-    for b in rawBeams:
-        bb = {}
-        bb['LeftDelays'] = tuple(map(int, b['LeftAdder']))
-        bb['LeftOffset'] = int(b['LeftOffset'])
-        bb['RightDelays'] = tuple(map(int, b['RightAdder']))
-        bb['RightOffset'] = int(b['RightOffset'])
-        bb['TopDelays'] = tuple(map(int, b['TopAdder'])) if b['TopAdder'] is not None else None
-        bb['TopOffset'] = int(b['TopOffset']) if b['TopOffset'] is not None else 0
-        bb['Index'] = b['Index']
-        bb['L2Mask'] = b['L2Mask']
-        beams.append(bb)
-        
-    print(f'process_jjb: loaded {NBEAMS} beam(s)')
+def compile_params( beams, optimize=False, verbose=True ):
+    """ Builds the pueo_beams package parameters from simplified beams (see simplify_beams).
+    The beams get their adders transformed in place. optimize=True reallocates the adders
+    with adder_alloc.
+    """
+    log = print if verbose else (lambda *args, **kwargs : None)
 
     # Get our parameters ready
     params = {}
@@ -115,17 +143,17 @@ if __name__ == '__main__':
         if b['TopDelays']:
             topAdders.add(b['TopDelays'])
 
-    print(f'process_jjb: {len(leftAdders)}/{len(rightAdders)}/{len(topAdders)} adders')
+    log(f'process_jjb: {len(leftAdders)}/{len(rightAdders)}/{len(topAdders)} adders')
 
-    transformedLeft = transform_adders(leftAdders, 'LeftDelays', 'LeftOffset', beams)
-    transformedRight = transform_adders(rightAdders, 'RightDelays', 'RightOffset', beams)
+    transformedLeft = transform_adders(leftAdders, 'LeftDelays', 'LeftOffset', beams, verbose)
+    transformedRight = transform_adders(rightAdders, 'RightDelays', 'RightOffset', beams, verbose)
     # just to keep the naming the same, top adders always begin at 0
     transformedTop = list(topAdders)
 
     leftOffsets = [ b['LeftOffset'] for b in beams ]
     rightOffsets = [ b['RightOffset'] for b in beams ]
-    topOffsets = [ b['TopOffset'] for b in beams ]    
-    
+    topOffsets = [ b['TopOffset'] for b in beams ]
+
     maxLeft = max(itertools.chain(*transformedLeft))
     maxRight = max(itertools.chain(*transformedRight))
     maxTop = max(itertools.chain(*transformedTop))
@@ -133,13 +161,13 @@ if __name__ == '__main__':
     maxLeftOffset = max(leftOffsets)
     maxRightOffset = max(rightOffsets)
     maxTopOffset = max(topOffsets)
-    
-    print(f'Transformed left adders (max delay {maxLeft} / max offset {maxLeftOffset}):')
-    print(transformedLeft)
-    print(f'Transformed right adders (max delay {maxRight} / max offset {maxRightOffset}):')
-    print(transformedRight)
-    print(f'Transformed top adders (max delay {maxTop} / max offset {maxTopOffset}):')
-    print(transformedTop)
+
+    log(f'Transformed left adders (max delay {maxLeft} / max offset {maxLeftOffset}):')
+    log(transformedLeft)
+    log(f'Transformed right adders (max delay {maxRight} / max offset {maxRightOffset}):')
+    log(transformedRight)
+    log(f'Transformed top adders (max delay {maxTop} / max offset {maxTopOffset}):')
+    log(transformedTop)
 
     maxAll = max((maxLeft, maxRight, maxTop))
     # if max is 23, for sample 0, we need to look back
@@ -150,42 +178,23 @@ if __name__ == '__main__':
     # and the sample storage depth is (maxAll//8)+2
     # (the extra is for the undelayed inputs)
     maxDepth = maxAll//8 + 2
-    print(f'Maximum sample delay is {maxAll} - sample store depth is {maxDepth}')
+    log(f'Maximum sample delay is {maxAll} - sample store depth is {maxDepth}')
     maxLeftDepth = maxLeftOffset//8 + 2 if maxLeftOffset > 0 else 1
-    print(f'Max left adder offset is {maxLeftOffset} - left store depth is {maxLeftDepth}')
-    maxRightDepth = maxLeftOffset//8 + 2 if maxRightOffset > 0 else 1
-    print(f'Max right adder offset is {maxRightOffset} - right store depth is {maxRightDepth}')
+    log(f'Max left adder offset is {maxLeftOffset} - left store depth is {maxLeftDepth}')
+    maxRightDepth = maxRightOffset//8 + 2 if maxRightOffset > 0 else 1
+    log(f'Max right adder offset is {maxRightOffset} - right store depth is {maxRightDepth}')
     maxTopDepth = maxTopOffset//8 + 2 if maxTopOffset > 0 else 1
-    print(f'Max top adder offset is {maxTopOffset} - top store depth is {maxTopDepth}')
-
-    meta0 = meta_indices(beams, 0x01)
-    meta0 = meta0+[255]*(22-len(meta0)) if len(meta0) < 22 else meta0
-    print(f'Bit 0 has beam indices: {meta0}')
-    meta1 = meta_indices(beams, 0x02)
-    meta1 = meta1+[255]*(22-len(meta1)) if len(meta1) < 22 else meta1
-    print(f'Bit 1 has beam indices: {meta1}')
-    meta2 = meta_indices(beams, 0x04)
-    meta2 = meta2+[255]*(22-len(meta2)) if len(meta2) < 22 else meta2    
-    print(f'Bit 2 has beam indices: {meta2}')
-    meta3 = meta_indices(beams, 0x08)
-    meta3 = meta3+[255]*(22-len(meta3)) if len(meta3) < 22 else meta3
-    print(f'Bit 3 has beam indices: {meta3}')
-
-    meta4 = meta_indices(beams, 0x10)
-    meta4 = meta4+[255]*(22-len(meta4)) if len(meta4) < 22 else meta4
-    print(f'Bit 4 has beam indices: {meta4}')    
-    meta5 = meta_indices(beams, 0x20)
-    meta5 = meta5+[255]*(22-len(meta5)) if len(meta5) < 22 else meta5
-    print(f'Bit 5 has beam indices: {meta5}')
-    meta6 = meta_indices(beams, 0x40)
-    meta6 = meta6+[255]*(22-len(meta6)) if len(meta6) < 22 else meta6
-    print(f'Bit 6 has beam indices: {meta6}')
-    meta7 = meta_indices(beams, 0x80)
-    meta7 = meta7+[255]*(22-len(meta7)) if len(meta7) < 22 else meta7
-    print(f'Bit 7 has beam indices: {meta7}')    
-
-    print("Determining beam indices.")
+    log(f'Max top adder offset is {maxTopOffset} - top store depth is {maxTopDepth}')
+
+    metas = all_meta_indices(beams)
+    for i, meta in enumerate(metas):
+        log(f'Bit {i} has beam indices: {meta}')
+
+    log("Determining beam indices.")
     indices = beam_adder_indices(beams, transformedLeft, transformedRight, transformedTop)
+    if len(transformedRight) > len(transformedLeft):
+        log(f'Padding the left adders from {len(transformedLeft)} to {len(transformedRight)} (right_store has LEFT_ADDER_LEN entries)')
+        transformedLeft = pad_left_adders(transformedLeft, transformedRight)
 
     params['NUM_BEAM'] = len(beams)
     params['SAMPLE_STORE_DEPTH'] = maxDepth
@@ -197,14 +206,8 @@ if __name__ == '__main__':
     params['TOP_STORE_DEPTH'] = maxTopDepth
 
     # these are all fixed length
-    params['META0_INDICES'] = meta0
-    params['META1_INDICES'] = meta1    
-    params['META2_INDICES'] = meta2
-    params['META3_INDICES'] = meta3    
-    params['META4_INDICES'] = meta4
-    params['META5_INDICES'] = meta5    
-    params['META6_INDICES'] = meta6
-    params['META7_INDICES'] = meta7
+    for i, meta in enumerate(metas):
+        params[f'META{i}_INDICES'] = meta
 
     # This order doesn't matter, we look up each beam's index later.
     # The BEAM indices do matter thanks to meta indexing
@@ -218,17 +221,45 @@ if __name__ == '__main__':
     params['BEAM_RIGHT_OFFSETS'] = rightOffsets
     params['BEAM_TOP_OFFSETS'] = topOffsets
 
-    with open(args.outfile, 'w') as f:
-        print('`ifndef PUEO_BEAMS_SV')
-        print('`define PUEO_BEAMS_SV')
-        print('')
+    if optimize:
+        import adder_alloc
+        if verbose:
+            adder_alloc.print_summary('process_jjb: current', params, adder_alloc.resources(params))
+        optimized, res = adder_alloc.optimize(beams)
+        if verbose:
+            adder_alloc.print_summary('process_jjb: optimized', optimized, res)
+        params.update(optimized)
+
+    return params
+
+def write_package( params, outfile ):
+    with open(outfile, 'w') as f:
+        print('`ifndef PUEO_BEAMS_SV', file=f)
+        print('`define PUEO_BEAMS_SV', file=f)
+        print('', file=f)
         print('package pueo_beams;', file=f)
-        
+
         for k, v in params.items():
             print(sv_string(k,v, type_name='int'), file=f)
             print('', file=f)
 
         print('endpackage', file=f)
-        print('')
-        print('`endif')
-        
+        print('', file=f)
+        print('`endif', file=f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("infile", help="beam file (pickle or CSV)")
+    parser.add_argument("outfile", help="output SV package")
+    parser.add_argument("--optimize", action="store_true", help="reallocate the adders with adder_alloc")
+    
+    args = parser.parse_args()
+
+    # any of the beam files, not just the jjb pickles
+    import adder_alloc
+    beams = adder_alloc.load_beams(args.infile)
+
+    print(f'process_jjb: loaded {len(beams)} beam(s)')
+
+    params = compile_params(beams, args.optimize)
+    write_package(params, args.outfile)
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+import adder_alloc
+import beam_check
+import process_jjb
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mapping", "evolved_90.pkl")
+
+@pytest.fixture
+def params():
+    return process_jjb.compile_params(adder_alloc.load_beams(SOURCE), verbose=False)
+
+def test_ok(params):
+    assert beam_check.mappable(params)
+    assert beam_check.check_package(params, SOURCE) == []
+
+def test_short_indices(params):
+    params['BEAM_INDICES'] = params['BEAM_INDICES'][:-2]
+    assert not beam_check.mappable(params)
+    problems = beam_check.check_package(params, SOURCE)
+    assert len(problems) == 1 and "BEAM_INDICES" in problems[0]
+
+@pytest.mark.parametrize("side", [0, 1])
+def test_missing_adder(params, side):
+    i = list(params['BEAM_INDICES'][3])
+    i[side] = len(params['LEFT_ADDERS' if side == 0 else 'RIGHT_ADDERS'])
+    params['BEAM_INDICES'][3] = tuple(i)
+    assert not beam_check.mappable(params)
+    problems = beam_check.check_package(params, SOURCE)
+    assert any("doesn't exist" in p and "[3]" in p for p in problems)
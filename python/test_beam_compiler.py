@@ -0,0 +1,24 @@
+import csv
+import glob
+import os
+
+import beam_compiler
+import process_jjb
+
+MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mapping")
+
+def test_directory(tmp_path):
+    summaries = beam_compiler.compile_directory(MAPPING, str(tmp_path), processes=1)
+    assert [ s['file'] for s in summaries ] == sorted(os.path.basename(f) for f in glob.glob(os.path.join(MAPPING, "*.pkl")))
+    assert not any('error' in s for s in summaries)
+    assert len(glob.glob(str(tmp_path / "*.sv"))) == len(summaries)
+
+def test_bad_package(tmp_path, monkeypatch):
+    # without the left adder padding the default packages have more right adders than left
+    monkeypatch.setattr(process_jjb, 'pad_left_adders', lambda left, right : left)
+    summaries = beam_compiler.compile_directory(MAPPING, processes=1)
+    assert all('RIGHT_ADDER_LEN' in s['error'] for s in summaries)
+    beam_compiler.write_summary(summaries, str(tmp_path / "summary.csv"))
+    with open(tmp_path / "summary.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [ r['error'] for r in rows ] == [ s['error'] for s in summaries ]
@@ -0,0 +1,26 @@
+import os
+
+import beam_diff
+import beam_files
+
+INCLUDE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "include")
+
+def load(name, nontop_delay=0):
+    return beam_files.load_beam_map(os.path.join(INCLUDE, name), nontop_delay)
+
+def test_same():
+    for name in ("pueo_beams_09_04_25.sv", "optimized_beams.vh", "L1Beams_header.vh"):
+        diff = beam_diff.diff_maps(load(name), load(name))
+        assert diff['same'] and not diff['adders_removed'] and not diff['adders_added']
+
+def test_nontop_delay():
+    # with the extra clock added back 11/06's taps are 8 later than 09/04's, which is only
+    # a different frame: the one real adder change is left (17,18,20) -> (17,18,19)
+    diff = beam_diff.diff_maps(load("pueo_beams_09_04_25.sv"), load("pueo_beams_11_06_25.sv", 8))
+    assert diff['adders_removed'] == { 'left' : [ (0, 1, 3) ] }
+    assert diff['adders_added'] == { 'left' : [ (0, 1, 2) ] }
+    assert [ c[0] for c in diff['changed'] ] == list(range(21, 28))
+
+def test_adder_shape():
+    assert beam_diff.adder_shape((8, 10, 13)) == beam_diff.adder_shape((0, 2, 5))
+    assert beam_diff.adder_shape(((1, 5), (2, 6), (3, 8))) == ((1, 0), (2, 1), (3, 3))
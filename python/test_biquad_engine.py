@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+import IIRSim
+import biquad_engine
+
+# biquad_engine against the IIRSim reference on random data, through the
+# numba kernel and through the pure Python/numpy fallbacks.
+
+NSAMP = 8
+NCLOCKS = 256
+
+def notch(freq, added_precision=0, q_factor=5):
+    """ (coeffs, a1, a2) as integers, the way generate_coeffs makes them """
+    b, a = signal.iirnotch(freq, q_factor, 3000)
+    pole = signal.tf2zpk(b, a)[1][0]
+    scale = 2**(14+added_precision)
+    coeffs = np.floor(IIRSim.iir_biquad_coeffs(np.abs(pole), np.angle(pole))*scale).astype(np.int64)
+    a1, a2 = np.floor(a[1:]*scale).astype(np.int64)
+    return coeffs, a1, a2
+
+@pytest.fixture(params=['numba', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'numba':
+        if biquad_engine.numba is None:
+            pytest.skip("numba not installed")
+    else:
+        monkeypatch.setattr(biquad_engine, 'numba', None)
+    return request.param
+
+@pytest.mark.parametrize("decimate", [True, False])
+@pytest.mark.parametrize("freq", [150, 400, 1200])
+def test_fixed_point(engine, freq, decimate):
+    rng = np.random.default_rng(freq)
+    x = rng.integers(-2048, 2048, NSAMP*NCLOCKS)
+    coeffs, a1, a2 = notch(freq)
+    ref = IIRSim.iir_biquad_run_fixed_point(x, coeffs, decimate=decimate, a1=a1, a2=a2)
+    out = biquad_engine.iir_biquad_run_fixed_point_fast(x, coeffs, decimate=decimate, a1=a1, a2=a2)
+    assert np.array_equal(out, ref)
+
+@pytest.mark.parametrize("decimate", [True, False])
+@pytest.mark.parametrize("added_precision", [1, 2])
+def test_fixed_point_extended(engine, added_precision, decimate):
+    rng = np.random.default_rng(added_precision)
+    x = rng.integers(-2048, 2048, NSAMP*NCLOCKS)
+    coeffs, a1, a2 = notch(400, added_precision)
+    ref = IIRSim.iir_biquad_run_fixed_point_extended(x, coeffs, decimate=decimate, a1=a1, a2=a2,
+                                                     added_precision=added_precision)
+    out = biquad_engine.iir_biquad_run_fixed_point_fast(x, coeffs, decimate=decimate, a1=a1, a2=a2,
+                                                        added_precision=added_precision)
+    assert np.array_equal(out, ref)
+
+@pytest.mark.parametrize("decimate", [True, False])
+def test_cascade_batch(engine, decimate):
+    # one stage, a different notch on every channel (the gain is too high to cascade random data)
+    rng = np.random.default_rng(3)
+    stages = [ notch(f) for f in (300, 700, 1100) ]
+    x = rng.integers(-2048, 2048, (len(stages), NSAMP*NCLOCKS))
+    coeffs = np.array([ [s[0]] for s in stages ])
+    a1 = np.array([ [s[1]] for s in stages ])
+    a2 = np.array([ [s[2]] for s in stages ])
+    out = biquad_engine.iir_biquad_cascade_batch(x, coeffs, decimate=decimate, a1=a1, a2=a2)
+    for ch, (c, b1, b2) in enumerate(stages):
+        ref = IIRSim.iir_biquad_run_fixed_point(x[ch], c, decimate=decimate, a1=b1, a2=b2)
+        assert np.array_equal(out[ch], ref)
+
+def test_stream(engine):
+    rng = np.random.default_rng(4)
+    x = rng.integers(-2048, 2048, NSAMP*NCLOCKS)
+    coeffs, a1, a2 = notch(900)
+    ref = IIRSim.iir_biquad_run_fixed_point(x, coeffs, decimate=False, a1=a1, a2=a2)
+    s = biquad_engine.BiquadStream(coeffs, decimate=False, a1=a1, a2=a2)
+    cuts = np.sort(rng.choice(np.arange(1, len(x)), 6, replace=False))
+    out = np.concatenate([ s.process(c) for c in np.split(x, cuts) ])
+    assert np.array_equal(out, ref)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import coeff_store
+
+FREQS = [ 300, 305, 310 ]
+QS = [ 5, 8 ]
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    tables = [ (rng.integers(-2**17, 2**17, (len(FREQS), len(QS), coeff_store.nregs_for(spc))), FREQS, QS, spc)
+               for spc in (4, 8) ]
+    filename = str(tmp_path / "coeffs.bin")
+    coeff_store.write_store(filename, tables)
+    return coeff_store.CoeffStore(filename), tables
+
+def test_lookup(store):
+    s, tables = store
+    for table, freqs, qs, spc in tables:
+        for i, f in enumerate(freqs):
+            for j, q in enumerate(qs):
+                assert np.array_equal(s.lookup(f, q, spc), table[i, j])
+                # integral floats are on the grid
+                assert np.array_equal(s.lookup(float(f), np.float64(q), spc), table[i, j])
+
+@pytest.mark.parametrize("key", [ (300.7, 5), (300, 5.5), (299, 5), (300, 5, 8.5) ])
+def test_off_grid(store, key):
+    s, _ = store
+    with pytest.raises(KeyError):
+        s.lookup(*key)
+    assert key not in s
+
+def test_write_fractional(tmp_path):
+    table = np.zeros((2, 1, coeff_store.nregs_for(8)), dtype=np.int64)
+    with pytest.raises(Exception, match="integers"):
+        coeff_store.write_store(str(tmp_path / "coeffs.bin"), [ (table, [ 300.0, 300.5 ], [ 5 ], 8) ])
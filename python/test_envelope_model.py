@@ -0,0 +1,57 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import envelope_model
+
+# The LUT low bit compression against the plain sum (exact for squares), and
+# the plain sum against the envelope written out clock by clock.
+
+NCLOCKS = 64
+
+def squares(rng, shape):
+    # 14 bit squares: |x| <= 127
+    return rng.integers(-127, 128, shape)**2
+
+def direct(sq, last74=0):
+    out = []
+    prev = last74
+    for c in range(sq.shape[-1]//8):
+        s30 = int(sq[8*c:8*c+4].sum())
+        s74 = int(sq[8*c+4:8*c+8].sum())
+        out.append(s30 + max(prev, s74))
+        prev = s74
+    return np.array(out)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_lut_matches_sum(seed):
+    rng = np.random.default_rng(seed)
+    sq = squares(rng, (4, 3, 8*NCLOCKS))
+    env, last = envelope_model.envelope(sq)
+    lenv, llast = envelope_model.envelope(sq, lut=True)
+    assert np.array_equal(lenv, env)
+    assert np.array_equal(llast, last)
+
+def test_lut_low_nibbles():
+    # every combination of square low nibbles (0, 1, 4, 9) across the 4 lanes, with random top bits
+    rng = np.random.default_rng(3)
+    low = np.array(list(itertools.product((0, 1, 4, 9), repeat=4)))
+    sq = (rng.integers(0, 1 << 10, low.shape) << 4) | low
+    assert np.array_equal(envelope_model.lut_half_sums(sq.reshape(-1)), sq.sum(axis=-1))
+
+def test_direct():
+    rng = np.random.default_rng(4)
+    sq = squares(rng, (5, 8*NCLOCKS))
+    env, last = envelope_model.envelope(sq)
+    for k in range(sq.shape[0]):
+        assert np.array_equal(env[k], direct(sq[k]))
+        assert last[k] == sq[k, -4:].sum()
+
+@pytest.mark.parametrize("lut", [False, True])
+def test_stream(lut):
+    rng = np.random.default_rng(5)
+    sq = squares(rng, (2, 8*NCLOCKS))
+    m = envelope_model.EnvelopeModel(lut=lut)
+    out = np.concatenate([ m.run(c) for c in np.split(sq, [8*5, 8*20, 8*21], axis=-1) ], axis=-1)
+    assert np.array_equal(out, envelope_model.envelope(sq)[0])
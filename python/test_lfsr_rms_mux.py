@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import lfsr_rms_mux
+
+# RMSMuxLFSR against a clock by clock simulation of xil_tiny_lfsr_3bit: three
+# SRLs (11 deep, address 10) plus tail_ff, with the feedback taken straight from
+# the HDL.
+
+def srl_sim(nclocks, rst=(), sync=()):
+    srl = np.zeros((3, 11), dtype=np.uint8)
+    tail = np.zeros(3, dtype=np.uint8)
+    out = []
+    for c in range(nclocks):
+        out.append(int(tail[2])*4 + int(tail[1])*2 + int(tail[0]))
+        tap = srl[:, -1].copy()
+        r = c in rst
+        x2 = tail[1] ^ tap[2]
+        x1 = tail[0] ^ tap[1]
+        x0 = tap[2] ^ tap[0]
+        shift_in = np.array([ (not r) and x0, (not r) and x1, (not r) and (c in sync or x2) ], dtype=np.uint8)
+        srl = np.concatenate((shift_in[:, np.newaxis], srl[:, :-1]), axis=1)
+        tail = tap
+    return np.array(out)
+
+def points(rng, n, k):
+    return sorted(set(rng.integers(0, n, k).tolist()))
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_run(seed):
+    rng = np.random.default_rng(seed)
+    n = 3000
+    sync = [3] + points(rng, n, 3)
+    rst = points(rng, n, 3)
+    ref = srl_sim(n, rst, sync)
+    assert np.array_equal(lfsr_rms_mux.RMSMuxLFSR().run(n, rst, sync), ref)
+    # and carried over between runs
+    cut = int(rng.integers(1, n))
+    m = lfsr_rms_mux.RMSMuxLFSR()
+    a = m.run(cut, [c for c in rst if c < cut], [c for c in sync if c < cut])
+    b = m.run(n - cut, [c - cut for c in rst if c >= cut], [c - cut for c in sync if c >= cut])
+    assert np.array_equal(np.concatenate((a, b)), ref)
+
+def test_skip():
+    n = 2500
+    ref = srl_sim(n, sync=[5])
+    m = lfsr_rms_mux.RMSMuxLFSR()
+    m.run(100, sync=[5])
+    m.skip(1000)
+    assert np.array_equal(m.run(n - 1100), ref[1100:])
+
+def test_agc_selects():
+    assert np.array_equal(lfsr_rms_mux.agc_selects(1000, tick_at=7), srl_sim(1000, sync=[8]))
@@ -0,0 +1,33 @@
+import glob
+import os
+
+import pytest
+
+import adder_alloc
+import beam_check
+import process_jjb
+
+# Every beam map in mapping/, compiled the plain way and with --optimize, has to
+# make a package the HDL can build (beam_check.store_problems) and that gives
+# back the beams it came from.
+
+MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mapping")
+PICKLES = sorted(glob.glob(os.path.join(MAPPING, "*.pkl")))
+
+@pytest.mark.parametrize("optimize", [False, True])
+@pytest.mark.parametrize("beamfile", PICKLES, ids=os.path.basename)
+def test_compile(beamfile, optimize, tmp_path):
+    params = process_jjb.compile_params(adder_alloc.load_beams(beamfile), optimize, verbose=False)
+    assert params['RIGHT_ADDER_LEN'] <= params['LEFT_ADDER_LEN']
+    assert beam_check.store_problems(params) == []
+    package = str(tmp_path / "pueo_beams.sv")
+    process_jjb.write_package(params, package)
+    assert beam_check.check_package(package, beamfile) == []
+
+@pytest.mark.parametrize("beamfile", PICKLES, ids=os.path.basename)
+def test_baseline(beamfile):
+    # adder_alloc's "current" numbers are what process_jjb writes
+    params = process_jjb.compile_params(adder_alloc.load_beams(beamfile), verbose=False)
+    base = adder_alloc.baseline(adder_alloc.load_beams(beamfile))
+    for k in ('LEFT_ADDER_LEN', 'RIGHT_ADDER_LEN', 'TOP_ADDER_LEN'):
+        assert base[k] == params[k]
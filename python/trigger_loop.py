@@ -0,0 +1,141 @@
+import argparse
+
+import numpy as np
+
+import trigger_mc
+
+# Model of hdl/L1_trigger_loop.sv, one scaler period per step, for every beam
+# and any number of (target_rate, target_delta) settings at once.
+#
+# What the loop does in LOOP_RUN, per iteration:
+#   COUNT_START          start a scaler period (the thresholds are already applied)
+#   COUNT_WAIT           wait for trig_count_done
+#   COUNT_READ           per beam, read the scaler count c at 0x0400 + 4*beam and
+#                          c < target + COUNT_MARGIN : threshold += delta
+#                          c > target + COUNT_MARGIN : threshold -= delta
+#                        (18 bit registers, no clipping, so they wrap)
+#   THRESHOLD_WRITE/APPLY/UPDATE  push all of them to the trigger
+# and after a reset every threshold starts at STARTTHRESH. The Wishbone
+# traffic is a few microseconds against a period of ~1 s, so it's not modeled.
+#
+# Note the direction: the loop as written *raises* the threshold when the count
+# is low. The older L1_trigger_wrapper.sv raises it when the count is high,
+# which is what converges when the trigger fires on envelope >= threshold.
+# direction=1 is L1_trigger_loop.sv as it is, direction=-1 the other way.
+#
+# The counts come from a rate vs. threshold curve per beam (trigger_mc, or a
+# threshold scan recorded on hardware), Poisson distributed and saturating at
+# the 12 bit scaler maximum, or from any function of the current thresholds.
+# The scalers count trigger rising edges, the Monte Carlo curves count clocks
+# over threshold: the same thing once triggers are rare.
+
+STARTTHRESH = 4500
+THRESH_BITS = 18
+COUNT_MARGIN = 2
+SCALER_MAX = 4095
+PERIOD = 1.0
+
+def loop_step(thresholds, counts, target_rate, target_delta, margin=COUNT_MARGIN, direction=1):
+    """ One COUNT_READ pass. thresholds/counts are (..., nbeams), target_rate/target_delta
+    broadcast against them (e.g. (nconfigs, 1)).
+    """
+    limit = np.asarray(target_rate, dtype=np.int64) + margin
+    step = np.asarray(target_delta, dtype=np.int64)*direction
+    change = np.where(counts < limit, step, np.where(counts > limit, -step, 0))
+    return (thresholds + change) & ((1 << THRESH_BITS) - 1)
+
+def curve_counts(rate_curve, period=PERIOD, rng=None, saturate=SCALER_MAX):
+    """ counts(thresholds) function from a (nbeams, nthresholds) rate curve in Hz.
+    Thresholds past the end of the curve count 0. rng=None gives the expected counts.
+    """
+    rate_curve = np.asarray(rate_curve, dtype=np.float64)
+    ncurve = rate_curve.shape[1]
+    beams = np.arange(rate_curve.shape[0])
+    def counts(thresholds):
+        inside = thresholds < ncurve
+        mean = np.where(inside, rate_curve[beams, np.minimum(thresholds, ncurve-1)], 0.0)*period
+        c = rng.poisson(mean) if rng is not None else np.rint(mean)
+        return np.minimum(c, saturate).astype(np.int64)
+    return counts
+
+def run(counts, target_rate, target_delta, nbeams, niter, start=STARTTHRESH, margin=COUNT_MARGIN, direction=1):
+    """ Runs the loop niter periods from reset. counts(thresholds) gives the scaler counts
+    for (nconfigs, nbeams) thresholds. target_rate/target_delta are (nconfigs,).
+    Returns (thresholds, counts), each (niter, nconfigs, nbeams): the thresholds during
+    each period and what the scalers counted.
+    """
+    target_rate = np.atleast_1d(np.asarray(target_rate, dtype=np.int64))
+    target_delta = np.atleast_1d(np.asarray(target_delta, dtype=np.int64))
+    target_rate, target_delta = np.broadcast_arrays(target_rate, target_delta)
+    ncfg = len(target_rate)
+    thr = np.full((ncfg, nbeams), start, dtype=np.int64)
+    thr_hist = np.zeros((niter, ncfg, nbeams), dtype=np.int32)
+    count_hist = np.zeros((niter, ncfg, nbeams), dtype=np.int32)
+    for k in range(niter):
+        c = counts(thr)
+        thr_hist[k] = thr
+        count_hist[k] = c
+        thr = loop_step(thr, c, target_rate[:, np.newaxis], target_delta[:, np.newaxis], margin, direction)
+    return thr_hist, count_hist
+
+def convergence(counts, target_rate, tolerance=0.2):
+    """ Per config and beam, from run()'s counts:
+      settle     : first period after which the count stays within tolerance*target of the
+                   target (niter if it never does)
+      overshoot  : largest |count - target|/target after the count first crosses the target
+                   (0 if it never crosses)
+      settled    : fraction of beams settled per config
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    niter = counts.shape[0]
+    target = np.asarray(target_rate, dtype=np.float64).reshape(1, -1, 1)
+    err = counts - target
+    ok = np.abs(err) <= tolerance*np.maximum(target, 1)
+    # last period that was out of tolerance
+    bad_rev = (~ok)[::-1]
+    last_bad = np.where(bad_rev.any(axis=0), niter - 1 - np.argmax(bad_rev, axis=0), -1)
+    settle = np.where(ok[-1], last_bad + 1, niter)
+    side = np.sign(err)
+    crossed = np.cumsum(np.abs(np.diff(side, axis=0)) > 0, axis=0) > 0
+    after = np.concatenate((np.zeros_like(crossed[:1]), crossed), axis=0)
+    overshoot = np.max(np.where(after, np.abs(err), 0), axis=0)/np.maximum(target[0], 1)
+    return { 'settle' : settle,
+             'overshoot' : overshoot,
+             'settled' : (settle < niter).mean(axis=1) }
+
+def sweep(rate_curve, target_rates, target_deltas, niter, period=PERIOD, seed=None, margin=COUNT_MARGIN,
+          direction=1, tolerance=0.2):
+    """ Every combination of target_rates x target_deltas. Returns (configs (n, 2), metrics)
+    with the convergence() metrics per config and beam.
+    """
+    tr, td = np.meshgrid(np.asarray(target_rates), np.asarray(target_deltas), indexing='ij')
+    configs = np.stack((tr.ravel(), td.ravel()), axis=1).astype(np.int64)
+    rng = np.random.default_rng(seed) if seed is not None else None
+    counts = curve_counts(rate_curve, period, rng)
+    _, c = run(counts, configs[:, 0], configs[:, 1], np.shape(rate_curve)[0], niter,
+               margin=margin, direction=direction)
+    return configs, convergence(c, configs[:, 0], tolerance)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep the L1_trigger_loop servo settings against a rate curve.")
+    parser.add_argument("histogram", help="trigger_mc --save output (.npz)")
+    parser.add_argument("--rates", type=float, nargs=3, default=[100, 2000, 100], metavar=("MIN", "MAX", "STEP"), help="target rates (counts per period)")
+    parser.add_argument("--deltas", type=float, nargs=3, default=[1, 100, 1], metavar=("MIN", "MAX", "STEP"))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--period", type=float, default=PERIOD, help="scaler period (s)")
+    parser.add_argument("--seed", type=int, default=None, help="Poisson counts with this seed (default: expected counts)")
+    parser.add_argument("--margin", type=int, default=COUNT_MARGIN)
+    parser.add_argument("--reverse", action="store_true", help="Lower the threshold on low counts (direction -1)")
+    args = parser.parse_args()
+
+    saved = np.load(args.histogram)
+    curve, _ = trigger_mc.rate_curves(saved['hist'], int(saved['nclocks']))
+    rates = np.arange(args.rates[0], args.rates[1] + args.rates[2]/2, args.rates[2])
+    deltas = np.arange(args.deltas[0], args.deltas[1] + args.deltas[2]/2, args.deltas[2])
+    configs, m = sweep(curve, rates, deltas, args.iterations, args.period, args.seed, args.margin,
+                       -1 if args.reverse else 1)
+    worst = m['settle'].max(axis=1)
+    print(f'trigger_loop: {len(configs)} settings, {np.mean(m["settled"] == 1)*100:.1f}% with every beam settled in {args.iterations} periods')
+    for i in np.argsort(worst + m['overshoot'].max(axis=1)/1e3)[:10]:
+        print(f'target {configs[i, 0]} delta {configs[i, 1]}: settles in {worst[i]} periods, '
+              f'overshoot {m["overshoot"][i].max()*100:.0f}%')
@@ -0,0 +1,145 @@
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import signal
+
+import agc_model
+import beam_files
+from beamform_model import BeamformModel, envelope_histogram, rates_from_histogram, CLOCK_RATE, SAMPLE_RATE, ENVELOPE_BITS
+
+# Monte Carlo trigger rates for a beam map, to pick the starting thresholds for
+# L1_trigger_loop instead of waiting for the servo to walk them in from the top.
+#
+# Thermal noise on 8 channels (gaussian, optionally band limited with an FIR
+# over the trigger band), as 12 bit ADC counts with sigma = 8*agc_rms, through
+# the AGC at unity scale (agc_model, bit exact): that's sigma = agc_rms 5 bit
+# LSBs (saturate_and_scale's default is 0.25 sigma, agc_rms=4), with the AGC's
+# round-to-odd bins and saturation at +/-15.5 LSBs. That goes through
+# BeamformModel (every beam of the package, bit exact) and only the per-beam
+# envelope histogram is kept, so memory doesn't grow with the number of clocks.
+# Seeds run in parallel, each with its own independent noise stream, and their
+# histograms just add up.
+
+BAND = (300e6, 1200e6)
+FIR_TAPS = 63
+AGC_RMS = 4.0
+CHUNK_CLOCKS = 65536
+NCHAN = 8
+# ADC counts per 5 bit LSB at unity scale
+COUNTS_PER_LSB = 1 << (agc_model.LSB - agc_model.Q_OFFSET - agc_model.Q_SCALE)
+DAT_LIMIT = 1 << (agc_model.DAT_BITS - 1)
+
+def bandpass_taps(band=BAND, ntaps=FIR_TAPS, sample_rate=SAMPLE_RATE):
+    """ FIR for the noise, normalized so white noise comes out with unit variance """
+    taps = signal.firwin(ntaps, band, pass_zero=False, fs=sample_rate)
+    return taps/np.sqrt(np.sum(taps**2))
+
+def quantize(x, agc_rms=AGC_RMS):
+    """ Unit-sigma (nch, n) samples -> 5 bit offset binary codes (code k is k-15.5 LSBs), via 12 bit
+    ADC counts and the AGC at unity scale
+    """
+    dat = np.clip(np.rint(x*agc_rms*COUNTS_PER_LSB), -DAT_LIMIT, DAT_LIMIT-1).astype(np.int64)
+    return agc_model.agc_samples(dat, agc_model.UNITY_SCALE)['out'].astype(np.int64)
+
+def noise_chunks(seed, nclocks, chunk_clocks=CHUNK_CLOCKS, agc_rms=AGC_RMS, taps=None):
+    """ Generator of (8, 8*n) 5 bit noise chunks, nclocks in total. The FIR state carries
+    over between chunks so the noise is one continuous stream.
+    """
+    rng = np.random.default_rng(seed)
+    zi = None
+    if taps is not None:
+        # start the filter settled
+        zi = signal.lfilter(taps, 1.0, rng.standard_normal((NCHAN, len(taps))), axis=1,
+                            zi=np.zeros((NCHAN, len(taps)-1)))[1]
+    done = 0
+    while done < nclocks:
+        n = min(chunk_clocks, nclocks - done)
+        x = rng.standard_normal((NCHAN, 8*n))
+        if taps is not None:
+            x, zi = signal.lfilter(taps, 1.0, x, axis=1, zi=zi)
+        yield quantize(x, agc_rms)
+        done += n
+
+def _trim(hist):
+    """ Drops the empty top of a histogram (they're 2**17 bins wide and mostly zero) """
+    nz = np.flatnonzero(hist.any(axis=0))
+    return hist[:, :(nz[-1]+1 if len(nz) else 1)]
+
+def _run_seed(args):
+    params, seed, nclocks, chunk_clocks, agc_rms, taps, skewed_top = args
+    model = BeamformModel(params, skewed_top)
+    hist = None
+    for x in noise_chunks(seed, nclocks, chunk_clocks, agc_rms, taps):
+        hist = envelope_histogram(model.envelopes(x), hist)
+    return _trim(hist)
+
+def simulate(params, nclocks, nseeds=1, seed=0, agc_rms=AGC_RMS, band=BAND, chunk_clocks=CHUNK_CLOCKS,
+             skewed_top=False, processes=None):
+    """ Runs nseeds independent noise streams of nclocks each through the beams.
+    band=None is white noise. processes=1 runs serially, None uses all the cores.
+    Returns (hist, total clocks), hist trimmed to the highest envelope seen.
+    """
+    taps = bandpass_taps(band) if band is not None else None
+    seeds = np.random.SeedSequence(seed).spawn(nseeds)
+    jobs = [ (params, s, nclocks, chunk_clocks, agc_rms, taps, skewed_top) for s in seeds ]
+    if processes == 1 or nseeds == 1:
+        hists = list(map(_run_seed, jobs))
+    else:
+        with Pool(min(processes or os.cpu_count() or 1, nseeds)) as pool:
+            hists = pool.map(_run_seed, jobs)
+    width = max(h.shape[1] for h in hists)
+    hist = np.zeros((hists[0].shape[0], width), dtype=np.int64)
+    for h in hists:
+        hist[:, :h.shape[1]] += h
+    return hist, nclocks*nseeds
+
+def rate_curves(hist, nclocks, thresholds=None, clock_rate=CLOCK_RATE):
+    """ (rates, errors) per beam at each threshold, errors being the Poisson 1 sigma.
+    Thresholds past the top of the histogram read 0.
+    """
+    full = np.zeros((hist.shape[0], 1 << ENVELOPE_BITS), dtype=np.int64)
+    full[:, :hist.shape[1]] = hist
+    rates = rates_from_histogram(full, thresholds, clock_rate)
+    counts = rates * nclocks / clock_rate
+    return rates, np.sqrt(counts) * clock_rate / nclocks
+
+def initial_thresholds(hist, nclocks, target_rate, clock_rate=CLOCK_RATE):
+    """ Lowest threshold per beam whose rate is at or below target_rate. If the simulation
+    didn't run long enough to see target_rate, that's the top of the histogram (flagged
+    by the second return value).
+    """
+    rates, _ = rate_curves(hist, nclocks, np.arange(hist.shape[1]+1), clock_rate)
+    ok = rates <= target_rate
+    thr = np.argmax(ok, axis=1)
+    # the noise floor of the estimate: one count
+    resolved = target_rate >= clock_rate / nclocks
+    return thr, resolved
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monte Carlo trigger rate vs. threshold for a beam map.")
+    parser.add_argument("package", help="pueo_beams package (.sv)")
+    parser.add_argument("--clocks", type=int, default=1 << 20, help="Clocks per seed")
+    parser.add_argument("--seeds", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--agc-rms", type=float, default=AGC_RMS, help="Noise sigma in 5 bit LSBs")
+    parser.add_argument("--white", action="store_true", help="Don't band limit the noise")
+    parser.add_argument("--skewed-top", action="store_true")
+    parser.add_argument("--target-rate", type=float, default=None, help="Print the threshold per beam for this rate (Hz)")
+    parser.add_argument("--save", default=None, help="Save the histogram (.npz)")
+    args = parser.parse_args()
+
+    params = beam_files.parse_file(args.package)
+    hist, nclocks = simulate(params, args.clocks, args.seeds, args.seed, args.agc_rms,
+                             None if args.white else BAND, skewed_top=args.skewed_top, processes=args.processes)
+    print(f'trigger_mc: {nclocks} clocks ({nclocks/CLOCK_RATE*1e3:.2f} ms), rates resolved down to {CLOCK_RATE/nclocks:.0f} Hz')
+    if args.target_rate is not None:
+        thr, resolved = initial_thresholds(hist, nclocks, args.target_rate)
+        if not resolved:
+            print(f'trigger_mc: not enough clocks to see {args.target_rate} Hz, thresholds are lower bounds')
+        for b, t in enumerate(thr):
+            print(f'beam {b}: {t}')
+    if args.save is not None:
+        np.savez(args.save, hist=hist, nclocks=nclocks)
@@ -0,0 +1,146 @@
+import numpy as np
+
+import coeff_table
+import fixed_point as fxp
+
+# Turns biquad coefficients into the Wishbone writes that program them.
+# See mapping/Wishbone_Register_Map.txt:
+#
+#   0x6000 - 0x7FFF : Biquads
+#      Channel index mask is 0x1C00 (bits [12:10])
+#      Biquad (0/1) selection mask is 0x80 (bit [7])
+#
+# Every register past the control register is a cascade: the values are all
+# written to the same address, one after the other, in a fixed (and sometimes
+# unusual) order. The register-ordered vectors from coeff_table / coeff_store
+# are already in write order, so each cascade is just a slice of them.
+#
+# NOTE: the register map says a'_1 goes first at 0x0C, but the coefficient files
+# generate_coeffs*.py produce (which is what gets loaded) have a'_2 first. We
+# follow the files.
+
+BIQUAD_BASE = 0x6000
+CHAN_SHIFT = 10
+CHAN_MASK = 0x1C00
+BIQUAD_BIT = 0x80
+CONTROL = 0x00
+
+def cascades(samp_per_clock=8):
+    """ (register offset, names in write order) for each coefficient cascade """
+    names = coeff_table.register_names(samp_per_clock)
+    lengths = [ (0x04, 2),                   # B, A
+                (0x08, 4),                   # C2, C3, C1, C0
+                (0x0C, 2),                   # a2', a1'
+                (0x10, 1+samp_per_clock-2),  # D_FF, X6 .. X1
+                (0x14, 1+samp_per_clock-1),  # E_GG, X7 .. X1
+                (0x18, 1),                   # D_FG
+                (0x1C, 1) ]                  # E_GF
+    out = []
+    pos = 0
+    for reg, n in lengths:
+        out.append((reg, names[pos:pos+n]))
+        pos += n
+    return out
+
+def biquad_address(channel, biquad, reg, base=BIQUAD_BASE):
+    """ Full address of register <reg> for biquad 0/1 of channel 0-7 """
+    if channel < 0 or channel > 7:
+        raise Exception("Channel %d out of range"%channel)
+    if biquad not in (0, 1):
+        raise Exception("Biquad must be 0 or 1, got %s"%biquad)
+    return base | ((channel << CHAN_SHIFT) & CHAN_MASK) | (BIQUAD_BIT if biquad else 0) | reg
+
+def cascade_writes(vector, channel, biquad, cascade, samp_per_clock=8, base=BIQUAD_BASE):
+    """ Writes for a single cascade (index into cascades()) of one biquad """
+    reg, names = cascades(samp_per_clock)[cascade]
+    start = sum(len(c[1]) for c in cascades(samp_per_clock)[:cascade])
+    addr = biquad_address(channel, biquad, reg, base)
+    vals = fxp.to_unsigned(np.asarray(vector, dtype=np.int64)[start:start+len(names)], 32)
+    return [ (addr, int(v)) for v in vals ]
+
+def biquad_writes(vector, channel, biquad, samp_per_clock=8, base=BIQUAD_BASE, update=None):
+    """ All the writes to program one biquad from a register-ordered vector.
+    update is the value to write to the control register afterwards (None = don't).
+    """
+    writes = []
+    for i in range(len(cascades(samp_per_clock))):
+        writes += cascade_writes(vector, channel, biquad, i, samp_per_clock, base)
+    if update is not None:
+        writes.append((biquad_address(channel, biquad, CONTROL, base), update))
+    return writes
+
+def vector_from_coeffs(coeffs, b, a, samp_per_clock=8):
+    """ Register-ordered vector from an iir_biquad_coeffs result and the notch b/a (all floats) """
+    return coeff_table.register_order(coeff_table.to_fixed(b), coeff_table.to_fixed(a),
+                                      coeff_table.to_fixed(coeffs), samp_per_clock)
+
+def writes_from_coeffs(coeffs, b, a, channel, biquad, samp_per_clock=8, base=BIQUAD_BASE, update=None):
+    return biquad_writes(vector_from_coeffs(coeffs, b, a, samp_per_clock), channel, biquad,
+                         samp_per_clock, base, update)
+
+def burst_writes(vectors, samp_per_clock=8, base=BIQUAD_BASE, update=None):
+    """ Coalesces the writes for many biquads into one burst.
+    vectors maps (channel, biquad) -> register-ordered vector. The burst is in address
+    order (channel, then biquad, then register), and every cascade stays contiguous.
+    Returns an (nwrites, 2) uint32 array of (address, value), ready for a bulk transfer.
+    """
+    writes = []
+    for key in sorted(vectors):
+        writes += biquad_writes(vectors[key], key[0], key[1], samp_per_clock, base, update)
+    return np.array(writes, dtype=np.uint32).reshape(-1, 2)
+
+def bursts(writes):
+    """ Groups consecutive writes to the same address: [(address, [values ...]), ...].
+    Handy for interfaces that do repeated writes to one address in a single call.
+    """
+    out = []
+    for addr, val in writes:
+        addr = int(addr)
+        if out and out[-1][0] == addr:
+            out[-1][1].append(int(val))
+        else:
+            out.append((addr, [int(val)]))
+    return out
+
+def changed_cascades(current, target, samp_per_clock=8):
+    """ Indices (into cascades()) of the cascades whose values differ. current=None means
+    we don't know what's loaded, so everything changed.
+    """
+    if current is None:
+        return list(range(len(cascades(samp_per_clock))))
+    current = np.asarray(current, dtype=np.int64)
+    target = np.asarray(target, dtype=np.int64)
+    out = []
+    pos = 0
+    for i, (reg, names) in enumerate(cascades(samp_per_clock)):
+        n = len(names)
+        if not np.array_equal(current[pos:pos+n], target[pos:pos+n]):
+            out.append(i)
+        pos += n
+    return out
+
+def plan_retune(current, target, samp_per_clock=8, base=BIQUAD_BASE, update=None):
+    """ Writes needed to go from the currently loaded coefficients to the target ones.
+    current/target map (channel, biquad) -> register-ordered vector. Biquads missing
+    from current are written in full. A cascade has to be rewritten as a whole, so any
+    change in it means the whole cascade goes out; untouched cascades are skipped, as
+    are biquads that don't change at all (including their control write).
+    Returns (writes, stats): writes is the same (n, 2) uint32 array as burst_writes,
+    stats has the write counts for the plan and for a full reprogram.
+    """
+    writes = []
+    full = 0
+    ncascades = 0
+    for key in sorted(target):
+        changed = changed_cascades(current.get(key), target[key], samp_per_clock)
+        full += len(biquad_writes(target[key], key[0], key[1], samp_per_clock, base, update))
+        for i in changed:
+            writes += cascade_writes(target[key], key[0], key[1], i, samp_per_clock, base)
+        if changed and update is not None:
+            writes.append((biquad_address(key[0], key[1], CONTROL, base), update))
+        ncascades += len(changed)
+    stats = { 'writes' : len(writes),
+              'full_writes' : full,
+              'saved' : full - len(writes),
+              'cascades' : ncascades }
+    return np.array(writes, dtype=np.uint32).reshape(-1, 2), stats